@@ -1,15 +1,32 @@
-from flask import Flask, send_from_directory, request, jsonify, g, session
+from flask import Flask, send_from_directory, request, jsonify, g, session, has_request_context, stream_with_context
 import os
+import base64
+import hashlib
+import math
 import re
 import traceback
-import hashlib
 import secrets
+import sys
 import json
+import inspect
+import functools
+import threading
+import time
+import atexit
+import io
+import cProfile
+import pstats
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Reads its cost settings from the environment, so import after load_dotenv()
+import password_hashing
+
 # Supabase client (required)
 try:
     from supabase import create_client
@@ -73,26 +90,452 @@ def after_request(response):
         response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
 
+# ============================================================
+# METRICS
+# ============================================================
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_CALLS_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+QUANTILES = (0.5, 0.95, 0.99)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + (list(extra) if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + '}'
+
+class MetricsRegistry:
+    """In-process counters, histograms and summaries rendered as Prometheus text.
+
+    Summaries compute p50/p95/p99 over the most recent reservoir_size
+    observations per label set.
+    """
+
+    def __init__(self, reservoir_size=1024):
+        self.reservoir_size = reservoir_size
+        self._lock = threading.Lock()
+        self._meta = OrderedDict()
+        self._counters = {}
+        self._histograms = {}
+        self._summaries = {}
+
+    def describe(self, name, metric_type, help_text, buckets=None):
+        self._meta[name] = (metric_type, help_text, buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric_type, _, buckets = self._meta[name]
+        with self._lock:
+            if metric_type == 'histogram':
+                state = self._histograms.get(key)
+                if state is None:
+                    state = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+                for i, bound in enumerate(buckets):
+                    if value <= bound:
+                        state[0][i] += 1
+                state[1] += value
+                state[2] += 1
+            else:
+                state = self._summaries.get(key)
+                if state is None:
+                    state = self._summaries[key] = [deque(maxlen=self.reservoir_size), 0.0, 0]
+                state[0].append(value)
+                state[1] += value
+                state[2] += 1
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: (list(v[0]), v[1], v[2]) for k, v in self._histograms.items()}
+            summaries = {k: (sorted(v[0]), v[1], v[2]) for k, v in self._summaries.items()}
+
+        lines = []
+        for name, (metric_type, help_text, buckets) in self._meta.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            if metric_type == 'counter' or metric_type == 'gauge':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+            elif metric_type == 'histogram':
+                for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, bucket_count in zip(buckets, counts):
+                        lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {bucket_count}')
+                    lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {count}')
+            elif metric_type == 'summary':
+                for (metric, labels), (samples, total, count) in sorted(summaries.items()):
+                    if metric != name:
+                        continue
+                    for q in QUANTILES:
+                        value = samples[min(len(samples) - 1, int(q * len(samples)))] if samples else 0
+                        lines.append(f'{name}{_format_labels(labels, [("quantile", q)])} {value}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+metrics.describe('http_requests_total', 'counter', 'HTTP requests handled, by route, method and status.')
+metrics.describe('http_request_duration_seconds', 'histogram', 'HTTP request latency.', LATENCY_BUCKETS)
+metrics.describe('http_request_latency_seconds', 'summary', 'HTTP request latency quantiles over recent requests.')
+metrics.describe('http_response_bytes_total', 'counter', 'Response body bytes sent.')
+metrics.describe('http_request_db_calls', 'histogram', 'Supabase calls made per HTTP request.', DB_CALLS_BUCKETS)
+metrics.describe('db_calls_total', 'counter', 'Supabase calls, by route, operation and table.')
+metrics.describe('db_call_seconds_total', 'counter', 'Cumulative time spent in Supabase calls.')
+metrics.describe('db_call_errors_total', 'counter', 'Supabase calls that raised.')
+
+def _metrics_route():
+    if not has_request_context():
+        return 'background'
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def instrument_db_call(operation):
+    """Count, time and trace an sb_* helper, attributing it to the current route"""
+    def decorator(f):
+        signature = inspect.signature(f)
+
+        @functools.wraps(f)
+        def wrapper(table, *args, **kwargs):
+            started = time.perf_counter()
+            result = None
+            failed = False
+            try:
+                result = f(table, *args, **kwargs)
+                return result
+            except Exception:
+                failed = True
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                route = _metrics_route()
+                metrics.inc('db_calls_total', route=route, op=operation, table=table)
+                metrics.inc('db_call_seconds_total', elapsed, route=route, op=operation, table=table)
+                if failed:
+                    metrics.inc('db_call_errors_total', route=route, op=operation, table=table)
+                if has_request_context():
+                    g.db_calls = g.get('db_calls', 0) + 1
+                record_db_span(operation, table, signature, (table,) + args, kwargs, result, elapsed, failed)
+        return wrapper
+    return decorator
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.db_calls = 0
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = _metrics_route()
+    metrics.inc('http_requests_total', route=route, method=request.method, status=response.status_code)
+    metrics.observe('http_request_duration_seconds', elapsed, route=route, method=request.method)
+    metrics.observe('http_request_latency_seconds', elapsed, route=route, method=request.method)
+    metrics.observe('http_request_db_calls', g.get('db_calls', 0), route=route, method=request.method)
+    size = response.calculate_content_length()
+    if size is not None:
+        metrics.inc('http_response_bytes_total', size, route=route, method=request.method)
+    return response
+
+# ============================================================
+# TRACING
+# ============================================================
+
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', 'true').lower() == 'true'
+TRACE_RING_SIZE = int(os.environ.get('TRACE_RING_SIZE', 500))
+TRACE_LOG_FILE = os.environ.get('TRACE_LOG_FILE')
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 250))
+REDACTED_FILTER_KEYS = ('token', 'password', 'hash', 'code', 'secret')
+
+recent_traces = deque(maxlen=TRACE_RING_SIZE)
+slow_queries = deque(maxlen=TRACE_RING_SIZE)
+trace_log_lock = threading.Lock()
+metrics.describe('db_slow_queries_total', 'counter', 'Supabase calls slower than SLOW_QUERY_MS.')
+
+def _describe_filter_value(key, value):
+    if any(part in key for part in REDACTED_FILTER_KEYS):
+        return '***'
+    if isinstance(value, tuple):
+        return [value[0], _describe_filter_value(key, value[1])]
+    if isinstance(value, list):
+        return value if len(value) <= 10 else f'[{len(value)} values]'
+    if isinstance(value, str) and len(value) > 100:
+        return value[:100] + '...'
+    return value
+
+def _span_filters(arguments):
+    filters = arguments.get('filters') or {}
+    if not filters and arguments.get('match_value') is not None:
+        filters = {arguments.get('match_column') or 'id': arguments['match_value']}
+    if not filters and arguments.get('params'):
+        filters = arguments['params']
+    described = {k: _describe_filter_value(k, v) for k, v in filters.items()}
+    if arguments.get('or_filters'):
+        described['or'] = {k: _describe_filter_value(k, v) for k, v in arguments['or_filters'].items()}
+    return described
+
+def _db_call_site():
+    """First frame outside the data layer, as 'function:line'"""
+    frame = sys._getframe(3)
+    while frame is not None:
+        name = frame.f_code.co_name
+        if name != 'wrapper' and not name.startswith('sb_') and name != 'record_db_span':
+            return f"{name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return 'unknown'
+
+def record_db_span(operation, table, signature, args, kwargs, result, elapsed, failed):
+    """Attach a span to the current trace and log the call if it was slow"""
+    duration_ms = elapsed * 1000
+    in_request = has_request_context()
+    trace = g.get('trace') if in_request else None
+    is_slow = duration_ms >= SLOW_QUERY_MS
+    if trace is None and not is_slow:
+        return
+
+    arguments = signature.bind(*args, **kwargs).arguments
+    span = {
+        'op': operation,
+        'table': table,
+        'filters': _span_filters(arguments),
+        'rows': len(result) if isinstance(result, list) else (None if result is None else 1),
+        'duration_ms': round(duration_ms, 2),
+        'call_site': _db_call_site(),
+        'error': failed
+    }
+    if trace is not None:
+        trace['spans'].append(span)
+    if is_slow:
+        span = dict(span, trace_id=trace['trace_id'] if trace else None,
+                    route=_metrics_route(), at=datetime.now(timezone.utc).isoformat())
+        slow_queries.append(span)
+        metrics.inc('db_slow_queries_total', route=span['route'], op=operation, table=table)
+        print(f"🐢 Slow query {span['duration_ms']}ms: {operation} {table} {span['filters']} "
+              f"at {span['call_site']} (trace {span['trace_id']})")
+
+@app.before_request
+def start_trace():
+    if not TRACE_ENABLED:
+        return
+    g.trace = {
+        'trace_id': secrets.token_hex(8),
+        'method': request.method,
+        'path': request.path,
+        'route': _metrics_route(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'spans': []
+    }
+
+@app.after_request
+def finish_trace(response):
+    trace = g.pop('trace', None)
+    if trace is None:
+        return response
+    trace['status'] = response.status_code
+    started = g.get('request_started') or time.perf_counter()
+    trace['duration_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    trace['db_calls'] = len(trace['spans'])
+    trace['db_ms'] = round(sum(span['duration_ms'] for span in trace['spans']), 2)
+    recent_traces.append(trace)
+    response.headers['X-Trace-Id'] = trace['trace_id']
+    if TRACE_LOG_FILE:
+        try:
+            with trace_log_lock, open(TRACE_LOG_FILE, 'a') as f:
+                f.write(json.dumps(trace, default=str) + '\n')
+        except Exception as e:
+            print(f"Failed to write trace log: {str(e)}")
+    return response
+
+# ============================================================
+# PROFILING
+# ============================================================
+
+PROFILER_MAX_REQUESTS = int(os.environ.get('PROFILER_MAX_REQUESTS', 100))
+PROFILER_MAX_SAMPLE_SECONDS = float(os.environ.get('PROFILER_MAX_SAMPLE_SECONDS', 30))
+
+# Leaf functions of threads that are blocked rather than burning CPU
+IDLE_FRAMES = ('wait', 'select', 'poll', 'accept', 'sleep', 'readinto', 'recv_into', '_wait_for_tstate_lock')
+
+# route -> {'remaining', 'profiled', 'stats', 'armed_at'}; empty unless an admin armed a route,
+# so the per-request cost when profiling is off is one dict lookup
+profiled_routes = {}
+profiler_lock = threading.Lock()
+
+@app.before_request
+def start_request_profile():
+    if not profiled_routes:
+        return
+    route = _metrics_route()
+    with profiler_lock:
+        target = profiled_routes.get(route)
+        if not target or target['remaining'] <= 0:
+            return
+        target['remaining'] -= 1
+    profiler = cProfile.Profile()
+    g.profiler = (route, profiler)
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active on this thread
+        g.pop('profiler', None)
+
+@app.teardown_request
+def finish_request_profile(exc):
+    if not has_request_context() or 'profiler' not in g:
+        return
+    route, profiler = g.pop('profiler')
+    profiler.disable()
+    with profiler_lock:
+        target = profiled_routes.get(route)
+        if target is None:
+            return
+        if target['stats'] is None:
+            target['stats'] = pstats.Stats(profiler)
+        else:
+            target['stats'].add(profiler)
+        target['profiled'] += 1
+
+def format_pstats(stats, sort='cumulative', limit=50):
+    """Render pstats output as text, trimmed to the top entries"""
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def sample_stacks(seconds, interval=0.01, include_idle=False):
+    """Sample every other thread's stack for a while and return collapsed stack counts"""
+    own_thread = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    counts = {}
+    samples = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if not include_idle and stack and stack[0].split(' ', 1)[0] in IDLE_FRAMES:
+                continue
+            stack.append(names.get(thread_id, f'thread-{thread_id}'))
+            key = ';'.join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+        samples += 1
+        time.sleep(interval)
+    return counts, samples
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of the in-process metrics"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'error': 'Metrics token required'}), 401
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Enhanced Supabase helper functions
-def sb_select(table, select='*', filters=None, order=None, limit=None, joins=None):
-    """Enhanced select with joins support"""
+def apply_filters(query, filters):
+    """Apply a filters dict to a PostgREST query.
+
+    Plain values match with eq, lists with in_, and (operator, value) tuples
+    call the named operator, e.g. {'expires_at': ('lt', now)}. A 'not_.'
+    prefix negates it: {'completed_at': ('not_.is_', 'null')}. A list of
+    tuples applies each: {'timestamp': [('gte', start), ('lt', end)]}.
+    """
+    for k, v in filters.items():
+        if isinstance(v, tuple):
+            conditions = [v]
+        elif isinstance(v, list) and v and all(isinstance(c, tuple) for c in v):
+            conditions = v
+        elif isinstance(v, list):
+            query = query.in_(k, v)
+            continue
+        else:
+            query = query.eq(k, v)
+            continue
+        for op, value in conditions:
+            if op.startswith('not_.'):
+                query = getattr(query.not_, op[len('not_.'):])(k, value)
+            else:
+                query = getattr(query, op)(k, value)
+    return query
+
+def quote_filter_value(value):
+    """Quote a value for a PostgREST logic filter so commas, dots and parens stay literal"""
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    text = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{text}"'
+
+def format_or_filters(or_filters):
+    """Build a PostgREST or=() expression from a filters-style dict.
+
+    An 'and' key groups a nested dict whose conditions must all hold:
+    {'timestamp': ('lt', ts), 'and': {'timestamp': ts, 'id': ('lt', last_id)}}
+    It may also hold a list of such dicts, and an 'or' key inside one nests
+    an any-of group, so (A or B) and C becomes {'and': [{'or': {A, B}, C}]}.
+    """
+    conditions = []
+    for k, v in or_filters.items():
+        if k in ('and', 'or') and isinstance(v, (dict, list)):
+            for group in (v if isinstance(v, list) else [v]):
+                conditions.append(f'{k}({format_or_filters(group)})')
+        elif isinstance(v, tuple):
+            op, value = v
+            conditions.append(f'{k}.{op}.{quote_filter_value(value)}')
+        elif isinstance(v, list):
+            conditions.append(f"{k}.in.({','.join(quote_filter_value(item) for item in v)})")
+        else:
+            conditions.append(f'{k}.eq.{quote_filter_value(v)}')
+    return ','.join(conditions)
+
+@instrument_db_call('select')
+def sb_select(table, select='*', filters=None, order=None, limit=None, joins=None, or_filters=None, offset=None):
+    """Enhanced select with joins support.
+
+    or_filters matches rows where any of its conditions hold, in addition
+    to every condition in filters. order takes one or more comma-separated
+    columns, each prefixed with '-' for descending: '-timestamp,-id'.
+    """
     try:
         query = supabase.table(table).select(select)
         
         if filters:
-            for k, v in filters.items():
-                if isinstance(v, list):
-                    query = query.in_(k, v)
-                else:
-                    query = query.eq(k, v)
+            query = apply_filters(query, filters)
+
+        if or_filters:
+            query = query.or_(format_or_filters(or_filters))
         
         if order:
-            desc = order.startswith('-')
-            column = order.lstrip('-')
-            query = query.order(column, desc=desc)
+            for term in order.split(','):
+                term = term.strip()
+                query = query.order(term.lstrip('-'), desc=term.startswith('-'))
         
         if limit:
             query = query.limit(limit)
+
+        if offset:
+            query = query.offset(offset)
             
         response = query.execute()
         return response.data if response.data else []
@@ -100,6 +543,7 @@ def sb_select(table, select='*', filters=None, order=None, limit=None, joins=Non
         print(f"Supabase select error: {str(e)}")
         raise Exception(f"Database query failed: {str(e)}")
 
+@instrument_db_call('insert')
 def sb_insert(table, row):
     """Insert a row into Supabase table"""
     try:
@@ -109,14 +553,26 @@ def sb_insert(table, row):
         print(f"Supabase insert error: {str(e)}")
         raise Exception(f"Database insert failed: {str(e)}")
 
+@instrument_db_call('upsert')
+def sb_upsert(table, rows, on_conflict=None, ignore_duplicates=False):
+    """Insert rows, updating (or with ignore_duplicates, skipping) rows that hit on_conflict"""
+    try:
+        response = supabase.table(table).upsert(
+            rows, on_conflict=on_conflict or '', ignore_duplicates=ignore_duplicates
+        ).execute()
+        return response.data if response.data else []
+    except Exception as e:
+        print(f"Supabase upsert error: {str(e)}")
+        raise Exception(f"Database upsert failed: {str(e)}")
+
+@instrument_db_call('update')
 def sb_update(table, row, match_column='id', match_value=None, filters=None):
     """Update rows in Supabase table"""
     try:
         query = supabase.table(table).update(row)
         
         if filters:
-            for k, v in filters.items():
-                query = query.eq(k, v)
+            query = apply_filters(query, filters)
         elif match_column and match_value is not None:
             query = query.eq(match_column, match_value)
         
@@ -126,14 +582,14 @@ def sb_update(table, row, match_column='id', match_value=None, filters=None):
         print(f"Supabase update error: {str(e)}")
         raise Exception(f"Database update failed: {str(e)}")
 
+@instrument_db_call('delete')
 def sb_delete(table, match_column='id', match_value=None, filters=None):
     """Delete rows from Supabase table"""
     try:
         query = supabase.table(table).delete()
         
         if filters:
-            for k, v in filters.items():
-                query = query.eq(k, v)
+            query = apply_filters(query, filters)
         elif match_column and match_value is not None:
             query = query.eq(match_column, match_value)
         
@@ -143,6 +599,7 @@ def sb_delete(table, match_column='id', match_value=None, filters=None):
         print(f"Supabase delete error: {str(e)}")
         raise Exception(f"Database delete failed: {str(e)}")
 
+@instrument_db_call('rpc')
 def sb_rpc(function_name, params=None):
     """Execute a Supabase RPC function"""
     try:
@@ -152,6 +609,129 @@ def sb_rpc(function_name, params=None):
         print(f"Supabase RPC error: {str(e)}")
         raise Exception(f"Database function call failed: {str(e)}")
 
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+# ============================================================
+# IDEMPOTENCY
+# ============================================================
+
+IDEMPOTENCY_ENABLED = os.environ.get('IDEMPOTENCY_ENABLED', 'true').lower() == 'true'
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 86400))
+IDEMPOTENCY_PENDING_TTL_SECONDS = 60
+IDEMPOTENCY_MAX_BODY_BYTES = int(os.environ.get('IDEMPOTENCY_MAX_BODY_BYTES', 65536))
+IDEMPOTENT_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+# Login responses carry fresh session tokens, which shouldn't sit in memory
+IDEMPOTENCY_EXCLUDED_PREFIXES = ('/api/auth/', '/api/admin/auth/')
+# Statuses a retry should be allowed to change
+IDEMPOTENCY_UNCACHED_STATUSES = (429,)
+
+idempotency_store = TTLCache(maxsize=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000)),
+                             ttl=IDEMPOTENCY_TTL_SECONDS)
+idempotency_lock = threading.Lock()
+metrics.describe('idempotency_requests_total', 'counter', 'Write requests carrying an Idempotency-Key, by result.')
+
+def _idempotency_cache_key(key):
+    """Scope a client's key to the endpoint and caller so keys can't collide across users"""
+    caller = (request.headers.get('Authorization') or request.headers.get('X-User-ID')
+              or session.get('user_id') or _client_ip())
+    caller_digest = hashlib.sha256(str(caller).encode()).hexdigest()[:16]
+    return (key, request.method, request.path, caller_digest)
+
+@app.before_request
+def replay_idempotent_request():
+    """Answer a retried write from the stored response, without touching the database"""
+    if not IDEMPOTENCY_ENABLED or request.method not in IDEMPOTENT_METHODS:
+        return
+    key = request.headers.get('Idempotency-Key')
+    if not key or request.path.startswith(IDEMPOTENCY_EXCLUDED_PREFIXES):
+        return
+    if len(key) > 255:
+        return jsonify({'error': 'Idempotency-Key must be at most 255 characters'}), 400
+
+    cache_key = _idempotency_cache_key(key)
+    fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+    with idempotency_lock:
+        entry = idempotency_store.get(cache_key)
+        if entry is None:
+            idempotency_store.set(cache_key, {'state': 'pending', 'fingerprint': fingerprint},
+                                  ttl=IDEMPOTENCY_PENDING_TTL_SECONDS)
+            g.idempotency_cache_key = cache_key
+            g.idempotency_fingerprint = fingerprint
+            metrics.inc('idempotency_requests_total', result='miss')
+            return
+
+    if entry['fingerprint'] != fingerprint:
+        metrics.inc('idempotency_requests_total', result='mismatch')
+        return jsonify({'error': 'Idempotency-Key was already used with a different request body'}), 422
+    if entry['state'] == 'pending':
+        metrics.inc('idempotency_requests_total', result='in_progress')
+        response = jsonify({'error': 'A request with this Idempotency-Key is still in progress'})
+        response.headers['Retry-After'] = '1'
+        return response, 409
+
+    metrics.inc('idempotency_requests_total', result='hit')
+    response = app.response_class(entry['body'], status=entry['status'], mimetype=entry['mimetype'])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+@app.after_request
+def store_idempotent_response(response):
+    cache_key = g.pop('idempotency_cache_key', None)
+    if cache_key is None:
+        return response
+    size = response.calculate_content_length()
+    if (response.status_code >= 500 or response.status_code in IDEMPOTENCY_UNCACHED_STATUSES
+            or response.is_streamed or size is None or size > IDEMPOTENCY_MAX_BODY_BYTES):
+        # Let the client retry for real
+        idempotency_store.pop(cache_key)
+        return response
+    idempotency_store.set(cache_key, {
+        'state': 'done',
+        'fingerprint': g.pop('idempotency_fingerprint', None),
+        'status': response.status_code,
+        'body': response.get_data(),
+        'mimetype': response.mimetype
+    })
+    return response
+
 def create_admin_user():
     """Create default admin user in Supabase if none exists"""
     try:
@@ -243,6 +823,12 @@ def init_supabase():
         # Create admin user if needed
         create_admin_user()
         create_teacher_user()
+
+        # Load room metadata once up front; later refreshes happen in the background
+        room_registry.refresh()
+        print(f"✅ Room registry loaded from {room_registry.source} ({len(room_registry.rooms)} rooms)")
+        achievement_catalog.refresh()
+        print(f"✅ Achievement catalog loaded ({len(achievement_catalog)} definitions, version {achievement_catalog.version})")
         
         return True
     except Exception as e:
@@ -252,38 +838,299 @@ def init_supabase():
 
 def hash_password(password):
     """Hash a password for storing"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    return password_hashing.hash_password(password)
 
 def verify_password(password, hashed):
-    """Verify a password against its hash"""
-    return hashlib.sha256(password.encode()).hexdigest() == hashed
+    """Verify a password against its hash, returning (matches, needs_rehash)"""
+    return password_hashing.verify_password(password, hashed)
 
 def generate_session_token():
     """Generate a secure session token"""
     return secrets.token_urlsafe(32)
 
+LOGIN_USER_COLUMNS = 'id, name, email, role, password_hash, is_active, total_score, current_streak'
+LOOKUP_USER_COLUMNS = 'id, name, email, role, total_score, current_streak'
+
+def find_user_by_identifier(identifier, select='*', extra_filters=None):
+    """Find a user by email or name in one round trip, preferring the email match"""
+    if 'email' not in select and select != '*':
+        select = f'{select}, email'
+    rows = sb_select('users', select=select, filters=extra_filters,
+                     or_filters={'email': identifier, 'name': identifier}, limit=2)
+    for row in rows:
+        if row.get('email') == identifier:
+            return row
+    return rows[0] if rows else None
+
+# Built-in room metadata, in display order. The room registry below serves
+# rows from the learning_rooms table and falls back to these entries when
+# the table is unreachable or a row predates the code_name/aliases columns.
+ROOM_METADATA = MappingProxyType({
+    'flowchart': MappingProxyType({
+        'display_name': 'FLOWBYTE', 'icon': 'bi-diagram-3', 'color': '#005FFB',
+        'description': 'Flowchart Logic', 'aliases': ('flowbyte',)
+    }),
+    'networking': MappingProxyType({
+        'display_name': 'NETXUS', 'icon': 'bi-hdd-network', 'color': '#00A949',
+        'description': 'Network Engineering', 'aliases': ('netxus',)
+    }),
+    'ai-training': MappingProxyType({
+        'display_name': 'AITRIX', 'icon': 'bi-robot', 'color': '#E08300',
+        'description': 'AI & Machine Learning', 'aliases': ('aitrix',)
+    }),
+    'database': MappingProxyType({
+        'display_name': 'SCHEMAX', 'icon': 'bi-database', 'color': '#FF3600',
+        'description': 'Database Management', 'aliases': ('schemax',)
+    }),
+    'programming': MappingProxyType({
+        'display_name': 'CODEVANCE', 'icon': 'bi-code-slash', 'color': '#FF006D',
+        'description': 'Advanced Programming', 'aliases': ('codevance',)
+    })
+})
+
+ROOM_REGISTRY_TTL_SECONDS = int(os.environ.get('ROOM_REGISTRY_TTL_SECONDS', 600))
+
+def _room_entry(room_name, display_name, description, icon, color, aliases, max_score=100, sort_order=0):
+    return MappingProxyType({
+        'room_name': room_name,
+        'display_name': display_name,
+        'description': description,
+        'icon': icon,
+        'color': color,
+        'aliases': tuple(aliases),
+        'max_score': max_score,
+        'sort_order': sort_order
+    })
+
+class RoomRegistry:
+    """Rooms keyed by canonical name, with O(1) alias resolution.
+
+    Loaded from learning_rooms and refreshed in the background once the
+    snapshot is older than ttl seconds. A snapshot is an immutable
+    (rooms, aliases) pair replaced in one assignment, so readers never
+    need a lock.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.loaded_at = 0
+        self.source = 'defaults'
+        self._refresh_lock = threading.Lock()
+        self._snapshot = self._build(self._default_rows())
+
+    @staticmethod
+    def _default_rows():
+        rows = []
+        for index, (name, meta) in enumerate(ROOM_METADATA.items()):
+            rows.append(_room_entry(name, meta['display_name'], meta['description'], meta['icon'],
+                                    meta['color'], meta['aliases'], sort_order=index))
+        return rows
+
+    @staticmethod
+    def _from_db_row(row):
+        # learning_rooms.display_name holds the room title ("Flowchart Logic"),
+        # which the API has always returned as 'description'; the upper-case
+        # brand name shown in the UI lives in code_name.
+        name = row['room_name']
+        default = ROOM_METADATA.get(name, {})
+        aliases = row.get('aliases')
+        if isinstance(aliases, str):
+            aliases = json.loads(aliases)
+        return _room_entry(
+            name,
+            row.get('code_name') or default.get('display_name') or name.upper(),
+            row.get('display_name') or default.get('description', ''),
+            row.get('icon') or default.get('icon'),
+            row.get('color_theme') or default.get('color'),
+            aliases if aliases is not None else default.get('aliases', ()),
+            max_score=row.get('max_score') or 100,
+            sort_order=row.get('sort_order') or 0
+        )
+
+    @staticmethod
+    def _build(entries):
+        alias_owner = {}
+        for entry in entries:
+            for alias in entry['aliases']:
+                alias_owner.setdefault(alias, entry['room_name'])
+        rooms = OrderedDict()
+        for entry in sorted(entries, key=lambda e: e['sort_order']):
+            # A row named like another room's alias (e.g. a legacy 'netxus' row) is not a room
+            if alias_owner.get(entry['room_name'], entry['room_name']) != entry['room_name']:
+                continue
+            rooms[entry['room_name']] = entry
+        aliases = {alias: owner for alias, owner in alias_owner.items() if owner in rooms}
+        aliases.update({name: name for name in rooms})
+        return MappingProxyType(rooms), MappingProxyType(aliases)
+
+    def refresh(self):
+        """Reload rooms from learning_rooms; keeps the current snapshot on failure"""
+        try:
+            rows = sb_select('learning_rooms', filters={'is_active': True}, order='sort_order')
+            if rows:
+                self._snapshot = self._build([self._from_db_row(r) for r in rows])
+                self.source = 'learning_rooms'
+            self.loaded_at = time.time()
+            return True
+        except Exception as e:
+            self.loaded_at = time.time()
+            print(f"Room registry refresh failed, keeping {self.source}: {str(e)}")
+            return False
+
+    def _refresh_if_stale(self):
+        if time.time() - self.loaded_at < self.ttl:
+            return
+        if self._refresh_lock.acquire(blocking=False):
+            def run():
+                try:
+                    self.refresh()
+                finally:
+                    self._refresh_lock.release()
+            threading.Thread(target=run, name='room-registry-refresh', daemon=True).start()
+
+    @property
+    def rooms(self):
+        """Canonical name -> room entry, in display order"""
+        self._refresh_if_stale()
+        return self._snapshot[0]
+
+    def get(self, room_name):
+        return self.rooms.get(room_name)
+
+    def resolve(self, name):
+        """Canonical room name for a canonical name or alias, else None"""
+        self._refresh_if_stale()
+        return self._snapshot[1].get(name)
+
+room_registry = RoomRegistry(ttl=ROOM_REGISTRY_TTL_SECONDS)
+
 def normalize_room_name(room_name):
     """Normalize room names between frontend and backend"""
-    room_name_map = {
-        'flowbyte': 'flowchart',
-        'netxus': 'networking', 
-        'aitrix': 'ai-training',
-        'schemax': 'database',
-        'codevance': 'programming'
-    }
-    
-    normalized = room_name_map.get(room_name, room_name)
-    
-    # Validate against known room names
-    valid_room_names = ['flowchart', 'networking', 'ai-training', 'database', 'programming']
-    if normalized not in valid_room_names:
-        print(f"⚠️ Warning: Unknown room name '{room_name}' normalized to '{normalized}'")
-    
+    normalized = room_registry.resolve(room_name)
+    if normalized is None:
+        print(f"⚠️ Warning: Unknown room name '{room_name}'")
+        return room_name
     return normalized
 
 
+# ============================================================
+# RATE LIMITING
+# ============================================================
+
+def _parse_rate(value):
+    """'capacity/seconds' -> (capacity, seconds)"""
+    capacity, seconds = value.split('/')
+    return int(capacity), float(seconds)
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+# Classrooms often share one public IP, so the per-IP login budget is generous
+# and the per-username budget is what stops guessing against one account
+RATE_LIMIT_LOGIN_IP = _parse_rate(os.environ.get('RATE_LIMIT_LOGIN_IP', '60/60'))
+RATE_LIMIT_LOGIN_USER = _parse_rate(os.environ.get('RATE_LIMIT_LOGIN_USER', '10/300'))
+RATE_LIMIT_WRITE_IP = _parse_rate(os.environ.get('RATE_LIMIT_WRITE_IP', '30/60'))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+TRUST_PROXY_HEADERS = os.environ.get(
+    'TRUST_PROXY_HEADERS', 'true' if os.environ.get('VERCEL') else 'false').lower() == 'true'
+
+metrics.describe('rate_limited_total', 'counter', 'Requests rejected by a rate limiter.')
+
+def _client_ip():
+    """Client address, taken from X-Forwarded-For only behind a trusted proxy"""
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get('X-Forwarded-For', '')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.remote_addr or 'unknown'
+
+class TokenBucketLimiter:
+    """Token buckets keyed by string, refilled lazily when checked.
+
+    Buckets live in an OrderedDict in last-touched order, so buckets that
+    have been idle long enough to refill completely sit at the front and
+    are evicted there without scanning the rest.
+    """
+
+    def __init__(self, capacity, period_seconds, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.capacity = capacity
+        self.rate = capacity / period_seconds
+        self.max_keys = max_keys
+        self._refill_seconds = period_seconds
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def consume(self, key, cost=1):
+        """Take cost tokens; returns 0 if allowed, else seconds until it would be"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._evict(now)
+        return 0 if allowed else (cost - tokens) / self.rate
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def _evict(self, now):
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < self._refill_seconds and len(self._buckets) <= self.max_keys:
+                break
+            self._buckets.popitem(last=False)
+
+    def __len__(self):
+        return len(self._buckets)
+
+rate_limiters = {}
+
+def rate_limit(name, per_ip=RATE_LIMIT_WRITE_IP, per_identity=None, identity_field=None):
+    """Reject requests over budget with 429 before the view touches the database.
+
+    per_ip and per_identity are (capacity, seconds). identity_field names
+    the JSON body field (e.g. 'username') whose value gets its own bucket;
+    a successful response clears that bucket so typos don't lock out the
+    real owner.
+    """
+    ip_limiter = TokenBucketLimiter(*per_ip) if per_ip else None
+    identity_limiter = TokenBucketLimiter(*per_identity) if per_identity and identity_field else None
+    rate_limiters[name] = (ip_limiter, identity_limiter)
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED:
+                return f(*args, **kwargs)
+            identity = None
+            if identity_limiter is not None:
+                data = request.get_json(silent=True) or {}
+                identity = str(data.get(identity_field) or '').strip().lower() or None
+            checks = [('ip', ip_limiter, _client_ip())] if ip_limiter is not None else []
+            if identity:
+                checks.append(('identity', identity_limiter, identity))
+            for key_type, limiter, key in checks:
+                retry_after = limiter.consume(key)
+                if retry_after:
+                    metrics.inc('rate_limited_total', limiter=name, key=key_type)
+                    response = jsonify({'error': 'Too many requests, please try again later',
+                                        'retry_after': math.ceil(retry_after)})
+                    response.headers['Retry-After'] = str(math.ceil(retry_after))
+                    return response, 429
+
+            response = app.make_response(f(*args, **kwargs))
+            if identity and response.status_code < 400:
+                identity_limiter.reset(identity)
+            return response
+        return wrapper
+    return decorator
+
+
 # Authentication endpoints
 @app.route('/api/auth/register', methods=['POST'])
+@rate_limit('register')
 def register_user():
     """Direct user registration without email verification"""
     try:
@@ -394,6 +1241,7 @@ def resend_verification_code():
         return jsonify({'error': f'Failed to resend code: {str(e)}'}), 500
 
 @app.route('/api/auth/login', methods=['POST'])
+@rate_limit('login', per_ip=RATE_LIMIT_LOGIN_IP, per_identity=RATE_LIMIT_LOGIN_USER, identity_field='username')
 def login_user():
     try:
         data = request.get_json()
@@ -410,13 +1258,8 @@ def login_user():
         if not password:
             return jsonify({'error': 'Password is required'}), 400
         
-        # Try to find by email or name
-        users_by_email = sb_select('users', filters={'email': username})
-        user_row = users_by_email[0] if users_by_email else None
-        
-        if not user_row:
-            users_by_name = sb_select('users', filters={'name': username})
-            user_row = users_by_name[0] if users_by_name else None
+        # Find by email or name
+        user_row = find_user_by_identifier(username, select=LOGIN_USER_COLUMNS)
 
         if not user_row:
             return jsonify({'error': 'User not found'}), 404
@@ -436,15 +1279,19 @@ def login_user():
         if not user_row.get('password_hash'):
             return jsonify({'error': 'Invalid credentials'}), 401
 
-        if not verify_password(password, user_row.get('password_hash')):
+        password_ok, needs_rehash = verify_password(password, user_row.get('password_hash'))
+        if not password_ok:
             return jsonify({'error': 'Invalid credentials'}), 401
 
         # Check if user is active
         if not user_row.get('is_active', True):
             return jsonify({'error': 'Account is disabled'}), 401
 
-        # Update last_login
-        sb_update('users', {'last_login': datetime.now().isoformat()}, match_column='id', match_value=user_row['id'])
+        # Update last_login, upgrading legacy or lower-cost hashes in the same write
+        login_updates = {'last_login': datetime.now().isoformat()}
+        if needs_rehash:
+            login_updates['password_hash'] = hash_password(password)
+        sb_update('users', login_updates, match_column='id', match_value=user_row['id'])
 
         # Create user session for tracking
         session_token = generate_session_token()
@@ -453,7 +1300,7 @@ def login_user():
         session_data = {
             'user_id': user_row['id'],
             'session_token': session_token,
-            'ip_address': request.environ.get('REMOTE_ADDR', 'unknown'),
+            'ip_address': _client_ip(),
             'user_agent': request.headers.get('User-Agent', 'unknown'),
             'expires_at': expires_at.isoformat(),
             'created_at': datetime.now().isoformat()
@@ -486,6 +1333,7 @@ def get_users():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/users', methods=['POST'])
+@rate_limit('create_user')
 def create_user():
     try:
         data = request.get_json()
@@ -562,6 +1410,7 @@ def update_user(user_id):
                 
         if update_data:
             sb_update('users', update_data, match_column='id', match_value=user_id)
+            progress_summaries.pop(user_id)
             
         return jsonify({'message': 'User updated successfully'})
     except Exception as e:
@@ -575,7 +1424,11 @@ def delete_user(user_id):
         if not users:
             return jsonify({'error': 'User not found'}), 404
             
+        progress_buffer.discard(user_id)
         sb_delete('users', match_column='id', match_value=user_id)
+        progress_summaries.pop(user_id)
+        earned_achievements_cache.pop(user_id)
+        earned_achievement_ids.pop(user_id)
         return jsonify({'message': 'User deleted successfully'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -626,6 +1479,7 @@ def update_user_profile(user_id):
                 
         if update_data:
             sb_update('users', update_data, match_column='id', match_value=user_id)
+            progress_summaries.pop(user_id)
             
         # Return updated user data
         updated_users = sb_select('users', filters={'id': user_id})
@@ -651,6 +1505,7 @@ def update_user_profile(user_id):
         }), 500
 
 @app.route('/api/users/<int:user_id>/password', methods=['PUT'])
+@rate_limit('change_password')
 def change_user_password(user_id):
     try:
         data = request.get_json()
@@ -674,7 +1529,7 @@ def change_user_password(user_id):
         user = users[0]
         
         # Verify current password
-        if not verify_password(current_password, user.get('password_hash', '')):
+        if not verify_password(current_password, user.get('password_hash', ''))[0]:
             return jsonify({'error': 'Current password is incorrect'}), 401
             
         # Validate new password strength
@@ -719,6 +1574,7 @@ def test_api():
     })
 
 @app.route('/api/user/lookup', methods=['POST'])
+@rate_limit('user_lookup')
 def lookup_user():
     """Lookup user data by username to recover missing user ID."""
     try:
@@ -728,13 +1584,8 @@ def lookup_user():
         
         username = data.get('username').strip()
         
-        # Try to find by email or name
-        users_by_email = sb_select('users', filters={'email': username})
-        user_row = users_by_email[0] if users_by_email else None
-        
-        if not user_row:
-            users_by_name = sb_select('users', filters={'name': username})
-            user_row = users_by_name[0] if users_by_name else None
+        # Find by email or name
+        user_row = find_user_by_identifier(username, select=LOOKUP_USER_COLUMNS)
 
         if not user_row:
             return jsonify({'error': 'User not found'}), 404
@@ -814,18 +1665,11 @@ def get_user_progress(user_id):
         progress = sb_select('user_progress', filters={'user_id': user_id}, order='-last_accessed')
         
         # Normalize the response and enrich with room display names
-        room_display_names = {
-            'flowchart': 'FLOWBYTE',
-            'networking': 'NETXUS',
-            'ai-training': 'AITRIX',
-            'database': 'SCHEMAX',
-            'programming': 'CODEVANCE'
-        }
-        
         for p in progress:
             room_name = p.get('room_name', 'Unknown')
-            p['display_name'] = room_display_names.get(room_name, room_name.upper())
-            p['max_score'] = 100
+            room = room_registry.get(room_name)
+            p['display_name'] = room['display_name'] if room else room_name.upper()
+            p['max_score'] = room['max_score'] if room else 100
             p['room_type'] = room_name
             
         return jsonify(progress), 200
@@ -835,260 +1679,723 @@ def get_user_progress(user_id):
         print(traceback.format_exc())
         return jsonify({'error': f'Failed to get user progress: {str(e)}'}), 500
 
-@app.route('/api/users/<int:user_id>/progress', methods=['POST'])
-def update_user_progress(user_id):
+# ============================================================
+# ACHIEVEMENT CATALOG
+# ============================================================
+
+ACHIEVEMENT_CATALOG_TTL_SECONDS = int(os.environ.get('ACHIEVEMENT_CATALOG_TTL_SECONDS', 600))
+
+class AchievementCatalog:
+    """Achievement definitions keyed by achievement_key.
+
+    Same refresh model as RoomRegistry: an immutable snapshot replaced in
+    one assignment and reloaded in the background once older than ttl.
+    version increases whenever the loaded definitions change, so derived
+    state (the rule index) knows when to rebuild.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.loaded_at = 0
+        self.version = 0
+        self._fingerprint = None
+        self._refresh_lock = threading.Lock()
+        self._snapshot = MappingProxyType({})
+
+    def refresh(self):
+        """Reload every definition; keeps the current snapshot on failure"""
+        try:
+            rows = sb_select('achievements')
+        except Exception as e:
+            self.loaded_at = time.time()
+            print(f"Achievement catalog refresh failed, keeping version {self.version}: {str(e)}")
+            return False
+        self._replace({row['achievement_key']: MappingProxyType(row) for row in rows})
+        self.loaded_at = time.time()
+        return True
+
+    def _replace(self, definitions):
+        fingerprint = hashlib.sha256(
+            json.dumps([dict(definitions[k]) for k in sorted(definitions)], sort_keys=True, default=str).encode()
+        ).hexdigest()
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self._snapshot = MappingProxyType(definitions)
+            self.version += 1
+
+    def add(self, row):
+        """Publish a definition created by this process without waiting for a refresh"""
+        with self._refresh_lock:
+            definitions = dict(self._snapshot)
+            definitions[row['achievement_key']] = MappingProxyType(row)
+            self._replace(definitions)
+
+    def invalidate(self):
+        """Drop the snapshot's freshness and reload it now"""
+        with self._refresh_lock:
+            self.loaded_at = 0
+            return self.refresh()
+
+    def _ensure_loaded(self):
+        if not self.loaded_at:
+            # Nothing to serve yet, so the first caller loads synchronously
+            with self._refresh_lock:
+                if not self.loaded_at:
+                    self.refresh()
+        elif time.time() - self.loaded_at >= self.ttl and self._refresh_lock.acquire(blocking=False):
+            def run():
+                try:
+                    self.refresh()
+                finally:
+                    self._refresh_lock.release()
+            threading.Thread(target=run, name='achievement-catalog-refresh', daemon=True).start()
+
+    @property
+    def definitions(self):
+        """achievement_key -> definition row"""
+        self._ensure_loaded()
+        return self._snapshot
+
+    def get(self, achievement_key):
+        return self.definitions.get(achievement_key)
+
+    def __len__(self):
+        return len(self._snapshot)
+
+achievement_catalog = AchievementCatalog(ttl=ACHIEVEMENT_CATALOG_TTL_SECONDS)
+
+# ============================================================
+# ACHIEVEMENT RULES
+# ============================================================
+
+# Achievements are awarded server-side from progress writes. Each active
+# catalog definition compiles to at most one rule, taken from
+# its requirements JSON, e.g. {"trigger": "room_level", "room": "aitrix",
+# "level": 2}, or else from the key naming conventions below. Rows that
+# match neither (speed runs, perfect scores) are still awarded by clients.
+ACHIEVEMENT_KEY_PATTERNS = (
+    (re.compile(r'^(?P<room>[a-z]+)_level_(?P<threshold>\d+)$'), 'room_level'),
+    (re.compile(r'^(?P<room>[a-z]+)_room_complete$'), 'room_complete'),
+)
+ACHIEVEMENT_KEY_RULES = {
+    'first_room': ('rooms_completed', 1),
+    'all_rooms': ('rooms_completed', None),  # None means every room in the registry
+    'weekly_streak': ('streak', 7),
+}
+ROOM_TRIGGERS = ('room_level', 'room_complete')
+USER_TRIGGERS = ('rooms_completed', 'streak', 'total_score')
+REQUIREMENT_THRESHOLDS = {'room_level': 'level', 'rooms_completed': 'count', 'streak': 'days', 'total_score': 'min'}
+# Triggers that work without a threshold: rooms_completed then means every room
+OPTIONAL_THRESHOLD_TRIGGERS = ('room_complete', 'rooms_completed')
+_skipped_achievement_keys = set()
+
+metrics.describe('achievements_awarded_total', 'counter', 'Achievements awarded by the rule engine, by trigger.')
+
+def compile_achievement_rule(row):
+    """Turn an achievements row into {'id', 'key', 'trigger', 'room', 'threshold'}, or None"""
+    key = row.get('achievement_key') or ''
+    requirements = row.get('requirements')
+    if isinstance(requirements, str):
+        try:
+            requirements = json.loads(requirements)
+        except ValueError:
+            requirements = None
+
+    trigger, room, threshold = None, None, None
+    if isinstance(requirements, dict) and requirements.get('trigger'):
+        trigger = requirements['trigger']
+        room = requirements.get('room')
+        threshold = requirements.get(REQUIREMENT_THRESHOLDS.get(trigger, ''), None)
+    elif key in ACHIEVEMENT_KEY_RULES:
+        trigger, threshold = ACHIEVEMENT_KEY_RULES[key]
+    else:
+        for pattern, pattern_trigger in ACHIEVEMENT_KEY_PATTERNS:
+            match = pattern.match(key)
+            if match:
+                trigger = pattern_trigger
+                room = match.group('room')
+                threshold = match.groupdict().get('threshold')
+                break
+
+    if trigger not in ROOM_TRIGGERS + USER_TRIGGERS:
+        return None
+    if trigger in ROOM_TRIGGERS:
+        room = room_registry.resolve(room) if room else None
+        if room is None:
+            return None
     try:
-        data = request.get_json()
-        if not data or not data.get('room_name'):
-            return jsonify({'error': 'Room name is required'}), 400
+        threshold = int(threshold) if threshold is not None else None
+    except (TypeError, ValueError):
+        return None
+    if threshold is None and trigger not in OPTIONAL_THRESHOLD_TRIGGERS:
+        # A rule without one would break evaluate() for every other rule
+        if key not in _skipped_achievement_keys:
+            _skipped_achievement_keys.add(key)
+            print(f"⚠️ Skipping achievement rule {key}: {trigger} needs a threshold")
+        return None
+    return {'id': row['id'], 'key': key, 'trigger': trigger, 'room': room, 'threshold': threshold}
 
-        # Check if user exists
+class AchievementRuleEngine:
+    """Compiled achievement rules indexed by trigger (and by room for room triggers).
+
+    Rebuilt from the achievement catalog whenever its version changes;
+    evaluate() only looks at the rules for the room that was written plus
+    the user-level triggers.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._index = None
+        self._version = None
+        self._lock = threading.Lock()
+        self.rule_count = 0
+
+    def _build(self, definitions):
+        index = {trigger: {} for trigger in ROOM_TRIGGERS}
+        index.update({trigger: [] for trigger in USER_TRIGGERS})
+        count = 0
+        for row in definitions.values():
+            rule = compile_achievement_rule(row) if row.get('is_active', True) else None
+            if rule is None:
+                continue
+            if rule['trigger'] in ROOM_TRIGGERS:
+                index[rule['trigger']].setdefault(rule['room'], []).append(rule)
+            else:
+                index[rule['trigger']].append(rule)
+            count += 1
+        self.rule_count = count
+        return index
+
+    def _current_index(self):
+        self.catalog.definitions  # loads or schedules a refresh
+        if self._version != self.catalog.version:
+            with self._lock:
+                version = self.catalog.version
+                if self._version != version:
+                    self._index = self._build(self.catalog.definitions)
+                    self._version = version
+        return self._index
+
+    def evaluate(self, progress_row, all_progress, user_stats):
+        """Rules satisfied after one progress write"""
+        index = self._current_index()
+        if not index:
+            return []
+        room_name = progress_row.get('room_name')
+        completed = bool(progress_row.get('completed'))
+        satisfied = []
+        for rule in index['room_level'].get(room_name, ()):
+            if completed or (progress_row.get('progress_percentage') or 0) >= rule['threshold'] * 20:
+                satisfied.append(rule)
+        if completed:
+            satisfied.extend(index['room_complete'].get(room_name, ()))
+            completed_rooms = sum(1 for p in all_progress if p.get('completed'))
+            for rule in index['rooms_completed']:
+                if completed_rooms >= (rule['threshold'] or len(room_registry.rooms)):
+                    satisfied.append(rule)
+        for rule in index['streak']:
+            if (user_stats.get('current_streak') or 0) >= rule['threshold']:
+                satisfied.append(rule)
+        for rule in index['total_score']:
+            if (user_stats.get('total_score') or 0) >= rule['threshold']:
+                satisfied.append(rule)
+        return satisfied
+
+achievement_rules = AchievementRuleEngine(achievement_catalog)
+# Achievement ids each user is known to hold, so satisfied rules aren't re-sent on every write
+earned_achievement_ids = TTLCache(maxsize=5000, ttl=3600)
+# Rows from user_earned_achievements, as served by /api/achievements/user
+EARNED_ACHIEVEMENTS_CACHE_TTL_SECONDS = int(os.environ.get('EARNED_ACHIEVEMENTS_CACHE_TTL_SECONDS', 300))
+earned_achievements_cache = TTLCache(maxsize=5000, ttl=EARNED_ACHIEVEMENTS_CACHE_TTL_SECONDS)
+
+def note_awards(user_ids, achievement_id=None):
+    """Keep the per-user achievement caches in step with a badge or achievement write"""
+    for user_id in user_ids:
+        earned_achievements_cache.pop(int(user_id))
+        if achievement_id is not None:
+            held = earned_achievement_ids.get(int(user_id))
+            if held is not None:
+                earned_achievement_ids.set(int(user_id), held | {achievement_id})
+
+def award_rule_achievements(user_id, rules):
+    """Insert not-yet-held achievements in one upsert; returns the keys that were new"""
+    known = earned_achievement_ids.get(user_id) or frozenset()
+    candidates = {rule['id']: rule for rule in rules if rule['id'] not in known}
+    if not candidates:
+        return []
+    now = datetime.now().isoformat()
+    rows = [{
+        'user_id': user_id,
+        'achievement_id': rule['id'],
+        'earned_at': now,
+        'progress_data': {'trigger': rule['trigger'], 'room_name': rule['room']}
+    } for rule in candidates.values()]
+    inserted = sb_upsert('user_achievements', rows, on_conflict='user_id,achievement_id', ignore_duplicates=True)
+    earned_achievement_ids.set(user_id, known | frozenset(candidates))
+    new_rules = [candidates[row['achievement_id']] for row in inserted if row.get('achievement_id') in candidates]
+    if new_rules:
+        earned_achievements_cache.pop(user_id)
+    for rule in new_rules:
+        metrics.inc('achievements_awarded_total', trigger=rule['trigger'])
+    return [rule['key'] for rule in new_rules]
+
+def parse_progress_update(user_id, data):
+    """Validate a progress payload into the fields merge_progress() understands"""
+    room_name = normalize_room_name(data['room_name'])
+
+    # Validate and bound current_level (1-5)
+    current_level = max(1, min(5, int(data.get('current_level', 1))))
+
+    # Validate and bound progress_percentage (0-100)
+    progress_percentage = max(0, min(100, int(data.get('progress_percentage', 0))))
+
+    # Ensure progress percentage aligns with level completion (each level = 20%)
+    if current_level > 1 and progress_percentage < (current_level - 1) * 20:
+        progress_percentage = (current_level - 1) * 20
+
+    # If progress is 100% but level is less than 5, set level to 5
+    if progress_percentage >= 100 and current_level < 5:
+        current_level = 5
+
+    return {
+        'user_id': user_id,
+        'room_name': room_name,
+        'progress_percentage': progress_percentage,
+        'current_level': current_level,
+        'score': max(0, int(data.get('score', 0))),
+        'time_spent': max(0, int(data.get('time_spent', 0))),
+        'attempts': max(1, int(data.get('attempts', 1))),
+        'last_accessed': datetime.now().isoformat(),
+        'notes': data.get('notes', '')
+    }
+
+def merge_progress(existing, update):
+    """Max-merge an update onto an existing progress row.
+
+    Progress, level and score never go down; time spent, attempts, notes
+    and last access take the update's values.
+    """
+    merged = dict(update)
+    if existing:
+        merged['progress_percentage'] = max(update['progress_percentage'], existing.get('progress_percentage') or 0)
+        merged['current_level'] = max(update['current_level'], existing.get('current_level') or 1)
+        merged['score'] = max(update['score'], existing.get('score') or 0)
+    merged['completed'] = merged['progress_percentage'] >= 100 or merged['current_level'] >= 5
+    if merged['completed'] and not (existing and existing.get('completed')):
+        merged['completed_at'] = datetime.now().isoformat()
+    elif existing and existing.get('completed_at'):
+        merged['completed_at'] = existing['completed_at']
+    return merged
+
+def _apply_progress_update(user_id, update, user_row=None):
+    """Write one validated progress update and the user's derived stats.
+
+    The single DB write path for learner progress, used directly and by the
+    coalescing buffer's flush. Returns (progress_row, user_updates, created,
+    newly_earned_achievement_keys).
+    """
+    if user_row is None:
         users = sb_select('users', filters={'id': user_id})
         if not users:
-            return jsonify({'error': 'User not found'}), 404
+            raise LookupError(f'User {user_id} not found')
+        user_row = users[0]
+    room_name = update['room_name']
 
-        # Normalize and validate room name
-        room_name = normalize_room_name(data['room_name'])
-        
-        # Validate and bound current_level (1-5)
-        current_level = max(1, min(5, int(data.get('current_level', 1))))
-        
-        # Validate and bound progress_percentage (0-100)
-        progress_percentage = max(0, min(100, int(data.get('progress_percentage', 0))))
-        
-        # Ensure progress percentage aligns with level completion (each level = 20%)
-        if current_level > 1 and progress_percentage < (current_level - 1) * 20:
-            progress_percentage = (current_level - 1) * 20
-        
-        # If progress is 100% but level is less than 5, set level to 5
-        if progress_percentage >= 100 and current_level < 5:
-            current_level = 5
-        
-        # Check if progress record already exists
-        existing_progress = sb_select('user_progress', filters={'user_id': user_id, 'room_name': room_name})
-        
-        # Prepare progress data with proper validation
-        progress_data = {
-            'user_id': user_id,
-            'room_name': room_name,
-            'progress_percentage': progress_percentage,
-            'current_level': current_level,
-            'score': max(0, int(data.get('score', 0))),
-            'time_spent': max(0, int(data.get('time_spent', 0))),
-            'attempts': max(1, int(data.get('attempts', 1))),
-            'completed': progress_percentage >= 100 or current_level >= 5,
-            'last_accessed': datetime.now().isoformat(),
-            'notes': data.get('notes', '')
-        }
-        
-        # Set completion timestamp if completed
-        if progress_data['completed'] and not existing_progress:
-            progress_data['completed_at'] = datetime.now().isoformat()
-        elif progress_data['completed'] and existing_progress and not existing_progress[0].get('completed'):
-            progress_data['completed_at'] = datetime.now().isoformat()
-        
-        if existing_progress:
-            # Update existing record, but keep higher progress
-            current_progress = existing_progress[0].get('progress_percentage', 0)
-            current_level_existing = existing_progress[0].get('current_level', 1)
-            
-            # Keep higher progress and level
-            if progress_percentage > current_progress:
-                progress_data['progress_percentage'] = progress_percentage
+    # Check if progress record already exists
+    existing_progress = sb_select('user_progress', filters={'user_id': user_id, 'room_name': room_name})
+    progress_data = merge_progress(existing_progress[0] if existing_progress else None, update)
+
+    if existing_progress:
+        sb_update('user_progress', progress_data, filters={'user_id': user_id, 'room_name': room_name})
+    else:
+        sb_insert('user_progress', progress_data)
+
+    # Update user's total score and last activity
+    user_updates = {
+        'last_activity': datetime.now().isoformat()
+    }
+
+    # Recalculate total score from all room progress
+    all_user_progress = sb_select('user_progress', filters={'user_id': user_id})
+    total_score = sum(p.get('score', 0) for p in all_user_progress)
+    user_updates['total_score'] = total_score
+
+    # Update current streak (simplified - if user made progress today)
+    last_activity = user_row.get('last_activity')
+    today = datetime.now().date()
+
+    if last_activity:
+        try:
+            last_date = datetime.fromisoformat(last_activity.replace('Z', '')).date()
+            if last_date == today:
+                # Same day, maintain streak
+                pass
+            elif (today - last_date).days == 1:
+                # Next day, increment streak
+                user_updates['current_streak'] = user_row.get('current_streak', 0) + 1
             else:
-                progress_data['progress_percentage'] = current_progress
-                
-            if current_level > current_level_existing:
-                progress_data['current_level'] = current_level
+                # Gap in activity, reset streak
+                user_updates['current_streak'] = 1
+        except:
+            user_updates['current_streak'] = 1
+    else:
+        user_updates['current_streak'] = 1
+
+    # Update longest streak if current is higher
+    if user_updates.get('current_streak', 0) > user_row.get('longest_streak', 0):
+        user_updates['longest_streak'] = user_updates['current_streak']
+
+    sb_update('users', user_updates, match_column='id', match_value=user_id)
+
+    # Award achievements from the rows already fetched above
+    earned = []
+    try:
+        # user_updates only carries the streak on the first write of a day
+        rules = achievement_rules.evaluate(progress_data, all_user_progress, {**user_row, **user_updates})
+        if rules:
+            earned = award_rule_achievements(user_id, rules)
+    except Exception as e:
+        print(f"Achievement evaluation error for user {user_id}: {str(e)}")
+
+    # Updates acknowledged since this flush began must not be hidden by it
+    pending = progress_buffer.peek(user_id, room_name)
+    update_progress_summary(user_id, merge_progress(progress_data, pending) if pending else progress_data,
+                            user_updates)
+    return progress_data, user_updates, not existing_progress, earned
+
+# Progress write coalescing. Room games post on every level step, so bursts
+# of updates for the same (user, room) are max-merged in memory, acknowledged
+# at once and written as one update after a quiet period. Off on Vercel,
+# where a frozen function instance would never flush.
+PROGRESS_COALESCE_ENABLED = os.environ.get(
+    'PROGRESS_COALESCE_ENABLED', 'false' if os.environ.get('VERCEL') else 'true').lower() == 'true'
+PROGRESS_COALESCE_DEBOUNCE_SECONDS = float(os.environ.get('PROGRESS_COALESCE_DEBOUNCE_SECONDS', 2))
+PROGRESS_COALESCE_MAX_DELAY_SECONDS = float(os.environ.get('PROGRESS_COALESCE_MAX_DELAY_SECONDS', 10))
+PROGRESS_COALESCE_MAX_EVENTS = int(os.environ.get('PROGRESS_COALESCE_MAX_EVENTS', 20))
+
+metrics.describe('progress_events_total', 'counter', 'Progress updates received, by write mode.')
+metrics.describe('progress_flushes_total', 'counter', 'Coalesced progress updates written to the database.')
+metrics.describe('progress_flush_errors_total', 'counter', 'Coalesced progress writes that failed and were requeued.')
+
+class ProgressWriteBuffer:
+    """Pending progress updates per (user_id, room_name), max-merged in memory"""
+
+    def __init__(self, debounce, max_delay, max_events):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_events = max_events
+        self._pending = {}  # (user_id, room_name) -> {'update', 'events', 'first_at', 'last_at', 'generation'}
+        # user_id (discard) or (user_id, room_name) (overriding) -> times reset,
+        # so entries a flush has already taken can tell they're stale
+        self._resets = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self.stats = {'events': 0, 'flushes': 0, 'errors': 0, 'last_flush_at': None, 'last_error': None}
+
+    def add(self, update):
+        """Merge an update into the pending state and return the merged update"""
+        key = (update['user_id'], update['room_name'])
+        now = time.monotonic()
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = {'update': update, 'events': 1, 'first_at': now, 'last_at': now,
+                                              'generation': self._generation(key)}
             else:
-                progress_data['current_level'] = current_level_existing
-                
-            # Keep higher score
-            current_score = existing_progress[0].get('score', 0)
-            if data.get('score', 0) > current_score:
-                progress_data['score'] = data.get('score', 0)
+                entry['update'] = merge_progress(entry['update'], update)
+                entry['events'] += 1
+                entry['last_at'] = now
+            self.stats['events'] += 1
+            if entry['events'] >= self.max_events:
+                self._wake.set()
+            return dict(entry['update'])
+
+    def peek(self, user_id, room_name):
+        with self._lock:
+            entry = self._pending.get((user_id, room_name))
+            return dict(entry['update']) if entry else None
+
+    def discard(self, user_id):
+        """Drop a user's unflushed updates, e.g. when their progress is reset.
+
+        Entries a flush has already taken are dropped by the flusher once it
+        sees the bumped generation; waiting on the write lock means a write
+        already under way lands before the caller goes on to delete rows.
+        """
+        with self._lock:
+            self._resets[user_id] = self._resets.get(user_id, 0) + 1
+            for key in [k for k in self._pending if k[0] == user_id]:
+                del self._pending[key]
+        with self._write_lock:
+            pass
+
+    @contextmanager
+    def overriding(self, user_id, room_name):
+        """Drop a room's unflushed update while the caller writes that room directly.
+
+        Used by admin and batch writes, which set progress outright; flushing
+        the pending update afterwards would max-merge it back over them.
+        Flushes are held off until the caller's write is done.
+        """
+        key = (user_id, room_name)
+        with self._write_lock:
+            with self._lock:
+                self._resets[key] = self._resets.get(key, 0) + 1
+                self._pending.pop(key, None)
+            yield
+
+    def _generation(self, key):
+        return self._resets.get(key[0], 0), self._resets.get(key, 0)
+
+    def _is_stale(self, key, entry):
+        # Plain dict reads, so safe without self._lock
+        return entry['generation'] != self._generation(key)
+
+    def pending_for(self, user_id):
+        with self._lock:
+            return [dict(e['update']) for (uid, _), e in self._pending.items() if uid == user_id]
+
+    def _take_due(self, force):
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                key for key, e in self._pending.items()
+                if force
+                or e['events'] >= self.max_events
+                or now - e['last_at'] >= self.debounce
+                or now - e['first_at'] >= self.max_delay
+            ]
+            return [(key, self._pending.pop(key)) for key in due]
+
+    def _requeue(self, key, entry):
+        with self._lock:
+            if self._is_stale(key, entry):
+                return
+            current = self._pending.get(key)
+            if current is None:
+                self._pending[key] = entry
             else:
-                progress_data['score'] = current_score
-            
-            # Update existing record
-            sb_update('user_progress', progress_data, filters={'user_id': user_id, 'room_name': room_name})
-            message = 'Progress updated successfully'
-        else:
-            # Insert new record
-            inserted = sb_insert('user_progress', progress_data)
-            message = 'Progress created successfully'
-        
-        # Update user's total score and last activity
-        user_updates = {
-            'last_activity': datetime.now().isoformat()
-        }
-        
-        # Recalculate total score from all room progress
-        all_user_progress = sb_select('user_progress', filters={'user_id': user_id})
-        total_score = sum(p.get('score', 0) for p in all_user_progress)
-        user_updates['total_score'] = total_score
-        
-        # Update current streak (simplified - if user made progress today)
-        current_user = users[0]
-        last_activity = current_user.get('last_activity')
-        today = datetime.now().date()
-        
-        if last_activity:
+                current['update'] = merge_progress(entry['update'], current['update'])
+                current['events'] += entry['events']
+                current['first_at'] = min(current['first_at'], entry['first_at'])
+
+    def flush(self, force=False):
+        """Write every due entry; failed writes go back into the buffer. Returns rows written."""
+        written = 0
+        with self._flush_lock:
+            for key, entry in self._take_due(force):
+                try:
+                    with self._write_lock:
+                        if self._is_stale(key, entry):
+                            continue  # the user was reset after this batch was taken
+                        _apply_progress_update(key[0], entry['update'])
+                    written += 1
+                    metrics.inc('progress_flushes_total')
+                except LookupError as e:
+                    print(f"Dropping progress for missing user: {str(e)}")
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    self.stats['last_error'] = f"{key}: {str(e)}"
+                    metrics.inc('progress_flush_errors_total')
+                    print(f"Progress flush error for {key}: {str(e)}")
+                    self._requeue(key, entry)
+            self.stats['flushes'] += written
+            if written:
+                self.stats['last_flush_at'] = datetime.now(timezone.utc).isoformat()
+        return written
+
+    def run(self):
+        interval = max(0.1, self.debounce / 2)
+        while True:
+            self._wake.wait(timeout=interval)
+            self._wake.clear()
             try:
-                last_date = datetime.fromisoformat(last_activity.replace('Z', '')).date()
-                if last_date == today:
-                    # Same day, maintain streak
-                    pass
-                elif (today - last_date).days == 1:
-                    # Next day, increment streak
-                    user_updates['current_streak'] = current_user.get('current_streak', 0) + 1
-                else:
-                    # Gap in activity, reset streak
-                    user_updates['current_streak'] = 1
-            except:
-                user_updates['current_streak'] = 1
-        else:
-            user_updates['current_streak'] = 1
-        
-        # Update longest streak if current is higher
-        if user_updates['current_streak'] > current_user.get('longest_streak', 0):
-            user_updates['longest_streak'] = user_updates['current_streak']
-        
-        sb_update('users', user_updates, match_column='id', match_value=user_id)
-        
+                self.flush()
+            except Exception as e:
+                print(f"Progress flush loop error: {str(e)}")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+progress_buffer = ProgressWriteBuffer(PROGRESS_COALESCE_DEBOUNCE_SECONDS, PROGRESS_COALESCE_MAX_DELAY_SECONDS,
+                                      PROGRESS_COALESCE_MAX_EVENTS)
+atexit.register(progress_buffer.flush, force=True)
+
+@app.route('/api/users/<int:user_id>/progress', methods=['POST'])
+def update_user_progress(user_id):
+    try:
+        data = request.get_json()
+        if not data or not data.get('room_name'):
+            return jsonify({'error': 'Room name is required'}), 400
+
+        update = parse_progress_update(user_id, data)
+
+        if PROGRESS_COALESCE_ENABLED:
+            # The cached summary doubles as the existence check and the merge
+            # base, so a burst costs no DB calls after the first event
+            doc = load_progress_summary(user_id)
+            if doc is None:
+                return jsonify({'error': 'User not found'}), 404
+            metrics.inc('progress_events_total', mode='coalesced')
+            pending = progress_buffer.add(update)
+            progress_data = merge_progress(doc['rooms'].get(update['room_name']), pending)
+            update_progress_summary(user_id, progress_data)
+            return jsonify({
+                'message': 'Progress accepted',
+                'progress': progress_data,
+                'queued': True
+            }), 202
+
+        # Check if user exists
+        users = sb_select('users', filters={'id': user_id})
+        if not users:
+            return jsonify({'error': 'User not found'}), 404
+
+        metrics.inc('progress_events_total', mode='direct')
+        progress_data, user_updates, created, earned = _apply_progress_update(user_id, update, users[0])
+
         return jsonify({
-            'message': message,
+            'message': 'Progress created successfully' if created else 'Progress updated successfully',
             'progress': progress_data,
-            'user_stats': user_updates
-        }), 200 if existing_progress else 201
+            'user_stats': user_updates,
+            'achievements_earned': earned
+        }), 201 if created else 200
             
     except Exception as e:
         print(f"Update user progress error: {str(e)}")
         print(traceback.format_exc())
         return jsonify({'error': f'Failed to update progress: {str(e)}'}), 500
 
+# Per-user progress summary documents, keyed by user id. Progress writes
+# update a cached document in place of a rebuild, so the summary endpoint is
+# a single cache read on the hot path.
+PROGRESS_SUMMARY_TTL_SECONDS = int(os.environ.get('PROGRESS_SUMMARY_TTL_SECONDS', 120))
+progress_summaries = TTLCache(maxsize=int(os.environ.get('PROGRESS_SUMMARY_CACHE_SIZE', 5000)),
+                              ttl=PROGRESS_SUMMARY_TTL_SECONDS)
+metrics.describe('cache_requests_total', 'counter', 'In-process cache lookups, by cache and result.')
+
+SUMMARY_ROOM_FIELDS = ('progress_percentage', 'score', 'completed', 'current_level',
+                       'time_spent', 'attempts', 'last_accessed')
+
+def _summary_room_entry(room_name, record=None):
+    meta = room_registry.get(room_name)
+    entry = {
+        'room_name': room_name,
+        'display_name': meta['display_name'],
+        'progress_percentage': 0,
+        'score': 0,
+        'completed': False,
+        'current_level': 1,
+        'time_spent': 0,
+        'attempts': 0,
+        'last_accessed': None,
+        'icon': meta['icon'],
+        'color': meta['color'],
+        'description': meta['description']
+    }
+    if record is not None:
+        for field in SUMMARY_ROOM_FIELDS:
+            entry[field] = record.get(field, entry[field])
+        entry['completed_at'] = record.get('completed_at')
+    return entry
+
+def _summary_totals(rooms):
+    return {
+        'progress_sum': sum(room['progress_percentage'] or 0 for room in rooms.values()),
+        'completed_rooms': sum(1 for room in rooms.values() if room['completed']),
+        'total_score': sum(room['score'] or 0 for room in rooms.values())
+    }
+
+def build_progress_summary(user, progress_records):
+    """Build a user's summary document from their user and progress rows"""
+    by_room = {r.get('room_name'): r for r in progress_records}
+    rooms = {name: _summary_room_entry(name, by_room.get(name)) for name in room_registry.rooms}
+    return {
+        'user_id': user['id'],
+        'username': user.get('name', 'Unknown'),
+        'current_streak': user.get('current_streak', 0),
+        'longest_streak': user.get('longest_streak', 0),
+        'rooms': rooms,
+        **_summary_totals(rooms)
+    }
+
+def update_progress_summary(user_id, progress_row, user_stats=None):
+    """Fold one written progress row into the user's cached summary.
+
+    Copy-on-write: the cached document is never mutated, so concurrent
+    readers always serialize a consistent snapshot. Users without a cached
+    document are skipped; their next summary read builds one from the DB.
+    """
+    doc = progress_summaries.get(user_id)
+    if doc is None:
+        return
+    room_name = progress_row.get('room_name')
+    if room_name not in doc['rooms']:
+        return
+
+    old_entry = doc['rooms'][room_name]
+    merged = dict(old_entry)
+    for field in SUMMARY_ROOM_FIELDS:
+        if field in progress_row:
+            merged[field] = progress_row[field]
+    merged['completed_at'] = progress_row.get('completed_at', old_entry.get('completed_at'))
+
+    new_doc = dict(doc)
+    new_doc['rooms'] = dict(doc['rooms'])
+    new_doc['rooms'][room_name] = merged
+    new_doc['progress_sum'] += (merged['progress_percentage'] or 0) - (old_entry['progress_percentage'] or 0)
+    new_doc['completed_rooms'] += int(bool(merged['completed'])) - int(bool(old_entry['completed']))
+    new_doc['total_score'] += (merged['score'] or 0) - (old_entry['score'] or 0)
+    for field in ('current_streak', 'longest_streak'):
+        if user_stats and field in user_stats:
+            new_doc[field] = user_stats[field]
+    progress_summaries.set(user_id, new_doc)
+
+def serialize_progress_summary(doc):
+    rooms = doc['rooms']
+    return {
+        'user_id': doc['user_id'],
+        'username': doc['username'],
+        'room_progress': list(rooms.values()),
+        'overall_stats': {
+            'total_progress': round(doc['progress_sum'] / len(rooms), 1),
+            'completed_rooms': doc['completed_rooms'],
+            'total_rooms': len(rooms),
+            'total_score': doc['total_score'],
+            'current_streak': doc['current_streak'],
+            'longest_streak': doc['longest_streak']
+        }
+    }
+
 # New endpoint to get progress for all rooms for a user
+def load_progress_summary(user_id):
+    """Cached summary document for a user, built from the DB on a miss; None if the user doesn't exist"""
+    doc = progress_summaries.get(user_id)
+    metrics.inc('cache_requests_total', cache='progress_summary', result='hit' if doc else 'miss')
+    if doc is None:
+        users = sb_select('users', filters={'id': user_id})
+        if not users:
+            return None
+        progress_records = sb_select('user_progress', filters={'user_id': user_id})
+        doc = build_progress_summary(users[0], progress_records)
+        progress_summaries.set(user_id, doc)
+        # Fold in updates that were acknowledged but not yet flushed
+        for pending in progress_buffer.pending_for(user_id):
+            update_progress_summary(user_id, merge_progress(doc['rooms'].get(pending['room_name']), pending))
+        doc = progress_summaries.get(user_id) or doc
+    return doc
+
 @app.route('/api/users/<int:user_id>/progress/summary', methods=['GET'])
 def get_user_progress_summary(user_id):
     try:
-        # Ensure user exists
-        users = sb_select('users', filters={'id': user_id})
-        if not users:
+        doc = load_progress_summary(user_id)
+        if doc is None:
             return jsonify({'error': 'User not found'}), 404
 
-        # Get all progress for user
-        progress_records = sb_select('user_progress', filters={'user_id': user_id})
-        
-        # Initialize all rooms with default progress
-        all_rooms = {
-            'flowchart': {
-                'room_name': 'flowchart',
-                'display_name': 'FLOWBYTE',
-                'progress_percentage': 0,
-                'score': 0,
-                'completed': False,
-                'current_level': 1,
-                'time_spent': 0,
-                'attempts': 0,
-                'last_accessed': None,
-                'icon': 'bi-diagram-3',
-                'color': '#005FFB',
-                'description': 'Flowchart Logic'
-            },
-            'networking': {
-                'room_name': 'networking',
-                'display_name': 'NETXUS',
-                'progress_percentage': 0,
-                'score': 0,
-                'completed': False,
-                'current_level': 1,
-                'time_spent': 0,
-                'attempts': 0,
-                'last_accessed': None,
-                'icon': 'bi-hdd-network',
-                'color': '#00A949',
-                'description': 'Network Engineering'
-            },
-            'ai-training': {
-                'room_name': 'ai-training',
-                'display_name': 'AITRIX',
-                'progress_percentage': 0,
-                'score': 0,
-                'completed': False,
-                'current_level': 1,
-                'time_spent': 0,
-                'attempts': 0,
-                'last_accessed': None,
-                'icon': 'bi-robot',
-                'color': '#E08300',
-                'description': 'AI & Machine Learning'
-            },
-            'database': {
-                'room_name': 'database',
-                'display_name': 'SCHEMAX',
-                'progress_percentage': 0,
-                'score': 0,
-                'completed': False,
-                'current_level': 1,
-                'time_spent': 0,
-                'attempts': 0,
-                'last_accessed': None,
-                'icon': 'bi-database',
-                'color': '#FF3600',
-                'description': 'Database Management'
-            },
-            'programming': {
-                'room_name': 'programming',
-                'display_name': 'CODEVANCE',
-                'progress_percentage': 0,
-                'score': 0,
-                'completed': False,
-                'current_level': 1,
-                'time_spent': 0,
-                'attempts': 0,
-                'last_accessed': None,
-                'icon': 'bi-code-slash',
-                'color': '#FF006D',
-                'description': 'Advanced Programming'
-            }
-        }
-        
-        # Update with actual progress data
-        for record in progress_records:
-            room_name = record.get('room_name')
-            if room_name in all_rooms:
-                all_rooms[room_name].update({
-                    'progress_percentage': record.get('progress_percentage', 0),
-                    'score': record.get('score', 0),
-                    'completed': record.get('completed', False),
-                    'current_level': record.get('current_level', 1),
-                    'time_spent': record.get('time_spent', 0),
-                    'attempts': record.get('attempts', 0),
-                    'last_accessed': record.get('last_accessed'),
-                    'completed_at': record.get('completed_at')
-                })
-        
-        # Calculate overall stats
-        total_progress = sum(room['progress_percentage'] for room in all_rooms.values()) / len(all_rooms)
-        completed_rooms = sum(1 for room in all_rooms.values() if room['completed'])
-        total_score = sum(room['score'] for room in all_rooms.values())
-        
-        # Get user stats
-        user = users[0]
-        
-        return jsonify({
-            'user_id': user_id,
-            'username': user.get('name', 'Unknown'),
-            'room_progress': list(all_rooms.values()),
-            'overall_stats': {
-                'total_progress': round(total_progress, 1),
-                'completed_rooms': completed_rooms,
-                'total_rooms': len(all_rooms),
-                'total_score': total_score,
-                'current_streak': user.get('current_streak', 0),
-                'longest_streak': user.get('longest_streak', 0)
-            }
-        }), 200
+        return jsonify(serialize_progress_summary(doc)), 200
         
     except Exception as e:
         print(f"Get user progress summary error: {str(e)}")
@@ -1107,17 +2414,17 @@ def reset_user_progress(user_id):
         if not users:
             return jsonify({'error': 'User not found'}), 404
         
-        # Delete all progress records for this user
+        # Delete all progress records for this user, including unflushed updates
+        progress_buffer.discard(user_id)
         result = sb_delete('user_progress', filters={'user_id': user_id})
         
         # Reset user's total score and streak
-        sb_update('users', 
-                 filters={'id': user_id}, 
-                 data={
-                     'total_score': 0,
-                     'current_streak': 0,
-                     'longest_streak': 0
-                 })
+        sb_update('users', {
+            'total_score': 0,
+            'current_streak': 0,
+            'longest_streak': 0
+        }, filters={'id': user_id})
+        progress_summaries.pop(user_id)
         
         print(f"✅ Reset all progress for user {user_id}")
         
@@ -1188,10 +2495,12 @@ def batch_update_progress():
                 if progress_data['completed'] and (not existing_progress or not existing_progress[0].get('completed')):
                     progress_data['completed_at'] = datetime.now().isoformat()
                 
-                if existing_progress:
-                    sb_update('user_progress', progress_data, filters={'user_id': user_id, 'room_name': room_name})
-                else:
-                    sb_insert('user_progress', progress_data)
+                with progress_buffer.overriding(int(user_id), room_name):
+                    if existing_progress:
+                        sb_update('user_progress', progress_data, filters={'user_id': user_id, 'room_name': room_name})
+                    else:
+                        sb_insert('user_progress', progress_data)
+                    update_progress_summary(int(user_id), progress_data)
                 
                 updated_count += 1
                 
@@ -1241,10 +2550,17 @@ def award_badge(user_id):
             'badge_type': data.get('badge_type', 'achievement'), 
             'earned_at': datetime.now().isoformat()
         }
-        inserted = sb_insert('badges', row)
+        try:
+            inserted = sb_insert('badges', row)
+        except Exception as e:
+            # UNIQUE(user_id, badge_name) rejects repeat awards
+            if 'duplicate key' in str(e) or '23505' in str(e):
+                return jsonify({'message': 'Badge already earned'}), 200
+            raise
+        note_awards([user_id])
         badge_id = inserted[0].get('id') if inserted else None
         return jsonify({'id': badge_id, 'message': 'Badge awarded successfully'}), 201
-        
+
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1282,13 +2598,14 @@ def award_badge_authenticated():
         try:
             inserted = sb_insert('badges', row)
             badge_id = inserted[0].get('id') if inserted else None
+            note_awards([user_id])
             
             # Update user's total score if points provided
             if data.get('points'):
                 users = sb_select('users', filters={'id': user_id})
                 if users:
                     current_score = users[0].get('total_score', 0)
-                    sb_update('users', {'total_score': current_score + data['points']}, {'id': user_id})
+                    sb_update('users', {'total_score': current_score + data['points']}, match_column='id', match_value=user_id)
             
             return jsonify({'id': badge_id, 'message': 'Badge awarded successfully'}), 201
         except Exception as e:
@@ -1311,11 +2628,9 @@ def award_achievement():
         if not data or not data.get('achievement_key'):
             return jsonify({'error': 'Achievement key is required'}), 400
 
-        # Check if achievement definition exists
-        achievement_def = sb_select('achievements', filters={'achievement_key': data['achievement_key']})
-        
-        if not achievement_def:
-            # Create achievement definition if it doesn't exist
+        achievement_def = achievement_catalog.get(data['achievement_key'])
+        if achievement_def is None:
+            # Create the definition on first use; ignore_duplicates covers a concurrent creator
             achievement_row = {
                 'achievement_key': data['achievement_key'],
                 'title': data.get('title', 'Achievement'),
@@ -1326,67 +2641,169 @@ def award_achievement():
                 'category': data.get('category', 'general'),
                 'is_active': True
             }
-            try:
-                sb_insert('achievements', achievement_row)
-                achievement_def = sb_select('achievements', filters={'achievement_key': data['achievement_key']})
-            except:
-                # Achievement might already exist due to race condition
-                achievement_def = sb_select('achievements', filters={'achievement_key': data['achievement_key']})
-
-        if not achievement_def:
-            return jsonify({'error': 'Failed to create achievement definition'}), 500
+            created = sb_upsert('achievements', achievement_row, on_conflict='achievement_key', ignore_duplicates=True)
+            if not created:
+                created = sb_select('achievements', filters={'achievement_key': data['achievement_key']})
+            if not created:
+                return jsonify({'error': 'Failed to create achievement definition'}), 500
+            achievement_catalog.add(created[0])
+            achievement_def = created[0]
 
-        achievement_id = achievement_def[0]['id']
-
-        # Check if user already has this achievement
-        existing_achievements = sb_select('user_achievements', filters={
-            'user_id': user_id,
-            'achievement_id': achievement_id
-        })
-        
-        if existing_achievements:
-            return jsonify({'message': 'Achievement already earned'}), 200
+        achievement_id = achievement_def['id']
 
-        # Award the achievement
+        # UNIQUE(user_id, achievement_id) turns a repeat award into a no-op
         user_achievement_row = {
             'user_id': int(user_id),
             'achievement_id': achievement_id,
             'earned_at': datetime.now().isoformat(),
             'progress_data': data.get('progress_data', {})
         }
-        
-        try:
-            inserted = sb_insert('user_achievements', user_achievement_row)
-            return jsonify({'message': 'Achievement awarded successfully'}), 201
-        except:
-            # Achievement might already exist
+        inserted = sb_upsert('user_achievements', user_achievement_row,
+                             on_conflict='user_id,achievement_id', ignore_duplicates=True)
+        note_awards([user_id], achievement_id)
+        if not inserted:
             return jsonify({'message': 'Achievement already earned'}), 200
-        
+        return jsonify({'message': 'Achievement awarded successfully'}), 201
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Bulk awards for whole classes
+BULK_AWARD_MAX_USERS = int(os.environ.get('BULK_AWARD_MAX_USERS', 1000))
+BULK_INSERT_CHUNK_SIZE = int(os.environ.get('BULK_INSERT_CHUNK_SIZE', 500))
+
+def parse_bulk_user_ids(data):
+    """Distinct integer user ids from data['user_ids'], or raise ValueError"""
+    user_ids = data.get('user_ids')
+    if not isinstance(user_ids, list) or not user_ids:
+        raise ValueError('user_ids must be a non-empty array')
+    try:
+        user_ids = list(dict.fromkeys(int(u) for u in user_ids))
+    except (TypeError, ValueError):
+        raise ValueError('user_ids must be integers')
+    if len(user_ids) > BULK_AWARD_MAX_USERS:
+        raise ValueError(f'At most {BULK_AWARD_MAX_USERS} users per request')
+    return user_ids
+
+def bulk_award(table, match, user_ids, build_row):
+    """Award one badge/achievement to many users in a fixed number of round trips.
+
+    One in_ query keeps the ids that exist, one query over the same ids
+    finds who already holds `match` (the anti-join is taken here), and the
+    rest are written in upserts of BULK_INSERT_CHUNK_SIZE rows that skip
+    anything a concurrent award inserted first.
+    """
+    existing = {u['id'] for u in sb_select('users', select='id', filters={'id': user_ids})}
+    candidates = [u for u in user_ids if u in existing]
+    held = set()
+    if candidates:
+        held = {r['user_id'] for r in sb_select(table, select='user_id', filters={'user_id': candidates, **match})}
+    to_award = [u for u in candidates if u not in held]
+
+    awarded = []
+    on_conflict = ','.join(['user_id', *match])
+    for start in range(0, len(to_award), BULK_INSERT_CHUNK_SIZE):
+        rows = [build_row(u) for u in to_award[start:start + BULK_INSERT_CHUNK_SIZE]]
+        inserted = sb_upsert(table, rows, on_conflict=on_conflict, ignore_duplicates=True)
+        awarded.extend(r['user_id'] for r in inserted)
+    # Rows skipped by the upsert were awarded concurrently, so count them as held
+    awarded_set = set(awarded)
+    return {
+        'awarded': awarded,
+        'already_held': [u for u in candidates if u not in awarded_set],
+        'not_found': [u for u in user_ids if u not in existing]
+    }
+
+@app.route('/api/badges/bulk-award', methods=['POST'])
+@rate_limit('bulk_award_badges')
+def bulk_award_badge():
+    """Award one badge to a list of users (teachers and admins)"""
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        data = request.get_json() or {}
+        if not data.get('badge_name'):
+            return jsonify({'error': 'Badge name is required'}), 400
+        try:
+            user_ids = parse_bulk_user_ids(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        earned_at = datetime.now().isoformat()
+        badge_type = data.get('badge_type', 'achievement')
+        result = bulk_award('badges', {'badge_name': data['badge_name']}, user_ids, lambda u: {
+            'user_id': u,
+            'badge_name': data['badge_name'],
+            'badge_type': badge_type,
+            'earned_at': earned_at
+        })
+        note_awards(result['awarded'])
+        return jsonify({'message': f"Badge awarded to {len(result['awarded'])} users", **result}), 200
+    except Exception as e:
+        print(f"Bulk badge award error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/achievements/bulk-award', methods=['POST'])
+@rate_limit('bulk_award_achievements')
+def bulk_award_achievement():
+    """Award one existing achievement to a list of users (teachers and admins)"""
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        data = request.get_json() or {}
+        if not data.get('achievement_key'):
+            return jsonify({'error': 'Achievement key is required'}), 400
+        achievement_def = achievement_catalog.get(data['achievement_key'])
+        if achievement_def is None:
+            return jsonify({'error': 'Achievement not found'}), 404
+        try:
+            user_ids = parse_bulk_user_ids(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        achievement_id = achievement_def['id']
+        earned_at = datetime.now().isoformat()
+        progress_data = data.get('progress_data', {'awarded_by': teacher_id})
+        result = bulk_award('user_achievements', {'achievement_id': achievement_id}, user_ids, lambda u: {
+            'user_id': u,
+            'achievement_id': achievement_id,
+            'earned_at': earned_at,
+            'progress_data': progress_data
+        })
+        note_awards(result['awarded'], achievement_id)
+        return jsonify({'message': f"Achievement awarded to {len(result['awarded'])} users", **result}), 200
     except Exception as e:
+        print(f"Bulk achievement award error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+EARNED_ACHIEVEMENT_COLUMNS = ('source, badge_name, badge_type, title, description, icon, badge_color, '
+                              'points, rarity, earned_at')
+
+def load_earned_achievements(user_id):
+    """Badges and achievements a user holds, newest first, from one query on the view"""
+    earned = earned_achievements_cache.get(user_id)
+    if earned is None:
+        earned = sb_select('user_earned_achievements', select=EARNED_ACHIEVEMENT_COLUMNS,
+                           filters={'user_id': user_id}, order='-earned_at')
+        earned_achievements_cache.set(user_id, earned)
+    return earned
+
 @app.route('/api/achievements/user', methods=['GET'])
 def get_user_achievements():
-    """Get all achievements for the authenticated user"""
+    """Get everything the authenticated user has earned, badges and achievements alike"""
     try:
         # Get user from session/token or header
         user_id = session.get('user_id') or request.headers.get('X-User-ID')
         if not user_id:
             return jsonify({'error': 'Authentication required'}), 401
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid user ID'}), 400
 
-        # Get user badges as achievements (simplified approach)
-        badges = sb_select('badges', filters={'user_id': user_id}, order='-earned_at')
-        
-        # Convert badges to achievement format
-        achievements = []
-        for badge in badges:
-            achievements.append({
-                'badge_name': badge['badge_name'],
-                'earned_at': badge['earned_at'],
-                'badge_type': badge.get('badge_type', 'achievement')
-            })
-        
-        return jsonify(achievements), 200
+        return jsonify(load_earned_achievements(user_id)), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1466,16 +2883,20 @@ def require_admin():
         return wrapper
     return decorator
 
-def log_admin_action(action_type, description, target_user_id=None):
-    """Log admin actions for audit trail"""
+def log_admin_action(action_type, description, target_user_id=None, admin_user_id=None):
+    """Log admin actions for audit trail.
+
+    admin_user_id defaults to the admin authenticated by require_admin;
+    pass it explicitly where there is no admin session yet (login).
+    """
     try:
         action_data = {
-            'admin_user_id': g.admin_user_id,
+            'admin_user_id': admin_user_id or g.admin_user_id,
             'action_type': action_type,
             'target_user_id': target_user_id,
             'description': description,
-            'ip_address': request.remote_addr,
-            'timestamp': datetime.now().isoformat()
+            'ip_address': _client_ip(),
+            'timestamp': datetime.now(timezone.utc).isoformat()
         }
         sb_insert('admin_actions', action_data)
     except Exception as e:
@@ -1483,6 +2904,7 @@ def log_admin_action(action_type, description, target_user_id=None):
 
 # Admin Authentication Endpoints
 @app.route('/api/admin/auth/login', methods=['POST'])
+@rate_limit('admin_login', per_ip=RATE_LIMIT_LOGIN_IP, per_identity=RATE_LIMIT_LOGIN_USER, identity_field='username')
 def admin_login():
     try:
         data = request.get_json()
@@ -1497,18 +2919,15 @@ def admin_login():
             return jsonify({'error': 'Username and password are required'}), 400
         
         # Find admin user
-        users_by_email = sb_select('users', filters={'email': username, 'role': 'admin', 'is_active': True})
-        user_row = users_by_email[0] if users_by_email else None
-        
-        if not user_row:
-            users_by_name = sb_select('users', filters={'name': username, 'role': 'admin', 'is_active': True})
-            user_row = users_by_name[0] if users_by_name else None
+        user_row = find_user_by_identifier(username, select=LOGIN_USER_COLUMNS,
+                                           extra_filters={'role': 'admin', 'is_active': True})
         
         if not user_row:
             return jsonify({'error': 'Admin user not found or inactive'}), 404
         
         # Verify password
-        if not verify_password(password, user_row['password_hash']):
+        password_ok, needs_rehash = verify_password(password, user_row['password_hash'])
+        if not password_ok:
             return jsonify({'error': 'Invalid credentials'}), 401
         
         # Create admin session
@@ -1524,11 +2943,14 @@ def admin_login():
         }
         sb_insert('admin_sessions', session_data)
         
-        # Update last login
-        sb_update('users', {'last_login': datetime.now().isoformat()}, match_column='id', match_value=user_row['id'])
+        # Update last login, upgrading legacy or lower-cost hashes in the same write
+        login_updates = {'last_login': datetime.now().isoformat()}
+        if needs_rehash:
+            login_updates['password_hash'] = hash_password(password)
+        sb_update('users', login_updates, match_column='id', match_value=user_row['id'])
         
         # Log admin login
-        log_admin_action('LOGIN', f"Admin login successful")
+        log_admin_action('LOGIN', "Admin login successful", admin_user_id=user_row['id'])
         
         return jsonify({
             'message': 'Admin login successful',
@@ -1639,20 +3061,11 @@ def admin_get_user_progress(user_id):
         # Get all badges for this user
         badges = sb_select('badges', filters={'user_id': user_id}, order='-earned_at')
         
-        # Calculate detailed stats
-        room_stats = {
-            'flowchart': {'name': 'FLOWBYTE', 'icon': 'bi-diagram-3', 'color': '#005FFB'},
-            'networking': {'name': 'NETXUS', 'icon': 'bi-hdd-network', 'color': '#00A949'},
-            'ai-training': {'name': 'AITRIX', 'icon': 'bi-robot', 'color': '#E08300'},
-            'database': {'name': 'SCHEMAX', 'icon': 'bi-database', 'color': '#FF3600'},
-            'programming': {'name': 'CODEVANCE', 'icon': 'bi-code-slash', 'color': '#FF006D'}
-        }
-        
         # Enrich progress with room metadata
         for record in progress_records:
-            room_name = record.get('room_name', '')
-            if room_name in room_stats:
-                record.update(room_stats[room_name])
+            room = room_registry.get(record.get('room_name', ''))
+            if room:
+                record.update({'name': room['display_name'], 'icon': room['icon'], 'color': room['color']})
         
         # Calculate overall statistics
         total_progress = sum(p.get('progress_percentage', 0) for p in progress_records)
@@ -1740,12 +3153,14 @@ def admin_update_user_progress(user_id):
         if progress_data['completed'] and (not existing_progress or not existing_progress[0].get('completed')):
             progress_data['completed_at'] = datetime.now().isoformat()
         
-        if existing_progress:
-            sb_update('user_progress', progress_data, filters={'user_id': user_id, 'room_name': room_name})
-            action_type = 'UPDATE_USER_PROGRESS'
-        else:
-            sb_insert('user_progress', progress_data)
-            action_type = 'CREATE_USER_PROGRESS'
+        with progress_buffer.overriding(user_id, room_name):
+            if existing_progress:
+                sb_update('user_progress', progress_data, filters={'user_id': user_id, 'room_name': room_name})
+                action_type = 'UPDATE_USER_PROGRESS'
+            else:
+                sb_insert('user_progress', progress_data)
+                action_type = 'CREATE_USER_PROGRESS'
+            update_progress_summary(user_id, progress_data)
         
         # Log admin action
         log_admin_action(
@@ -1878,100 +3293,57 @@ def get_analytics_overview():
         print(f"Analytics overview error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# How each event type reads in the admin live activity feed
+LIVE_ACTIVITY_DESCRIPTIONS = {
+    'user_registered': "{user} joined the platform",
+    'progress_started': "{user} started {room}",
+    'progress_updated': "{user} made progress in {room} ({progress_percentage}%)",
+    'room_completed': "{user} completed {room}",
+    'badge_earned': "{user} earned '{badge_name}' badge",
+    'achievement_earned': "{user} earned the '{title}' achievement",
+    'content_created': "{user} created: {title}",
+}
+LIVE_STATS_SAMPLE_SIZE = 1000
+
 @app.route('/api/admin/activity/live', methods=['GET'])
 def get_live_activity():
-    """Get live activity feed"""
+    """Get live activity feed, read from the newest end of the event log"""
     try:
-        # Get recent activities from last 24 hours
-        day_ago = datetime.now(timezone.utc) - timedelta(hours=24)
-        day_ago_str = day_ago.isoformat()
-        
+        now = datetime.now(timezone.utc)
+        day_ago_str = (now - timedelta(hours=24)).isoformat()
+        hour_ago_str = (now - timedelta(hours=1)).isoformat()
+
+        events = sb_select('events', filters={
+            'ts': ('gt', day_ago_str), 'type': list(LIVE_ACTIVITY_DESCRIPTIONS)
+        }, order='-seq', limit=20)
+        recent_progress = sb_select('events', select='user_id, room', filters={
+            'ts': ('gt', hour_ago_str), 'type': list(PROGRESS_EVENT_TYPES)
+        }, order='-seq', limit=LIVE_STATS_SAMPLE_SIZE)
+
+        user_ids = sorted({e['user_id'] for e in events if e.get('user_id') is not None})
+        names = {}
+        if user_ids:
+            names = {u['id']: u['name'] for u in sb_select('users', select='id, name', filters={'id': user_ids})}
+
         all_activities = []
-        
-        # Recent user registrations
-        users = sb_select('users', order='-created_at', limit=10)
-        recent_users = [u for u in users if u.get('created_at', '') > day_ago_str]
-        
-        for user in recent_users:
-            all_activities.append({
-                'type': 'user_registered',
-                'description': f"{user.get('name', 'Unknown')} joined the platform",
-                'timestamp': user.get('created_at'),
-                'user': user.get('name', 'Unknown')
-            })
-        
-        # Recent progress updates
-        progress_records = sb_select('user_progress', select='*, users(name)', order='-last_accessed', limit=10)
-        recent_progress = [p for p in progress_records if p.get('last_accessed', '') > day_ago_str]
-        
-        for progress in recent_progress:
-            user_name = 'Unknown'
-            if progress.get('users'):
-                if isinstance(progress['users'], dict):
-                    user_name = progress['users'].get('name', 'Unknown')
-                else:
-                    user_name = progress['users']
-            
-            all_activities.append({
-                'type': 'progress_updated', 
-                'description': f"{user_name} made progress in {progress.get('room_name', 'Unknown')} ({progress.get('progress_percentage', 0)}%)",
-                'timestamp': progress.get('last_accessed'),
-                'user': user_name
-            })
-        
-        # Recent badge awards
-        badges = sb_select('badges', select='*, users(name)', order='-earned_at', limit=10)
-        recent_badges = [b for b in badges if b.get('earned_at', '') > day_ago_str]
-        
-        for badge in recent_badges:
-            user_name = 'Unknown'
-            if badge.get('users'):
-                if isinstance(badge['users'], dict):
-                    user_name = badge['users'].get('name', 'Unknown')
-                else:
-                    user_name = badge['users']
-            
+        for event in events:
+            payload = event.get('payload') or {}
+            user_name = names.get(event.get('user_id')) or payload.get('name') or 'Unknown'
+            fields = {'progress_percentage': 0, 'badge_name': 'Unknown', 'title': 'Unknown', **payload,
+                      'user': user_name, 'room': event.get('room') or 'Unknown'}
             all_activities.append({
-                'type': 'badge_earned',
-                'description': f"{user_name} earned '{badge.get('badge_name', 'Unknown')}' badge",
-                'timestamp': badge.get('earned_at'), 
+                'type': event['type'],
+                'description': LIVE_ACTIVITY_DESCRIPTIONS[event['type']].format(**fields),
+                'timestamp': event.get('ts'),
                 'user': user_name
             })
-        
-        # Recent content creation
-        items = sb_select('items', select='*, users(name)', order='-created_at', limit=5)
-        recent_items = [i for i in items if i.get('created_at', '') > day_ago_str]
-        
-        for item in recent_items:
-            creator = 'System'
-            if item.get('users'):
-                if isinstance(item['users'], dict):
-                    creator = item['users'].get('name', 'System')
-                else:
-                    creator = item['users']
-            
-            all_activities.append({
-                'type': 'content_created',
-                'description': f"{creator} created: {item.get('title', 'Unknown')}",
-                'timestamp': item.get('created_at'),
-                'user': creator
-            })
-        
-        # Sort by timestamp and limit
-        all_activities.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-        
-        # Calculate live stats
-        hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
-        hour_ago_str = hour_ago.isoformat()
-        
-        very_recent_progress = [p for p in progress_records if p.get('last_accessed', '') > hour_ago_str]
-        recent_activity_count = len(set(p.get('user_id') for p in very_recent_progress))
-        
+
+        recent_activity_count = len({e.get('user_id') for e in recent_progress})
         active_sessions = recent_activity_count + 3  # Add some buffer for realism
-        rooms_in_use = len(set(p.get('room_name') for p in very_recent_progress))
+        rooms_in_use = len({e.get('room') for e in recent_progress})
         
         return jsonify({
-            'activities': all_activities[:20],
+            'activities': all_activities,
             'live_stats': {
                 'online_users': recent_activity_count,
                 'active_sessions': active_sessions,
@@ -2029,79 +3401,520 @@ def get_badges_summary():
         return jsonify({'error': str(e)}), 500
 
 # ============================================================
-# TEACHER API ROUTES
+# EVENT LOG
 # ============================================================
 
-def require_teacher():
-    """Check that the requesting user has the teacher role.
-    Returns (user_id, None) on success or (None, error_response) on failure."""
-    teacher_id = request.headers.get('X-User-ID') or request.args.get('teacher_id')
-    if not teacher_id:
-        return None, (jsonify({'error': 'Teacher ID required'}), 401)
-    try:
-        teacher_id = int(teacher_id)
-    except (TypeError, ValueError):
-        return None, (jsonify({'error': 'Invalid teacher ID'}), 400)
-    users = sb_select('users', filters={'id': teacher_id})
-    if not users or users[0].get('role') not in ('teacher', 'admin'):
-        return None, (jsonify({'error': 'Unauthorized'}), 403)
-    return teacher_id, None
+EVENTS_PAGE_SIZE = int(os.environ.get('EVENTS_PAGE_SIZE', 500))
+EVENTS_MAX_PAGE_SIZE = int(os.environ.get('EVENTS_MAX_PAGE_SIZE', 5000))
 
-@app.route('/api/teacher/tasks', methods=['GET'])
-def get_teacher_tasks():
-    try:
-        teacher_id, err = require_teacher()
-        if err:
-            return err
-        tasks = sb_select('items', filters={'user_id': teacher_id}, order='-created_at')
-        # Only return tasks created by this teacher
-        teacher_tasks = [t for t in (tasks or []) if _is_teacher_task(t)]
-        return jsonify(teacher_tasks), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+PROGRESS_EVENT_TYPES = ('progress_started', 'progress_updated', 'room_completed')
 
-@app.route('/api/teacher/tasks', methods=['POST'])
-def create_teacher_task():
+def read_events(after=None, types=None, user_id=None, limit=EVENTS_PAGE_SIZE):
+    """Settled events after an offset, in (change_xid, seq) order.
+
+    seq is taken when a row is written, so a transaction still running can
+    commit a lower seq after a higher one has been read. Events are read
+    only below the commit horizon and ordered by the writing transaction
+    first, so nothing can later commit behind an offset. Returns
+    (events, next_offset, has_more); offsets are (change_xid, seq) tuples.
+    """
+    horizon = commit_horizon()
+    filters = {'change_xid': ('lt', horizon)}
+    if types:
+        filters['type'] = list(types)
+    if user_id is not None:
+        filters['user_id'] = user_id
+    rows = sb_select('events', filters=filters, or_filters=after_position(after, 'seq') if after else None,
+                     order='change_xid,seq', limit=limit + 1)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, change_position(rows[-1], 'seq'), True
+    # Every matching event below the horizon has been read
+    return rows, max((horizon, 0), after or (0, 0)), False
+
+@app.route('/api/admin/events', methods=['GET'])
+@require_admin()
+def get_events():
+    """Read the event log from an offset.
+
+    ?after=<next_offset from the previous call> (omit to start from the
+    oldest event), ?limit=N, ?type=progress_updated,badge_earned and
+    ?user_id=N. Resume from next_offset while has_more is true.
+    """
     try:
-        teacher_id, err = require_teacher()
-        if err:
-            return err
-        data = request.get_json() or {}
-        title = (data.get('title') or '').strip()
-        if not title:
-            return jsonify({'error': 'Title is required'}), 400
-        task_data = {
-            'title': title,
-            'description': data.get('description', '{}'),
-            'user_id': teacher_id,
-            'created_at': datetime.now().isoformat()
-        }
-        result = sb_insert('items', task_data)
-        return jsonify(result or task_data), 201
+        try:
+            after = parse_position(request.args['after']) if request.args.get('after') else None
+            limit = min(max(int(request.args.get('limit', EVENTS_PAGE_SIZE)), 1), EVENTS_MAX_PAGE_SIZE)
+            user_id = int(request.args['user_id']) if request.args.get('user_id') else None
+        except ValueError:
+            return jsonify({'error': 'after must be a next_offset; limit and user_id must be integers'}), 400
+        types = [t.strip() for t in request.args.get('type', '').split(',') if t.strip()]
+
+        events, next_offset, has_more = read_events(after, types, user_id, limit)
+        return jsonify({
+            'events': events,
+            'next_offset': encode_position(next_offset),
+            'has_more': has_more
+        }), 200
     except Exception as e:
+        print(f"Event log error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/teacher/tasks/<int:task_id>', methods=['PUT'])
-def update_teacher_task(task_id):
-    try:
-        teacher_id, err = require_teacher()
-        if err:
-            return err
-        tasks = sb_select('items', filters={'id': task_id})
-        if not tasks:
-            return jsonify({'error': 'Task not found'}), 404
-        if tasks[0].get('user_id') != teacher_id:
-            return jsonify({'error': 'Forbidden'}), 403
-        data = request.get_json() or {}
-        update_payload = {}
-        if 'title' in data and data['title'].strip():
-            update_payload['title'] = data['title'].strip()
-        if 'description' in data:
-            update_payload['description'] = data['description']
+# ============================================================
+# AUDIT LOG
+# ============================================================
+
+AUDIT_PAGE_SIZE = int(os.environ.get('AUDIT_PAGE_SIZE', 100))
+AUDIT_MAX_PAGE_SIZE = int(os.environ.get('AUDIT_MAX_PAGE_SIZE', 1000))
+AUDIT_EXPORT_BATCH_SIZE = int(os.environ.get('AUDIT_EXPORT_BATCH_SIZE', 1000))
+AUDIT_EXPORT_MAX_ROWS = int(os.environ.get('AUDIT_EXPORT_MAX_ROWS', 1000000))
+
+def _parse_audit_time(value):
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).isoformat()
+
+def parse_audit_filters(args):
+    """Build admin_actions filters from query parameters; raises ValueError.
+
+    since/until bound the timestamp (until is exclusive), so a time range
+    only touches the monthly partitions it overlaps.
+    """
+    filters = {}
+    for param in ('admin_user_id', 'target_user_id'):
+        if args.get(param):
+            filters[param] = int(args[param])
+    action_types = [t.strip().upper() for t in args.get('action_type', '').split(',') if t.strip()]
+    if action_types:
+        filters['action_type'] = action_types if len(action_types) > 1 else action_types[0]
+    bounds = []
+    if args.get('since'):
+        bounds.append(('gte', _parse_audit_time(args['since'])))
+    if args.get('until'):
+        bounds.append(('lt', _parse_audit_time(args['until'])))
+    if bounds:
+        filters['timestamp'] = bounds
+    return filters
+
+def encode_audit_cursor(cursor):
+    timestamp, action_id = cursor
+    return base64.urlsafe_b64encode(f"{timestamp}|{action_id}".encode()).decode().rstrip('=')
+
+def parse_audit_cursor(cursor):
+    """Decode a cursor into (timestamp, id); raises ValueError"""
+    try:
+        text = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+    timestamp, _, action_id = text.rpartition('|')
+    if not timestamp:
+        raise ValueError('Invalid cursor')
+    return timestamp, int(action_id)
+
+def fetch_audit_page(filters, cursor, limit):
+    """One page of admin_actions, newest first, strictly after a keyset cursor.
+
+    Keyset rather than offset pagination: each page seeks straight to its
+    position in the (timestamp, id) index however deep the reader is.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    or_filters = None
+    if cursor:
+        timestamp, action_id = cursor
+        or_filters = {'timestamp': ('lt', timestamp), 'and': {'timestamp': timestamp, 'id': ('lt', action_id)}}
+    rows = sb_select('admin_actions', filters=filters, or_filters=or_filters,
+                     order='-timestamp,-id', limit=limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    user_ids = sorted({r[c] for r in rows for c in ('admin_user_id', 'target_user_id') if r.get(c) is not None})
+    names = {}
+    if user_ids:
+        names = {u['id']: u['name'] for u in sb_select('users', select='id, name', filters={'id': user_ids})}
+    for row in rows:
+        row['admin_name'] = names.get(row.get('admin_user_id'))
+        row['target_name'] = names.get(row.get('target_user_id'))
+
+    next_cursor = (rows[-1]['timestamp'], rows[-1]['id']) if has_more else None
+    return rows, next_cursor
+
+@app.route('/api/admin/audit', methods=['GET'])
+@require_admin()
+def get_audit_log():
+    """Query the admin audit trail, newest first.
+
+    Filters: ?admin_user_id, ?target_user_id, ?action_type (comma-separated)
+    and ?since/?until (ISO 8601). Pages with ?limit and the returned
+    next_cursor (?cursor=). ?format=ndjson (or Accept: application/x-ndjson)
+    streams every matching row, one JSON object per line, up to
+    AUDIT_EXPORT_MAX_ROWS.
+    """
+    try:
+        filters = parse_audit_filters(request.args)
+        cursor = parse_audit_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        limit = min(max(int(request.args.get('limit', AUDIT_PAGE_SIZE)), 1), AUDIT_MAX_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid audit query: {str(e)}'}), 400
+
+    if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        log_admin_action('EXPORT_AUDIT', f"Exported audit log with filters {request.args.to_dict()}")
+
+        def generate():
+            position, sent = cursor, 0
+            try:
+                while sent < AUDIT_EXPORT_MAX_ROWS:
+                    rows, position = fetch_audit_page(
+                        filters, position, min(AUDIT_EXPORT_BATCH_SIZE, AUDIT_EXPORT_MAX_ROWS - sent))
+                    for row in rows:
+                        yield json.dumps(row, default=str) + '\n'
+                    sent += len(rows)
+                    if position is None:
+                        break
+            except Exception as e:
+                # Headers are already sent; end the stream with an error line
+                print(f"Audit export error: {str(e)}")
+                yield json.dumps({'error': str(e)}) + '\n'
+
+        return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson',
+                                  headers={'Content-Disposition': 'attachment; filename=audit-log.ndjson'})
+
+    try:
+        rows, next_cursor = fetch_audit_page(filters, cursor, limit)
+        return jsonify({
+            'actions': rows,
+            'next_cursor': encode_audit_cursor(next_cursor) if next_cursor else None,
+            'has_more': next_cursor is not None
+        }), 200
+    except Exception as e:
+        print(f"Audit log error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# ============================================================
+# INCREMENTAL SYNC
+# ============================================================
+
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', 500))
+SYNC_MAX_PAGE_SIZE = int(os.environ.get('SYNC_MAX_PAGE_SIZE', 2000))
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.environ.get('SYNC_TOMBSTONE_RETENTION_DAYS', 30))
+
+# table -> (columns sent to clients, column holding the owning user's id).
+# Rows without an owner column are shared with every caller.
+SYNC_TABLES = {
+    'users': ('id, name, email, full_name, role, is_active, email_verified, profile_image, bio, skill_level, '
+              'total_score, current_streak, longest_streak, last_activity, last_login, created_at, updated_at, '
+              'change_seq, change_xid', 'id'),
+    'user_progress': ('*', 'user_id'),
+    'badges': ('*', 'user_id'),
+    'items': ('*', None),
+}
+
+metrics.describe('sync_rows_total', 'counter', 'Changed and deleted rows returned by /api/sync, by table.')
+
+def commit_horizon():
+    """Oldest running transaction id. Rows with a lower change_xid are final,
+    and no transaction can commit one later."""
+    return int(sb_rpc('commit_horizon') or 0)
+
+def change_position(row, seq_column='change_seq'):
+    """A row's place in (change_xid, seq) order; PostgREST renders xid8 as a string"""
+    return int(row['change_xid']), row[seq_column]
+
+def after_position(position, seq_column='change_seq', scope=None):
+    """or_filters for rows after a (change_xid, seq) position, optionally also
+    matching any condition in scope"""
+    xid, seq = position
+    later = {'change_xid': ('gt', xid)}
+    same = {'change_xid': xid, seq_column: ('gt', seq)}
+    if scope:
+        return {'and': [{**later, 'or': scope}, {**same, 'or': scope}]}
+    return {**later, 'and': same}
+
+def encode_position(position):
+    return '.'.join(str(v) for v in position)
+
+def parse_position(text):
+    """Decode 'xid.seq' into a (change_xid, seq) tuple; raises ValueError"""
+    xid, seq = (int(v) for v in text.split('.'))
+    if xid < 0 or seq < 0:
+        raise ValueError('Invalid position')
+    return xid, seq
+
+def encode_sync_cursor(position):
+    return f'{encode_position(position)}.{int(time.time())}'
+
+def parse_sync_cursor(cursor):
+    """Split a cursor into ((change_xid, change_seq), issued_at); raises ValueError.
+
+    No cursor, or one issued before cursors were ordered by change_xid,
+    means a full snapshot. issued_at tells whether tombstones the client
+    hasn't seen may already have been pruned.
+    """
+    if not cursor:
+        return None, None
+    position, _, issued_at = cursor.rpartition('.')
+    issued_at = int(issued_at)
+    if '.' not in position:
+        int(position)  # seq.issued_at, from before cursors led with change_xid
+        return None, None
+    return parse_position(position), issued_at
+
+@app.route('/api/sync', methods=['GET'])
+def sync_changes():
+    """Rows changed since a cursor, for clients that keep a local copy.
+
+    ?since=<cursor> from the previous response (omit for a full snapshot,
+    'head' for just the current cursor), ?tables=users,user_progress,...
+    and ?limit=<rows per table>. Teachers and admins see every row; other
+    users see their own rows and shared items. Keep calling with the new
+    cursor while has_more is true; reset means the client should replace
+    its copy with what follows rather than merge into it.
+    """
+    try:
+        user_id = session.get('user_id') or request.headers.get('X-User-ID')
+        if not user_id:
+            return jsonify({'error': 'Authentication required'}), 401
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid user ID'}), 400
+
+        tables = [t.strip() for t in request.args.get('tables', '').split(',') if t.strip()] or list(SYNC_TABLES)
+        unknown = [t for t in tables if t not in SYNC_TABLES]
+        if unknown:
+            return jsonify({'error': f"Unknown tables: {', '.join(unknown)}"}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', SYNC_PAGE_SIZE)), 1), SYNC_MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+
+        # change_seq is taken at write time, so it doesn't follow commit
+        # order. Rows are paged in (change_xid, change_seq) order instead,
+        # and only below the horizon: every transaction there has finished,
+        # so nothing can later commit behind the cursor. The horizon is read
+        # before the rows so each of them is visible to the reads below.
+        horizon = commit_horizon()
+        since_arg = request.args.get('since')
+        if since_arg == 'head':
+            return jsonify({'cursor': encode_sync_cursor((horizon, 0)), 'has_more': False,
+                            'reset': False, 'changes': {}, 'deleted': {}}), 200
+        try:
+            since, issued_at = parse_sync_cursor(since_arg)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        if issued_at is not None and issued_at < time.time() - SYNC_TOMBSTONE_RETENTION_DAYS * 86400:
+            since = None
+
+        callers = sb_select('users', select='role', filters={'id': user_id})
+        if not callers:
+            return jsonify({'error': 'User not found'}), 404
+        scoped = callers[0].get('role') not in ('teacher', 'admin')
+
+        changes, page_ends = {}, []
+        for table in tables:
+            select, owner = SYNC_TABLES[table]
+            filters = {'change_xid': ('lt', horizon)}
+            if scoped and owner:
+                filters[owner] = user_id
+            rows = sb_select(table, select=select, filters=filters,
+                             or_filters=after_position(since) if since else None,
+                             order='change_xid,change_seq', limit=limit + 1)
+            if len(rows) > limit:
+                rows = rows[:limit]
+                page_ends.append(change_position(rows[-1]))
+            changes[table] = rows
+
+        # A fresh snapshot has nothing to delete
+        tombstones = []
+        if since:
+            filters = {'change_xid': ('lt', horizon), 'table_name': tables}
+            scope = None
+            if scoped:
+                scope = {'user_id': user_id}
+                if 'items' in tables:
+                    scope['table_name'] = 'items'
+            tombstones = sb_select('sync_tombstones', select='table_name, row_id, change_seq, change_xid',
+                                   filters=filters, or_filters=after_position(since, scope=scope),
+                                   order='change_xid,change_seq', limit=limit + 1)
+            if len(tombstones) > limit:
+                tombstones = tombstones[:limit]
+                page_ends.append(change_position(tombstones[-1]))
+
+        # When any table filled its page, stop at the earliest page end and
+        # leave later rows for the next call so no change is skipped.
+        # Otherwise everything below the horizon has been sent.
+        if page_ends:
+            cursor = min(page_ends)
+            changes = {t: [r for r in rows if change_position(r) <= cursor] for t, rows in changes.items()}
+            tombstones = [r for r in tombstones if change_position(r) <= cursor]
+        else:
+            cursor = max((horizon, 0), since or (0, 0))
+
+        deleted = {}
+        for row in tombstones:
+            deleted.setdefault(row['table_name'], []).append(row['row_id'])
+        for table in tables:
+            sent = len(changes[table]) + len(deleted.get(table, []))
+            if sent:
+                metrics.inc('sync_rows_total', sent, table=table)
+
+        return jsonify({
+            'cursor': encode_sync_cursor(cursor),
+            'has_more': bool(page_ends),
+            'reset': since is None,
+            'changes': changes,
+            'deleted': deleted
+        }), 200
+
+    except Exception as e:
+        print(f"Sync error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# ============================================================
+# TEACHER API ROUTES
+# ============================================================
+
+def require_teacher():
+    """Check that the requesting user has the teacher role.
+    Returns (user_id, None) on success or (None, error_response) on failure."""
+    teacher_id = request.headers.get('X-User-ID') or request.args.get('teacher_id')
+    if not teacher_id:
+        return None, (jsonify({'error': 'Teacher ID required'}), 401)
+    try:
+        teacher_id = int(teacher_id)
+    except (TypeError, ValueError):
+        return None, (jsonify({'error': 'Invalid teacher ID'}), 400)
+    users = sb_select('users', filters={'id': teacher_id})
+    if not users or users[0].get('role') not in ('teacher', 'admin'):
+        return None, (jsonify({'error': 'Unauthorized'}), 403)
+    return teacher_id, None
+
+TEACHER_TASK_DIFFICULTIES = ('easy', 'medium', 'hard')
+# Keys of the legacy JSON description that became columns (or were display-only)
+LEGACY_TASK_KEYS = ('type', 'teacher_task', 'room', 'room_display', 'difficulty', 'is_active')
+
+def parse_teacher_task(data, partial=False):
+    """Validate a task payload into teacher_tasks columns; raises ValueError.
+
+    Older clients send everything as a JSON string in 'description'; it is
+    unpacked here once so nothing downstream has to parse it again.
+    """
+    legacy = {}
+    if isinstance(data.get('description'), str):
+        try:
+            legacy = json.loads(data['description'] or '{}')
+        except ValueError:
+            legacy = {}
+        if not isinstance(legacy, dict):
+            legacy = {}
+
+    row = {}
+    if 'title' in data or not partial:
+        title = (data.get('title') or '').strip()
+        if not title:
+            raise ValueError('Title is required')
+        row['title'] = title
+    if 'task_type' in data or not partial:
+        row['task_type'] = (data.get('task_type') or '').strip() or 'teacher_task'
+
+    room = data.get('room_name', data.get('room', legacy.get('room')))
+    if room is not None:
+        resolved = room_registry.resolve(room)
+        if resolved is None:
+            raise ValueError(f'Unknown room: {room}')
+        row['room_name'] = resolved
+
+    difficulty = data.get('difficulty', legacy.get('difficulty'))
+    if difficulty is not None:
+        if difficulty not in TEACHER_TASK_DIFFICULTIES:
+            raise ValueError(f"Difficulty must be one of {', '.join(TEACHER_TASK_DIFFICULTIES)}")
+        row['difficulty'] = difficulty
+
+    if 'due_date' in data:
+        try:
+            row['due_date'] = datetime.fromisoformat(data['due_date']).isoformat() if data['due_date'] else None
+        except (TypeError, ValueError):
+            raise ValueError('due_date must be an ISO 8601 date')
+
+    is_active = data.get('is_active', legacy.get('is_active'))
+    if is_active is not None:
+        row['is_active'] = bool(is_active)
+
+    if data.get('target_progress') is not None:
+        try:
+            row['target_progress'] = int(data['target_progress'])
+        except (TypeError, ValueError):
+            raise ValueError('target_progress must be an integer')
+        if not 0 <= row['target_progress'] <= 100:
+            raise ValueError('target_progress must be between 0 and 100')
+
+    payload = data.get('payload')
+    if payload is None and legacy:
+        payload = {k: v for k, v in legacy.items() if k not in LEGACY_TASK_KEYS}
+    if payload is not None:
+        if not isinstance(payload, dict):
+            raise ValueError('payload must be an object')
+        row['payload'] = payload
+    return row
+
+@app.route('/api/teacher/tasks', methods=['GET'])
+def get_teacher_tasks():
+    """This teacher's tasks, newest first; ?task_type, ?room and ?active narrow the list"""
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        filters = {'user_id': teacher_id, 'task_type': request.args.get('task_type', 'teacher_task')}
+        if request.args.get('room'):
+            filters['room_name'] = normalize_room_name(request.args['room'])
+        if request.args.get('active') is not None:
+            filters['is_active'] = request.args['active'].lower() == 'true'
+        tasks = sb_select('teacher_tasks', filters=filters, order='-created_at')
+        return jsonify(tasks), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teacher/tasks', methods=['POST'])
+def create_teacher_task():
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        try:
+            task_data = parse_teacher_task(request.get_json() or {})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        task_data.update({
+            'user_id': teacher_id,
+            'created_at': datetime.now().isoformat(),
+            'updated_at': datetime.now().isoformat()
+        })
+        result = sb_insert('teacher_tasks', task_data)
+        return jsonify(result[0] if result else task_data), 201
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teacher/tasks/<int:task_id>', methods=['PUT'])
+def update_teacher_task(task_id):
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        try:
+            update_payload = parse_teacher_task(request.get_json() or {}, partial=True)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         if not update_payload:
             return jsonify({'error': 'No update data provided'}), 400
-        sb_update('items', update_payload, match_column='id', match_value=task_id)
-        return jsonify({'message': 'Task updated', 'id': task_id}), 200
+        update_payload['updated_at'] = datetime.now().isoformat()
+        # Scoped to the teacher, so another teacher's task id simply matches nothing
+        updated = sb_update('teacher_tasks', update_payload, filters={'id': task_id, 'user_id': teacher_id})
+        if not updated:
+            return jsonify({'error': 'Task not found'}), 404
+        task = updated[0]
+        if 'room_name' in update_payload or 'target_progress' in update_payload:
+            # A trigger re-checks the assignments after the update, so the
+            # returned row's completed_count predates it
+            task = load_owned_task(task_id, teacher_id) or task
+        return jsonify({'message': 'Task updated', 'id': task_id, 'task': task}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -2111,38 +3924,837 @@ def delete_teacher_task(task_id):
         teacher_id, err = require_teacher()
         if err:
             return err
-        tasks = sb_select('items', filters={'id': task_id})
-        if not tasks:
+        deleted = sb_delete('teacher_tasks', filters={'id': task_id, 'user_id': teacher_id})
+        if not deleted:
             return jsonify({'error': 'Task not found'}), 404
-        if tasks[0].get('user_id') != teacher_id:
-            return jsonify({'error': 'Forbidden'}), 403
-        sb_delete('items', match_column='id', match_value=task_id)
         return jsonify({'message': 'Task deleted'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Assignments: completed_at and the assigned/completed counters on
+# teacher_tasks are maintained by database triggers, so reads never need
+# to cross-reference students' progress.
+def load_owned_task(task_id, teacher_id, select='*'):
+    tasks = sb_select('teacher_tasks', select=select, filters={'id': task_id, 'user_id': teacher_id})
+    return tasks[0] if tasks else None
+
+def task_completion(task):
+    """Completion summary from a teacher_tasks row's counters"""
+    assigned = task.get('assigned_count') or 0
+    completed = task.get('completed_count') or 0
+    return {
+        'assigned': assigned,
+        'completed': completed,
+        'completion_rate': round(100 * completed / assigned, 1) if assigned else 0.0
+    }
+
+@app.route('/api/teacher/tasks/<int:task_id>/assign', methods=['POST'])
+def assign_teacher_task(task_id):
+    """Assign a task to a cohort (cohort_id) or to a list of students (user_ids)"""
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        data = request.get_json() or {}
+        task = load_owned_task(task_id, teacher_id, select='id, room_name, target_progress')
+        if task is None:
+            return jsonify({'error': 'Task not found'}), 404
+
+        cohort_id = None
+        not_students = []
+        if data.get('cohort_id') is not None:
+            user_ids, err = cohort_member_ids(data['cohort_id'], teacher_id)
+            if err:
+                return err
+            cohort_id = int(data['cohort_id'])
+        else:
+            try:
+                requested = parse_bulk_user_ids(data)
+            except ValueError as e:
+                return jsonify({'error': 'cohort_id or ' + str(e)}), 400
+            students = {u['id'] for u in sb_select('users', select='id', filters={'id': requested, 'role': 'user'})}
+            user_ids = [u for u in requested if u in students]
+            not_students = [u for u in requested if u not in students]
+
+        # Students already at the target start out completed
+        done = set()
+        if task.get('room_name') and user_ids:
+            progress = sb_select('user_progress', select='user_id, progress_percentage, completed',
+                                 filters={'user_id': user_ids, 'room_name': task['room_name']})
+            done = {p['user_id'] for p in progress
+                    if p.get('completed') or (p.get('progress_percentage') or 0) >= task['target_progress']}
+
+        now = datetime.now().isoformat()
+        rows = [{
+            'task_id': task_id,
+            'user_id': u,
+            'cohort_id': cohort_id,
+            'assigned_at': now,
+            'completed_at': now if u in done else None
+        } for u in user_ids]
+        assigned = []
+        for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+            inserted = sb_upsert('task_assignments', rows[start:start + BULK_INSERT_CHUNK_SIZE],
+                                 on_conflict='task_id,user_id', ignore_duplicates=True)
+            assigned.extend(r['user_id'] for r in inserted)
+
+        assigned_set = set(assigned)
+        return jsonify({
+            'assigned': assigned,
+            'already_assigned': [u for u in user_ids if u not in assigned_set],
+            'completed_on_assign': len(assigned_set & done),
+            'not_students': not_students
+        }), 200
+    except Exception as e:
+        print(f"Assign task error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teacher/tasks/<int:task_id>/assignments', methods=['GET'])
+def get_task_assignments(task_id):
+    """Who a task is assigned to and who has completed it"""
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        task = load_owned_task(task_id, teacher_id, select='id, title, assigned_count, completed_count')
+        if task is None:
+            return jsonify({'error': 'Task not found'}), 404
+        if request.args.get('counts_only', '').lower() == 'true':
+            return jsonify({'task_id': task_id, **task_completion(task)}), 200
+
+        filters = {'task_id': task_id}
+        status = request.args.get('status')
+        if status == 'completed':
+            filters['completed_at'] = ('not_.is_', 'null')
+        elif status == 'open':
+            filters['completed_at'] = ('is_', 'null')
+        assignments = sb_select('task_assignments', select='user_id, cohort_id, assigned_at, completed_at, users(name)',
+                                filters=filters, order='assigned_at')
+        for assignment in assignments:
+            user = assignment.pop('users', None)
+            assignment['user_name'] = user.get('name') if isinstance(user, dict) else None
+        return jsonify({'task_id': task_id, **task_completion(task), 'assignments': assignments}), 200
+    except Exception as e:
+        print(f"Get task assignments error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teacher/tasks/<int:task_id>/assignments', methods=['DELETE'])
+def unassign_teacher_task(task_id):
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        try:
+            user_ids = parse_bulk_user_ids(request.get_json() or {})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if load_owned_task(task_id, teacher_id, select='id') is None:
+            return jsonify({'error': 'Task not found'}), 404
+        removed = sb_delete('task_assignments', filters={'task_id': task_id, 'user_id': user_ids})
+        return jsonify({'removed': [r['user_id'] for r in removed]}), 200
+    except Exception as e:
+        print(f"Unassign task error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def cohort_member_ids(cohort_id, teacher_id):
+    """User ids in one of the teacher's cohorts, as (ids, None) or (None, error_response)"""
+    try:
+        cohort_id = int(cohort_id)
+    except (TypeError, ValueError):
+        return None, (jsonify({'error': 'Invalid cohort ID'}), 400)
+    cohort = load_owned_cohort(cohort_id, teacher_id, select='id, cohort_members(user_id)')
+    if cohort is None:
+        return None, (jsonify({'error': 'Cohort not found'}), 404)
+    return [m['user_id'] for m in cohort.get('cohort_members') or []], None
+
 @app.route('/api/teacher/students', methods=['GET'])
 def get_teacher_students():
+    """Students, newest first; ?cohort_id limits them to one of the teacher's cohorts"""
     try:
         teacher_id, err = require_teacher()
         if err:
             return err
-        students = sb_select('users', order='-created_at')
+        filters = {'role': 'user'}
+        if request.args.get('cohort_id'):
+            member_ids, err = cohort_member_ids(request.args['cohort_id'], teacher_id)
+            if err:
+                return err
+            if not member_ids:
+                return jsonify([]), 200
+            filters['id'] = member_ids
+        students = sb_select('users', filters=filters, order='-created_at')
         student_list = [
             s for s in (students or [])
-            if s.get('role', 'user') == 'user'
-            and s.get('name', '').lower() not in ('admin', 'teacher')
+            if s.get('name', '').lower() not in ('admin', 'teacher')
         ]
         return jsonify(student_list), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def _is_teacher_task(item):
+ROSTER_DEFAULT_PER_PAGE = 50
+ROSTER_MAX_PER_PAGE = 200
+ROSTER_USER_COLUMNS = 'id, name, email, total_score, current_streak, last_activity, created_at'
+ROSTER_PROGRESS_COLUMNS = ('user_id, room_name, progress_percentage, current_level, score, time_spent, '
+                           'completed, completed_at, last_accessed')
+
+@app.route('/api/teacher/roster', methods=['GET'])
+def get_teacher_roster():
+    """Students with their per-room progress matrix, a page at a time.
+
+    One users query and one user_progress query for the whole page,
+    pivoted into student -> room -> progress. ?room (repeatable or
+    comma-separated) narrows the matrix to those rooms and ?cohort_id
+    limits the students to one of the teacher's cohorts.
+    """
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        try:
+            page = max(1, int(request.args.get('page', 1)))
+            per_page = max(1, min(int(request.args.get('per_page', ROSTER_DEFAULT_PER_PAGE)), ROSTER_MAX_PER_PAGE))
+        except ValueError:
+            return jsonify({'error': 'page and per_page must be integers'}), 400
+
+        requested = [r for value in request.args.getlist('room') for r in value.split(',') if r.strip()]
+        rooms = list(room_registry.rooms)
+        if requested:
+            resolved = [room_registry.resolve(r.strip()) for r in requested]
+            unknown = [r for r, name in zip(requested, resolved) if name is None]
+            if unknown:
+                return jsonify({'error': f"Unknown room: {', '.join(unknown)}"}), 400
+            rooms = [name for name in rooms if name in resolved]
+
+        user_filters = {'role': 'user'}
+        if request.args.get('cohort_id'):
+            member_ids, err = cohort_member_ids(request.args['cohort_id'], teacher_id)
+            if err:
+                return err
+            if not member_ids:
+                return jsonify({'rooms': rooms, 'students': [], 'page': page, 'per_page': per_page,
+                                'has_more': False}), 200
+            user_filters['id'] = member_ids
+
+        # One extra row tells us whether another page exists without a count query
+        users = sb_select('users', select=ROSTER_USER_COLUMNS, filters=user_filters, order='name',
+                          limit=per_page + 1, offset=(page - 1) * per_page)
+        has_more = len(users) > per_page
+        students = [u for u in users[:per_page] if u.get('name', '').lower() not in ('admin', 'teacher')]
+
+        progress_rows = []
+        if students:
+            filters = {'user_id': [u['id'] for u in students]}
+            if requested:
+                filters['room_name'] = rooms
+            progress_rows = sb_select('user_progress', select=ROSTER_PROGRESS_COLUMNS, filters=filters)
+
+        matrix = {u['id']: dict.fromkeys(rooms) for u in students}
+        for row in progress_rows:
+            cells = matrix.get(row['user_id'])
+            if cells is not None and row['room_name'] in cells:
+                cells[row['room_name']] = {k: v for k, v in row.items() if k not in ('user_id', 'room_name')}
+
+        for student in students:
+            cells = [c for c in matrix[student['id']].values() if c]
+            student['progress'] = matrix[student['id']]
+            student['avg_progress'] = round(sum(c.get('progress_percentage') or 0 for c in cells) / len(cells), 1) if cells else 0.0
+            student['completed_rooms'] = sum(1 for c in cells if c.get('completed'))
+
+        return jsonify({
+            'rooms': rooms,
+            'students': students,
+            'page': page,
+            'per_page': per_page,
+            'has_more': has_more
+        }), 200
+    except Exception as e:
+        print(f"Teacher roster error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# ============================================================
+# COHORTS
+# ============================================================
+
+# cohort_room_stats, cohorts.member_count and cohort_members.last_active_at
+# are maintained by database triggers on user_progress and cohort_members,
+# so summaries read precomputed rows instead of scanning members' progress.
+COHORT_ACTIVE_WINDOW_DAYS = 7
+
+def load_owned_cohort(cohort_id, teacher_id, select='*'):
+    cohorts = sb_select('cohorts', select=select, filters={'id': cohort_id, 'teacher_id': teacher_id})
+    return cohorts[0] if cohorts else None
+
+def count_active_members(cohort_ids):
+    """cohort id -> members with progress in the last COHORT_ACTIVE_WINDOW_DAYS, in one query"""
+    counts = dict.fromkeys(cohort_ids, 0)
+    if cohort_ids:
+        since = (datetime.now() - timedelta(days=COHORT_ACTIVE_WINDOW_DAYS)).isoformat()
+        for row in sb_select('cohort_members', select='cohort_id',
+                             filters={'cohort_id': list(cohort_ids), 'last_active_at': ('gte', since)}):
+            counts[row['cohort_id']] += 1
+    return counts
+
+def summarize_cohort(cohort, active_members):
+    """Shape a cohorts row with embedded cohort_room_stats into the API summary"""
+    members = cohort.get('member_count') or 0
+    stats = {s['room_name']: s for s in cohort.get('cohort_room_stats') or []}
+    rooms = {}
+    for room_name in room_registry.rooms:
+        room_stats = stats.get(room_name, {})
+        completed = room_stats.get('completed_count') or 0
+        rooms[room_name] = {
+            # Members who haven't started a room count as 0%
+            'avg_progress': round((room_stats.get('progress_sum') or 0) / members, 1) if members else 0.0,
+            'started': room_stats.get('started_count') or 0,
+            'completed': completed,
+            'completion_rate': round(100 * completed / members, 1) if members else 0.0
+        }
+    return {
+        'id': cohort['id'],
+        'name': cohort['name'],
+        'member_count': members,
+        f'active_last_{COHORT_ACTIVE_WINDOW_DAYS}_days': active_members,
+        'created_at': cohort.get('created_at'),
+        'rooms': rooms
+    }
+
+def add_cohort_members(cohort_id, user_ids):
+    """Add existing students to a cohort; returns (added ids, ids that aren't students)"""
+    students = {u['id'] for u in sb_select('users', select='id', filters={'id': user_ids, 'role': 'user'})}
+    rows = [{'cohort_id': cohort_id, 'user_id': u} for u in user_ids if u in students]
+    added = []
+    for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+        inserted = sb_upsert('cohort_members', rows[start:start + BULK_INSERT_CHUNK_SIZE],
+                             on_conflict='cohort_id,user_id', ignore_duplicates=True)
+        added.extend(r['user_id'] for r in inserted)
+    return added, [u for u in user_ids if u not in students]
+
+@app.route('/api/teacher/cohorts', methods=['GET'])
+def get_teacher_cohorts():
+    """The teacher's cohorts with their precomputed per-room aggregates"""
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        cohorts = sb_select('cohorts', select='*, cohort_room_stats(*)', filters={'teacher_id': teacher_id},
+                            order='name')
+        active = count_active_members([c['id'] for c in cohorts])
+        return jsonify([summarize_cohort(c, active[c['id']]) for c in cohorts]), 200
+    except Exception as e:
+        print(f"Get cohorts error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teacher/cohorts', methods=['POST'])
+def create_cohort():
+    """Create a cohort, optionally with an initial list of user_ids"""
     try:
-        meta = json.loads(item.get('description') or '{}')
-        return meta.get('teacher_task') is True
-    except Exception:
-        return False
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        data = request.get_json() or {}
+        name = (data.get('name') or '').strip()
+        if not name:
+            return jsonify({'error': 'Cohort name is required'}), 400
+        user_ids = []
+        if data.get('user_ids'):
+            try:
+                user_ids = parse_bulk_user_ids(data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+        try:
+            created = sb_insert('cohorts', {'teacher_id': teacher_id, 'name': name,
+                                            'created_at': datetime.now().isoformat()})
+        except Exception as e:
+            # UNIQUE(teacher_id, name)
+            if 'duplicate key' in str(e) or '23505' in str(e):
+                return jsonify({'error': 'A cohort with this name already exists'}), 409
+            raise
+        cohort = created[0]
+        added, not_students = add_cohort_members(cohort['id'], user_ids) if user_ids else ([], [])
+        return jsonify({'id': cohort['id'], 'name': cohort['name'], 'added': added,
+                        'not_students': not_students}), 201
+    except Exception as e:
+        print(f"Create cohort error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teacher/cohorts/<int:cohort_id>', methods=['GET'])
+def get_cohort(cohort_id):
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        cohort = load_owned_cohort(cohort_id, teacher_id, select='*, cohort_room_stats(*)')
+        if cohort is None:
+            return jsonify({'error': 'Cohort not found'}), 404
+        return jsonify(summarize_cohort(cohort, count_active_members([cohort_id])[cohort_id])), 200
+    except Exception as e:
+        print(f"Get cohort error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teacher/cohorts/<int:cohort_id>', methods=['DELETE'])
+def delete_cohort(cohort_id):
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        deleted = sb_delete('cohorts', filters={'id': cohort_id, 'teacher_id': teacher_id})
+        if not deleted:
+            return jsonify({'error': 'Cohort not found'}), 404
+        return jsonify({'message': 'Cohort deleted'}), 200
+    except Exception as e:
+        print(f"Delete cohort error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teacher/cohorts/<int:cohort_id>/members', methods=['POST'])
+def add_members_to_cohort(cohort_id):
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        try:
+            user_ids = parse_bulk_user_ids(request.get_json() or {})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if load_owned_cohort(cohort_id, teacher_id, select='id') is None:
+            return jsonify({'error': 'Cohort not found'}), 404
+        added, not_students = add_cohort_members(cohort_id, user_ids)
+        return jsonify({'added': added, 'not_students': not_students}), 200
+    except Exception as e:
+        print(f"Add cohort members error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teacher/cohorts/<int:cohort_id>/members', methods=['DELETE'])
+def remove_members_from_cohort(cohort_id):
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        try:
+            user_ids = parse_bulk_user_ids(request.get_json() or {})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if load_owned_cohort(cohort_id, teacher_id, select='id') is None:
+            return jsonify({'error': 'Cohort not found'}), 404
+        removed = sb_delete('cohort_members', filters={'cohort_id': cohort_id, 'user_id': user_ids})
+        return jsonify({'removed': [r['user_id'] for r in removed]}), 200
+    except Exception as e:
+        print(f"Remove cohort members error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teacher/cohorts/<int:cohort_id>/recompute', methods=['POST'])
+def recompute_cohort(cohort_id):
+    """Rebuild a cohort's aggregates from user_progress, e.g. after editing rows by hand"""
+    try:
+        teacher_id, err = require_teacher()
+        if err:
+            return err
+        if load_owned_cohort(cohort_id, teacher_id, select='id') is None:
+            return jsonify({'error': 'Cohort not found'}), 404
+        sb_rpc('recompute_cohort_stats', {'p_cohort_id': cohort_id})
+        cohort = load_owned_cohort(cohort_id, teacher_id, select='*, cohort_room_stats(*)')
+        return jsonify(summarize_cohort(cohort, count_active_members([cohort_id])[cohort_id])), 200
+    except Exception as e:
+        print(f"Recompute cohort error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# ============================================================
+# BACKGROUND MAINTENANCE
+# ============================================================
+
+REAPER_ENABLED = os.environ.get('REAPER_ENABLED', 'true').lower() == 'true'
+REAPER_INTERVAL_SECONDS = int(os.environ.get('REAPER_INTERVAL_SECONDS', 300))
+REAPER_BATCH_SIZE = int(os.environ.get('REAPER_BATCH_SIZE', 200))
+REAPER_BATCH_PAUSE_SECONDS = float(os.environ.get('REAPER_BATCH_PAUSE_SECONDS', 0.5))
+REAPER_MAX_BATCHES = int(os.environ.get('REAPER_MAX_BATCHES', 25))
+
+# (job name, table, function returning the filters for rows to delete).
+# user_sessions isn't here: old sessions go with their monthly partition.
+REAPER_JOBS = (
+    ('expired_admin_sessions', 'admin_sessions', lambda now: {'expires_at': ('lt', now)}),
+    ('used_verification_codes', 'verification_codes', lambda now: {'used': True}),
+    ('expired_verification_codes', 'verification_codes', lambda now: {'expires_at': ('lt', now)}),
+    ('expired_temp_registrations', 'temp_registrations', lambda now: {'expires_at': ('lt', now)}),
+    ('old_sync_tombstones', 'sync_tombstones', lambda now: {'deleted_at': (
+        'lt', (datetime.fromisoformat(now) - timedelta(days=SYNC_TOMBSTONE_RETENTION_DAYS)).isoformat())}),
+)
+
+reaper_lock = threading.Lock()
+metrics.describe('reaper_deleted_rows_total', 'counter', 'Rows deleted by the background reaper, by job.')
+metrics.describe('reaper_runs_total', 'counter', 'Completed reaper runs.')
+metrics.describe('reaper_errors_total', 'counter', 'Reaper jobs that failed.')
+reaper_stats = {
+    'runs': 0,
+    'errors': 0,
+    'last_run_at': None,
+    'last_duration_seconds': None,
+    'last_error': None,
+    'deleted_total': {name: 0 for name, _, _ in REAPER_JOBS},
+    'deleted_last_run': {name: 0 for name, _, _ in REAPER_JOBS}
+}
+
+def reap_table(table, filters):
+    """Delete matching rows in batches of REAPER_BATCH_SIZE.
+
+    Each batch selects ids first so every delete is a bounded primary-key
+    delete, and sleeps between batches so the reaper never saturates the
+    database. Returns the number of rows deleted.
+    """
+    deleted = 0
+    for batch in range(REAPER_MAX_BATCHES):
+        rows = sb_select(table, select='id', filters=filters, limit=REAPER_BATCH_SIZE)
+        if not rows:
+            break
+        sb_delete(table, filters={'id': [r['id'] for r in rows]})
+        deleted += len(rows)
+        if len(rows) < REAPER_BATCH_SIZE:
+            break
+        time.sleep(REAPER_BATCH_PAUSE_SECONDS)
+    return deleted
+
+def run_reaper():
+    """Run every reaper job once and record what was deleted"""
+    with reaper_lock:
+        started = time.time()
+        now = datetime.now(timezone.utc).isoformat()
+        deleted_this_run = {}
+        for name, table, build_filters in REAPER_JOBS:
+            try:
+                deleted_this_run[name] = reap_table(table, build_filters(now))
+            except Exception as e:
+                deleted_this_run[name] = 0
+                reaper_stats['errors'] += 1
+                reaper_stats['last_error'] = f"{name}: {str(e)}"
+                metrics.inc('reaper_errors_total', job=name)
+                print(f"Reaper error ({name}): {str(e)}")
+
+        for name, count in deleted_this_run.items():
+            reaper_stats['deleted_total'][name] += count
+            metrics.inc('reaper_deleted_rows_total', count, job=name)
+        metrics.inc('reaper_runs_total')
+        reaper_stats['deleted_last_run'] = deleted_this_run
+        reaper_stats['runs'] += 1
+        reaper_stats['last_run_at'] = datetime.now(timezone.utc).isoformat()
+        reaper_stats['last_duration_seconds'] = round(time.time() - started, 3)
+
+        if any(deleted_this_run.values()):
+            print(f"🧹 Reaper removed {sum(deleted_this_run.values())} stale rows: {deleted_this_run}")
+        return deleted_this_run
+
+PARTITION_MAINTENANCE_ENABLED = os.environ.get('PARTITION_MAINTENANCE_ENABLED', 'true').lower() == 'true'
+PARTITION_MAINTENANCE_INTERVAL_SECONDS = int(os.environ.get('PARTITION_MAINTENANCE_INTERVAL_SECONDS', 6 * 3600))
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 2))
+# Monthly-partitioned table -> whole months kept before the current one
+PARTITION_RETENTION_MONTHS = {
+    'user_sessions': int(os.environ.get('USER_SESSIONS_RETENTION_MONTHS', 1)),
+    'admin_actions': int(os.environ.get('ADMIN_ACTIONS_RETENTION_MONTHS', 12)),
+    'events': int(os.environ.get('EVENTS_RETENTION_MONTHS', 6)),
+}
+
+partition_lock = threading.Lock()
+metrics.describe('partitions_created_total', 'counter', 'Monthly partitions created ahead of time, by table.')
+metrics.describe('partitions_dropped_total', 'counter', 'Monthly partitions dropped past retention, by table.')
+partition_stats = {
+    'runs': 0,
+    'errors': 0,
+    'last_run_at': None,
+    'last_error': None,
+    'created_last_run': {},
+    'dropped_last_run': {}
+}
+
+def run_partition_maintenance():
+    """Create upcoming monthly partitions and drop those past retention.
+
+    Dropping a month is a metadata change, so retention never runs a large
+    DELETE. Returns {'created': {table: n}, 'dropped': {table: n}}.
+    """
+    with partition_lock:
+        created, dropped = {}, {}
+        for table, keep_months in PARTITION_RETENTION_MONTHS.items():
+            try:
+                created[table] = int(sb_rpc('ensure_monthly_partitions', {
+                    'p_table': table, 'p_months_ahead': PARTITION_MONTHS_AHEAD}) or 0)
+                dropped[table] = int(sb_rpc('drop_old_partitions', {
+                    'p_table': table, 'p_keep_months': keep_months}) or 0)
+            except Exception as e:
+                partition_stats['errors'] += 1
+                partition_stats['last_error'] = f"{table}: {str(e)}"
+                print(f"Partition maintenance error ({table}): {str(e)}")
+                continue
+            metrics.inc('partitions_created_total', created[table], table=table)
+            metrics.inc('partitions_dropped_total', dropped[table], table=table)
+
+        partition_stats['runs'] += 1
+        partition_stats['last_run_at'] = datetime.now(timezone.utc).isoformat()
+        partition_stats['created_last_run'] = created
+        partition_stats['dropped_last_run'] = dropped
+        if any(created.values()) or any(dropped.values()):
+            print(f"🗂️ Partitions created {created}, dropped {dropped}")
+        return {'created': created, 'dropped': dropped}
+
+def _partition_maintenance_loop():
+    # Run straight away so a new month's partition exists before it's needed
+    while True:
+        try:
+            run_partition_maintenance()
+        except Exception as e:
+            print(f"Partition maintenance loop error: {str(e)}")
+        time.sleep(PARTITION_MAINTENANCE_INTERVAL_SECONDS)
+
+def _reaper_loop():
+    while True:
+        time.sleep(REAPER_INTERVAL_SECONDS)
+        try:
+            run_reaper()
+        except Exception as e:
+            print(f"Reaper loop error: {str(e)}")
+
+background_jobs_lock = threading.Lock()
+background_jobs_started = False
+
+@app.before_request
+def start_background_jobs():
+    """Start in-process background workers on the first request.
+
+    Started lazily rather than at import so the debug reloader's parent
+    process and one-off imports (scripts, benchmarks) don't spawn threads.
+    """
+    global background_jobs_started
+    if background_jobs_started:
+        return
+    with background_jobs_lock:
+        if background_jobs_started:
+            return
+        background_jobs_started = True
+        if REAPER_ENABLED:
+            threading.Thread(target=_reaper_loop, name='session-reaper', daemon=True).start()
+        if PROGRESS_COALESCE_ENABLED:
+            threading.Thread(target=progress_buffer.run, name='progress-flusher', daemon=True).start()
+        if PARTITION_MAINTENANCE_ENABLED:
+            threading.Thread(target=_partition_maintenance_loop, name='partition-maintenance', daemon=True).start()
+
+@app.route('/api/admin/maintenance/reaper', methods=['GET'])
+@require_admin()
+def get_reaper_stats():
+    """Report what the session reaper has deleted so far"""
+    return jsonify({
+        'enabled': REAPER_ENABLED,
+        'interval_seconds': REAPER_INTERVAL_SECONDS,
+        'batch_size': REAPER_BATCH_SIZE,
+        'stats': reaper_stats
+    }), 200
+
+@app.route('/api/admin/maintenance/reaper', methods=['POST'])
+@require_admin()
+def trigger_reaper():
+    """Run the session reaper immediately"""
+    try:
+        deleted = run_reaper()
+        log_admin_action('RUN_REAPER', f"Manual reaper run deleted {sum(deleted.values())} rows")
+        return jsonify({'message': 'Reaper run completed', 'deleted': deleted}), 200
+    except Exception as e:
+        print(f"Reaper trigger error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/maintenance/partitions', methods=['GET'])
+@require_admin()
+def get_partition_stats():
+    """Report partition maintenance settings and what the last runs did"""
+    return jsonify({
+        'enabled': PARTITION_MAINTENANCE_ENABLED,
+        'interval_seconds': PARTITION_MAINTENANCE_INTERVAL_SECONDS,
+        'months_ahead': PARTITION_MONTHS_AHEAD,
+        'retention_months': PARTITION_RETENTION_MONTHS,
+        'stats': partition_stats
+    }), 200
+
+@app.route('/api/admin/maintenance/partitions', methods=['POST'])
+@require_admin()
+def trigger_partition_maintenance():
+    """Create upcoming partitions and drop expired ones now"""
+    try:
+        result = run_partition_maintenance()
+        log_admin_action('RUN_PARTITION_MAINTENANCE',
+                         f"Created {sum(result['created'].values())} and dropped "
+                         f"{sum(result['dropped'].values())} partitions")
+        return jsonify({'message': 'Partition maintenance completed', **result}), 200
+    except Exception as e:
+        print(f"Partition maintenance trigger error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/maintenance/progress-buffer', methods=['GET'])
+@require_admin()
+def get_progress_buffer_stats():
+    """Pending coalesced progress writes and flush counters"""
+    return jsonify({
+        'enabled': PROGRESS_COALESCE_ENABLED,
+        'debounce_seconds': PROGRESS_COALESCE_DEBOUNCE_SECONDS,
+        'max_delay_seconds': PROGRESS_COALESCE_MAX_DELAY_SECONDS,
+        'max_events': PROGRESS_COALESCE_MAX_EVENTS,
+        'pending': len(progress_buffer),
+        'stats': progress_buffer.stats
+    }), 200
+
+@app.route('/api/admin/maintenance/progress-buffer', methods=['POST'])
+@require_admin()
+def flush_progress_buffer():
+    """Write every pending progress update now"""
+    try:
+        written = progress_buffer.flush(force=True)
+        return jsonify({'message': 'Progress buffer flushed', 'written': written}), 200
+    except Exception as e:
+        print(f"Progress buffer flush error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/achievements/catalog', methods=['GET'])
+@require_admin()
+def get_achievement_catalog_status():
+    """Version and freshness of the cached achievement definitions"""
+    return jsonify({
+        'version': achievement_catalog.version,
+        'definitions': len(achievement_catalog),
+        'rules': achievement_rules.rule_count,
+        'loaded_at': datetime.fromtimestamp(achievement_catalog.loaded_at).isoformat() if achievement_catalog.loaded_at else None,
+        'ttl_seconds': ACHIEVEMENT_CATALOG_TTL_SECONDS
+    }), 200
+
+@app.route('/api/admin/achievements/catalog', methods=['DELETE'])
+@require_admin()
+def invalidate_achievement_catalog():
+    """Reload achievement definitions now, e.g. after editing the table directly"""
+    if not achievement_catalog.invalidate():
+        return jsonify({'error': 'Achievement catalog reload failed', 'version': achievement_catalog.version}), 500
+    log_admin_action('INVALIDATE_ACHIEVEMENT_CATALOG', f"Achievement catalog reloaded at version {achievement_catalog.version}")
+    return jsonify({'message': 'Achievement catalog reloaded', 'version': achievement_catalog.version,
+                    'definitions': len(achievement_catalog)}), 200
+
+# ============================================================
+# ADMIN DIAGNOSTICS
+# ============================================================
+
+@app.route('/api/admin/traces', methods=['GET'])
+@require_admin()
+def get_recent_traces():
+    """Recent request traces, newest first, optionally filtered by route or duration"""
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), TRACE_RING_SIZE))
+        min_ms = float(request.args.get('min_ms', 0))
+        route = request.args.get('route')
+        traces = [
+            t for t in reversed(list(recent_traces))
+            if t['duration_ms'] >= min_ms and (not route or t['route'] == route)
+        ]
+        return jsonify({'enabled': TRACE_ENABLED, 'traces': traces[:limit]}), 200
+    except Exception as e:
+        print(f"Get traces error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/traces/<trace_id>', methods=['GET'])
+@require_admin()
+def get_trace(trace_id):
+    for trace in list(recent_traces):
+        if trace['trace_id'] == trace_id:
+            return jsonify(trace), 200
+    return jsonify({'error': 'Trace not found'}), 404
+
+@app.route('/api/admin/traces/slow-queries', methods=['GET'])
+@require_admin()
+def get_slow_queries():
+    """Supabase calls that exceeded SLOW_QUERY_MS, newest first"""
+    return jsonify({
+        'threshold_ms': SLOW_QUERY_MS,
+        'queries': list(reversed(list(slow_queries)))
+    }), 200
+
+@app.route('/api/admin/profiler/requests', methods=['GET'])
+@require_admin()
+def get_profiled_routes():
+    """Routes armed for cProfile and how many requests have been captured"""
+    with profiler_lock:
+        routes = [
+            {'route': route, 'remaining': t['remaining'], 'profiled': t['profiled'], 'armed_at': t['armed_at']}
+            for route, t in profiled_routes.items()
+        ]
+    return jsonify({'routes': routes}), 200
+
+@app.route('/api/admin/profiler/requests', methods=['POST'])
+@require_admin()
+def arm_route_profiler():
+    """Profile the next N requests to a route, e.g. {"route": "/api/admin/analytics/overview", "count": 5}"""
+    try:
+        data = request.get_json() or {}
+        route = data.get('route')
+        if route not in {rule.rule for rule in app.url_map.iter_rules()}:
+            return jsonify({'error': 'Unknown route'}), 400
+        count = max(1, min(int(data.get('count', 10)), PROFILER_MAX_REQUESTS))
+        with profiler_lock:
+            profiled_routes[route] = {
+                'remaining': count,
+                'profiled': 0,
+                'stats': None,
+                'armed_at': datetime.now(timezone.utc).isoformat()
+            }
+        return jsonify({'message': 'Profiler armed', 'route': route, 'count': count}), 200
+    except Exception as e:
+        print(f"Arm profiler error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/profiler/requests/results', methods=['GET'])
+@require_admin()
+def get_route_profile():
+    """Aggregated pstats text for an armed route (?route=&sort=cumulative&limit=50)"""
+    route = request.args.get('route')
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in pstats.Stats.sort_arg_dict_default:
+        return jsonify({'error': 'Invalid sort key'}), 400
+    limit = max(1, min(int(request.args.get('limit', 50)), 500))
+    with profiler_lock:
+        target = profiled_routes.get(route)
+        if target is None:
+            return jsonify({'error': 'Route is not being profiled'}), 404
+        if target['stats'] is None:
+            return jsonify({'error': 'No requests profiled yet', 'remaining': target['remaining']}), 404
+        header = f"# {route}: {target['profiled']} requests profiled, {target['remaining']} remaining\n"
+        text = header + format_pstats(target['stats'], sort, limit)
+    return app.response_class(text, mimetype='text/plain')
+
+@app.route('/api/admin/profiler/requests', methods=['DELETE'])
+@require_admin()
+def disarm_route_profiler():
+    route = request.args.get('route')
+    with profiler_lock:
+        if route:
+            profiled_routes.pop(route, None)
+        else:
+            profiled_routes.clear()
+    return jsonify({'message': 'Profiler disarmed'}), 200
+
+@app.route('/api/admin/profiler/sample', methods=['POST'])
+@require_admin()
+def sample_worker_stacks():
+    """Sample this worker's thread stacks for up to PROFILER_MAX_SAMPLE_SECONDS.
+
+    Returns collapsed stacks ("frame;frame;frame count" lines, the input
+    format of flamegraph.pl and speedscope) or JSON with format=json.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        seconds = max(0.1, min(float(data.get('seconds', 5)), PROFILER_MAX_SAMPLE_SECONDS))
+        interval = max(1, int(data.get('interval_ms', 10))) / 1000.0
+        counts, samples = sample_stacks(seconds, interval, include_idle=bool(data.get('include_idle')))
+        if data.get('format') == 'json':
+            stacks = sorted(counts.items(), key=lambda item: -item[1])
+            return jsonify({
+                'seconds': seconds,
+                'samples': samples,
+                'stacks': [{'stack': stack, 'count': count} for stack, count in stacks]
+            }), 200
+        text = '\n'.join(f'{stack} {count}' for stack, count in sorted(counts.items()))
+        return app.response_class(text + '\n', mimetype='text/plain')
+    except Exception as e:
+        print(f"Stack sampling error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
 # Complete the admin system
 print("🔧 Enhanced Admin system ready with Supabase!")
@@ -2152,7 +4764,7 @@ print("   • Live activity monitoring")
 print("   • Comprehensive analytics")
 print("   • Report generation")
 print("   • System health monitoring")
-print("   • Audit trail logging")
+print("   • Audit trail logging and search")
 
 if __name__ == '__main__':
     # Initialize Supabase connection and admin user
@@ -0,0 +1,168 @@
+"""Record PostgreSQL EXPLAIN plans for the app's hottest queries.
+
+Each entry in QUERIES mirrors an sb_select call site in app.py. Run once
+before applying the index section of database_schema.sql and once after,
+then compare the two snapshots:
+
+    python benchmarks/explain_plans.py --label before
+    # apply indexes
+    python benchmarks/explain_plans.py --label after
+    python benchmarks/explain_plans.py --compare before after
+
+Plans are fetched through PostgREST, which only serves them when plan output
+is enabled for the API role. Run this once in the Supabase SQL Editor:
+
+    ALTER ROLE authenticator SET pgrst.db_plan_enabled TO TRUE;
+    NOTIFY pgrst, 'reload config';
+"""
+import argparse
+import json
+import os
+import re
+import sys
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# name -> (call site, table, select, filters, order, limit). Filter values
+# follow apply_filters in app.py: a plain value is eq, a list is in and an
+# (op, value) tuple calls that operator.
+QUERIES = {
+    'badges_by_user_and_name': (
+        'award_badge_authenticated', 'badges', '*',
+        {'user_id': '{user_id}', 'badge_name': 'first_login'}, None, None),
+    'badges_by_user_recent': (
+        'get_user_badges', 'badges', '*', {'user_id': '{user_id}'}, '-earned_at', None),
+    'events_live_feed': (
+        'get_live_activity', 'events', '*',
+        {'ts': ('gt', '{day_ago}'), 'type': ['user_registered', 'progress_started', 'progress_updated',
+                                              'room_completed', 'badge_earned', 'achievement_earned',
+                                              'content_created']}, '-seq', 20),
+    'events_live_progress': (
+        'get_live_activity', 'events', 'user_id, room',
+        {'ts': ('gt', '{hour_ago}'), 'type': ['progress_started', 'progress_updated', 'room_completed']},
+        '-seq', 1000),
+    'user_progress_summary': (
+        'get_progress_summary', 'user_progress', '*, users(name)', None, '-last_accessed', None),
+    'user_progress_by_user_recent': (
+        'get_user_progress', 'user_progress', '*', {'user_id': '{user_id}'}, '-last_accessed', None),
+    'user_progress_by_user_room': (
+        'update_user_progress', 'user_progress', '*',
+        {'user_id': '{user_id}', 'room_name': 'flowchart'}, None, None),
+    'admin_sessions_active_token': (
+        'require_admin', 'admin_sessions', '*',
+        {'session_token': '{token}', 'is_active': True}, None, None),
+    'users_admin_by_email': (
+        'admin_login', 'users', '*',
+        {'email': 'admin@ascended.tech', 'role': 'admin', 'is_active': True}, None, None),
+    'users_by_role': (
+        'create_admin_user', 'users', '*', {'role': 'admin'}, None, None),
+    'users_recent': (
+        'get_teacher_students', 'users', '*', None, '-created_at', None),
+    'teacher_tasks_by_user_type_recent': (
+        'get_teacher_tasks', 'teacher_tasks', '*',
+        {'user_id': '{user_id}', 'task_type': 'teacher_task'}, '-created_at', None),
+}
+
+def _resolve(value, params):
+    if isinstance(value, str):
+        return value.format(**params)
+    return value
+
+def explain_query(client, spec, params, analyze=False):
+    """Return the text plan PostgREST produces for one audited query"""
+    _, table, select, filters, order, limit = spec
+    query = client.table(table).select(select)
+    for column, value in (filters or {}).items():
+        if isinstance(value, tuple):
+            op, operand = value
+            query = getattr(query, op)(column, _resolve(operand, params))
+        elif isinstance(value, list):
+            query = query.in_(column, value)
+        else:
+            query = query.eq(column, _resolve(value, params))
+    if order:
+        query = query.order(order.lstrip('-'), desc=order.startswith('-'))
+    if limit:
+        query = query.limit(limit)
+    response = query.explain(analyze=analyze, format='text').execute()
+    return response if isinstance(response, str) else str(response)
+
+def plan_nodes(plan_text):
+    """Extract the scan/sort node names from a text plan"""
+    return re.findall(r'((?:Parallel )?(?:Seq Scan|Index Only Scan|Index Scan|Bitmap Heap Scan|'
+                      r'Bitmap Index Scan|Sort|Incremental Sort)(?: using \w+)?(?: on \w+)?)', plan_text)
+
+def record(label, analyze=False, user_id=1, token='benchmark-token'):
+    """Run every audited query and store the plans under results/explain-<label>.json"""
+    load_dotenv()
+    from supabase import create_client
+
+    url = os.environ.get('SUPABASE_URL')
+    key = os.environ.get('SUPABASE_SERVICE_ROLE_KEY')
+    if not url or not key:
+        print('❌ SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set')
+        return False
+
+    client = create_client(url, key)
+    now = datetime.now(timezone.utc)
+    params = {'user_id': user_id, 'token': token,
+              'day_ago': (now - timedelta(days=1)).isoformat(), 'hour_ago': (now - timedelta(hours=1)).isoformat()}
+    snapshot = {
+        'label': label,
+        'analyze': analyze,
+        'recorded_at': datetime.now(timezone.utc).isoformat(),
+        'plans': {}
+    }
+
+    for name, spec in QUERIES.items():
+        try:
+            plan = explain_query(client, spec, params, analyze=analyze)
+            snapshot['plans'][name] = {'call_site': spec[0], 'table': spec[1], 'plan': plan}
+            print(f"✅ {name}: {', '.join(plan_nodes(plan)) or 'no scan nodes'}")
+        except Exception as e:
+            snapshot['plans'][name] = {'call_site': spec[0], 'table': spec[1], 'error': str(e)}
+            print(f"❌ {name}: {e}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'explain-{label}.json')
+    with open(path, 'w') as f:
+        json.dump(snapshot, f, indent=2)
+    print(f"\nPlans written to {path}")
+    return True
+
+def compare(before_label, after_label):
+    """Print the scan nodes of each query side by side"""
+    snapshots = []
+    for label in (before_label, after_label):
+        with open(os.path.join(RESULTS_DIR, f'explain-{label}.json')) as f:
+            snapshots.append(json.load(f)['plans'])
+
+    before, after = snapshots
+    for name in QUERIES:
+        old = plan_nodes(before.get(name, {}).get('plan', ''))
+        new = plan_nodes(after.get(name, {}).get('plan', ''))
+        marker = '  ' if old == new else '* '
+        print(f"{marker}{name}")
+        print(f"    {before_label}: {', '.join(old) or '-'}")
+        print(f"    {after_label}: {', '.join(new) or '-'}")
+    return True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--label', help='Snapshot name, e.g. "before" or "after"')
+    parser.add_argument('--analyze', action='store_true', help='Use EXPLAIN ANALYZE (executes the queries)')
+    parser.add_argument('--user-id', type=int, default=1, help='User id substituted into per-user queries')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='Compare two snapshots')
+    args = parser.parse_args()
+
+    if args.compare:
+        ok = compare(*args.compare)
+    elif args.label:
+        ok = record(args.label, analyze=args.analyze, user_id=args.user_id)
+    else:
+        parser.print_help()
+        ok = False
+    sys.exit(0 if ok else 1)
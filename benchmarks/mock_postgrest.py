@@ -0,0 +1,551 @@
+"""In-memory PostgREST-compatible server for benchmarks and local testing.
+
+Implements the subset of the PostgREST HTTP API that app.py uses through
+the supabase client: filtered/ordered/paginated selects with embedded
+resources (``*, users(name)``), ``or=`` filters, inserts, upserts,
+updates, deletes, RPC calls and read-only views, plus the unique
+constraints and the sync/event-log trigger effects the app relies on. Every request can be delayed by a fixed latency plus random jitter to
+model the network round trip to a hosted database.
+
+    from benchmarks.mock_postgrest import MockPostgrest
+    mock = MockPostgrest(latency_ms=5).start()
+    os.environ['SUPABASE_URL'] = mock.url
+"""
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit, unquote
+
+# Unique constraints from database_schema.sql, checked on insert/upsert
+UNIQUE_CONSTRAINTS = {
+    'users': [('email',), ('name',)],
+    'badges': [('user_id', 'badge_name')],
+    'user_progress': [('user_id', 'room_name')],
+    'user_achievements': [('user_id', 'achievement_id')],
+    'achievements': [('achievement_key',)],
+    'learning_rooms': [('room_name',)],
+    'user_sessions': [('session_token',)],
+    'admin_sessions': [('session_token',)],
+    'cohorts': [('teacher_id', 'name')],
+    'cohort_members': [('cohort_id', 'user_id')],
+    'cohort_room_stats': [('cohort_id', 'room_name')],
+    'task_assignments': [('task_id', 'user_id')],
+}
+
+# Columns filled in when an insert omits them
+COLUMN_DEFAULTS = {
+    'users': {'role': 'user', 'is_active': True, 'total_score': 0, 'current_streak': 0,
+              'longest_streak': 0, 'last_activity': None},
+    'user_progress': {'progress_percentage': 0, 'current_level': 1, 'score': 0, 'time_spent': 0,
+                      'attempts': 0, 'completed': False, 'completed_at': None},
+    'admin_sessions': {'is_active': True},
+    'verification_codes': {'used': False},
+    'achievements': {'is_active': True},
+    'cohorts': {'member_count': 0},
+    'cohort_members': {'last_active_at': None},
+    'teacher_tasks': {'task_type': 'teacher_task', 'difficulty': 'medium', 'is_active': True, 'payload': {},
+                      'target_progress': 100, 'assigned_count': 0, 'completed_count': 0},
+    'task_assignments': {'cohort_id': None, 'completed_at': None},
+}
+
+TIMESTAMP_DEFAULTS = {
+    'users': 'created_at', 'items': 'created_at', 'badges': 'earned_at',
+    'user_progress': 'last_accessed', 'user_achievements': 'earned_at',
+    'user_sessions': 'created_at', 'admin_sessions': 'created_at',
+    'admin_actions': 'timestamp', 'achievements': 'created_at',
+}
+
+# Tables numbered by the change_seq sync triggers: table -> owning user column.
+# Inserts and updates take the next change_seq; deletes leave sync_tombstones rows.
+# Every mock write commits at once, so each gets its own change_xid and
+# commit_horizon() is always past all of them.
+SYNC_TABLES = {'users': 'id', 'user_progress': 'user_id', 'badges': 'user_id', 'items': 'user_id'}
+
+PROGRESS_EVENT_COLUMNS = ('progress_percentage', 'current_level', 'score', 'completed')
+
+def _events_for(table, old, new):
+    """Events the schema's event triggers append for one inserted (old is None)
+    or updated row. Covers progress, badges, registrations and content."""
+    if table == 'user_progress':
+        if old is None:
+            kind = 'room_completed' if new.get('completed') else 'progress_started'
+        elif all(old.get(c) == new.get(c) for c in (*PROGRESS_EVENT_COLUMNS, 'time_spent')):
+            return []
+        else:
+            kind = 'room_completed' if new.get('completed') and not old.get('completed') else 'progress_updated'
+        return [{'type': kind, 'user_id': new['user_id'], 'room': new['room_name'],
+                 'payload': {c: new.get(c) for c in PROGRESS_EVENT_COLUMNS}}]
+    if old is not None:
+        return []
+    if table == 'badges':
+        return [{'type': 'badge_earned', 'user_id': new['user_id'],
+                 'payload': {'badge_name': new.get('badge_name'), 'badge_type': new.get('badge_type')}}]
+    if table == 'users':
+        return [{'type': 'user_registered', 'user_id': new['id'],
+                 'payload': {'name': new.get('name'), 'role': new.get('role')}}]
+    if table == 'items':
+        return [{'type': 'content_created', 'user_id': new.get('user_id'),
+                 'payload': {'item_id': new['id'], 'title': new.get('title')}}]
+    return []
+
+def _user_earned_achievements(mock):
+    """Rows of the user_earned_achievements view in database_schema.sql"""
+    achievements = {a['id']: a for a in mock.tables.get('achievements', [])}
+    rows = []
+    held = set()
+    for ua in mock.tables.get('user_achievements', []):
+        a = achievements.get(ua.get('achievement_id'))
+        if a is None:
+            continue
+        held.add((ua['user_id'], a['achievement_key']))
+        rows.append({
+            'user_id': ua['user_id'], 'source': 'achievement', 'badge_name': a['achievement_key'],
+            'badge_type': a.get('category'), 'title': a.get('title'), 'description': a.get('description'),
+            'icon': a.get('icon'), 'badge_color': a.get('badge_color'), 'points': a.get('points', 0),
+            'rarity': a.get('rarity'), 'earned_at': ua.get('earned_at'), 'progress_data': ua.get('progress_data')
+        })
+    for b in mock.tables.get('badges', []):
+        if (b['user_id'], b['badge_name']) in held:
+            continue
+        rows.append({
+            'user_id': b['user_id'], 'source': 'badge', 'badge_name': b['badge_name'],
+            'badge_type': b.get('badge_type'), 'title': b['badge_name'], 'description': None,
+            'icon': None, 'badge_color': None, 'points': 0, 'rarity': None,
+            'earned_at': b.get('earned_at'), 'progress_data': None
+        })
+    return rows
+
+# Read-only views, rebuilt from the tables on every select
+VIEWS = {
+    'user_earned_achievements': _user_earned_achievements,
+}
+
+def split_top_level(text, sep=','):
+    """Split on sep, ignoring separators inside parentheses or double quotes"""
+    parts, depth, quoted, current = [], 0, False, []
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if ch == '\\' and quoted and i + 1 < len(text):
+            current.append(text[i + 1])
+            i += 2
+            continue
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        if ch == sep and depth == 0 and not quoted:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(ch)
+        i += 1
+    parts.append(''.join(current))
+    return [p.strip() for p in parts if p.strip() != '']
+
+def _unquote_value(value):
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return value[1:-1]
+    return value
+
+def _coerce(raw, sample):
+    """Convert a filter value from the URL to the type of the stored value"""
+    if raw == 'null':
+        return None
+    if isinstance(sample, bool):
+        return raw.lower() == 'true'
+    if isinstance(sample, int):
+        try:
+            return int(raw)
+        except ValueError:
+            return raw
+    if isinstance(sample, float):
+        try:
+            return float(raw)
+        except ValueError:
+            return raw
+    if sample is None:
+        if raw in ('true', 'false'):
+            return raw == 'true'
+        if re.fullmatch(r'-?\d+', raw):
+            return int(raw)
+    return raw
+
+def _compare(op, stored, raw):
+    if op == 'is':
+        if raw == 'null':
+            return stored is None
+        return stored is (raw == 'true')
+    if op == 'in':
+        values = [_unquote_value(v) for v in split_top_level(raw.strip()[1:-1])]
+        return stored in [_coerce(v, stored) for v in values]
+    if op in ('like', 'ilike'):
+        if stored is None:
+            return False
+        pattern = '^' + re.escape(raw).replace('\\*', '.*').replace('%', '.*') + '$'
+        return re.match(pattern, str(stored), re.IGNORECASE if op == 'ilike' else 0) is not None
+    value = _coerce(_unquote_value(raw), stored)
+    if op == 'eq':
+        return stored == value
+    if op == 'neq':
+        return stored != value
+    if stored is None or value is None:
+        return False
+    try:
+        if op == 'gt':
+            return stored > value
+        if op == 'gte':
+            return stored >= value
+        if op == 'lt':
+            return stored < value
+        if op == 'lte':
+            return stored <= value
+    except TypeError:
+        return str(stored) > str(value) if op in ('gt', 'gte') else str(stored) < str(value)
+    raise ValueError(f'Unsupported operator: {op}')
+
+def _parse_condition(text):
+    """Parse 'col.op.value' (or 'col.not.op.value') from an or=/and= group"""
+    column, rest = text.split('.', 1)
+    negate = rest.startswith('not.')
+    if negate:
+        rest = rest[4:]
+    op, value = rest.split('.', 1)
+    return column, op, value, negate
+
+def _row_matches_logic(row, expression):
+    """Evaluate 'or(...)'/'and(...)' style expressions used by the or= parameter"""
+    kind, inner = expression.split('(', 1)
+    terms = split_top_level(inner[:-1])
+    results = []
+    for term in terms:
+        if term.startswith('or(') or term.startswith('and('):
+            results.append(_row_matches_logic(row, term))
+        else:
+            column, op, value, negate = _parse_condition(term)
+            matched = _compare(op, row.get(column), value)
+            results.append(not matched if negate else matched)
+    return any(results) if kind == 'or' else all(results)
+
+class MockPostgrest:
+    """In-memory tables served over a PostgREST-shaped HTTP API"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0.0, jitter_ms=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tables = {}
+        self.rpc_handlers = {'commit_horizon': lambda mock, params: mock._xid + 1}
+        self.request_count = 0
+        self.request_counts = {}
+        self._ids = {}
+        self._change_seq = 0
+        self._xid = 0
+        self._lock = threading.RLock()
+        self._random = random.Random(seed)
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-postgrest', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.request_count = 0
+            self.request_counts = {}
+
+    def register_rpc(self, name, handler):
+        """handler(mock, params) -> JSON-serializable result"""
+        self.rpc_handlers[name] = handler
+
+    # -- table operations -------------------------------------------------
+
+    def _append_events(self, table, old, new):
+        for event in _events_for(table, old, new):
+            self._ids['events'] = self._ids.get('events', 0) + 1
+            event.update(seq=self._ids['events'], ts=datetime.now(timezone.utc).isoformat(),
+                         change_xid=self._xid)
+            self.tables.setdefault('events', []).append(event)
+
+    def _stamp_change(self, row):
+        self._change_seq += 1
+        self._xid += 1
+        row['change_seq'] = self._change_seq
+        # PostgREST renders xid8 as a string; a number keeps the mock's
+        # filters and ordering numeric, and the app int()s either
+        row['change_xid'] = self._xid
+
+    def insert_rows(self, table, rows, on_conflict=None, resolution=None):
+        with self._lock:
+            data = self.tables.setdefault(table, [])
+            written = []
+            for row in rows:
+                row = dict(row)
+                for column, default in COLUMN_DEFAULTS.get(table, {}).items():
+                    row.setdefault(column, default)
+                ts_column = TIMESTAMP_DEFAULTS.get(table)
+                if ts_column and not row.get(ts_column):
+                    row[ts_column] = datetime.now(timezone.utc).isoformat()
+                if table in SYNC_TABLES or table == 'sync_tombstones':
+                    self._stamp_change(row)
+                conflict = self._find_conflict(table, row, on_conflict)
+                if conflict is not None:
+                    if resolution == 'ignore-duplicates':
+                        continue
+                    if resolution == 'merge-duplicates':
+                        old = dict(conflict)
+                        conflict.update(row)
+                        self._append_events(table, old, conflict)
+                        written.append(dict(conflict))
+                        continue
+                    raise ValueError(('23505', f'duplicate key value violates unique constraint "{table}_key"'))
+                if 'id' not in row or row['id'] is None:
+                    self._ids[table] = self._ids.get(table, 0) + 1
+                    row['id'] = self._ids[table]
+                else:
+                    self._ids[table] = max(self._ids.get(table, 0), row['id'])
+                data.append(row)
+                self._append_events(table, None, row)
+                written.append(dict(row))
+            return written
+
+    def _find_conflict(self, table, row, on_conflict):
+        constraints = list(UNIQUE_CONSTRAINTS.get(table, []))
+        if on_conflict:
+            constraints.append(tuple(c.strip() for c in on_conflict.split(',')))
+        if row.get('id') is not None:
+            constraints.append(('id',))
+        for columns in constraints:
+            if any(row.get(c) is None for c in columns):
+                continue
+            for existing in self.tables.get(table, []):
+                if all(existing.get(c) == row.get(c) for c in columns):
+                    return existing
+        return None
+
+    def _filter(self, table, params):
+        rows = VIEWS[table](self) if table in VIEWS else self.tables.get(table, [])
+        for key, value in params:
+            if key in ('select', 'order', 'limit', 'offset', 'on_conflict', 'columns'):
+                continue
+            if key in ('or', 'and'):
+                rows = [r for r in rows if _row_matches_logic(r, f'{key}{value}')]
+                continue
+            negate = value.startswith('not.')
+            if negate:
+                value = value[4:]
+            op, operand = value.split('.', 1)
+            rows = [r for r in rows if _compare(op, r.get(key), operand) != negate]
+        return rows
+
+    def _project(self, row, select):
+        columns = split_top_level(select or '*')
+        if any('*' in c for c in columns if '(' not in c) or not columns:
+            result = dict(row)
+        else:
+            result = {}
+        for column in columns:
+            if '(' in column:
+                name, inner = column.split('(', 1)
+                alias, _, name = name.rpartition(':')
+                embedded = self._embed(row, name.strip(), inner[:-1])
+                result[(alias or name).strip()] = embedded
+            elif '*' not in column and '.' not in column:
+                alias, _, name = column.rpartition(':')
+                result[(alias or name).strip()] = row.get(name.strip())
+        return result
+
+    def _embed(self, row, table, select):
+        fk = table[:-1] + '_id' if table.endswith('s') else table + '_id'
+        if fk in row:
+            for candidate in self.tables.get(table, []):
+                if candidate.get('id') == row[fk]:
+                    return self._project(candidate, select)
+            return None
+        # one-to-many: child rows pointing back at this row
+        parent_fk = None
+        for candidate in self.tables.get(table, []):
+            for key in candidate:
+                if key.endswith('_id') and candidate.get(key) == row.get('id'):
+                    parent_fk = key
+                    break
+            if parent_fk:
+                break
+        if not parent_fk:
+            return []
+        return [self._project(c, select) for c in self.tables.get(table, []) if c.get(parent_fk) == row.get('id')]
+
+    def select_rows(self, table, params):
+        with self._lock:
+            rows = self._filter(table, params)
+            options = dict(params)
+            if options.get('order'):
+                for term in reversed(split_top_level(options['order'])):
+                    parts = term.split('.')
+                    column, desc = parts[0], len(parts) > 1 and parts[1] == 'desc'
+                    present = [r for r in rows if r.get(column) is not None]
+                    missing = [r for r in rows if r.get(column) is None]
+                    present.sort(key=lambda r: r.get(column), reverse=desc)
+                    rows = (missing + present) if desc else (present + missing)
+            offset = int(options.get('offset', 0) or 0)
+            limit = options.get('limit')
+            rows = rows[offset:offset + int(limit)] if limit else rows[offset:]
+            return [self._project(r, options.get('select')) for r in rows]
+
+    def update_rows(self, table, params, values):
+        with self._lock:
+            matched = self._filter(table, params)
+            for row in matched:
+                old = dict(row)
+                row.update(values)
+                self._append_events(table, old, row)
+                if table in SYNC_TABLES:
+                    self._stamp_change(row)
+            return [dict(r) for r in matched]
+
+    def delete_rows(self, table, params):
+        with self._lock:
+            matched = self._filter(table, params)
+            ids = {id(r) for r in matched}
+            self.tables[table] = [r for r in self.tables.get(table, []) if id(r) not in ids]
+            if table in SYNC_TABLES and matched:
+                owner = SYNC_TABLES[table]
+                self.insert_rows('sync_tombstones', [
+                    {'table_name': table, 'row_id': r['id'], 'user_id': r.get(owner),
+                     'deleted_at': datetime.now(timezone.utc).isoformat()} for r in matched])
+            return [dict(r) for r in matched]
+
+    # -- HTTP -------------------------------------------------------------
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _delay(self):
+                delay = mock.latency_ms + (mock._random.uniform(0, mock.jitter_ms) if mock.jitter_ms else 0)
+                if delay > 0:
+                    time.sleep(delay / 1000.0)
+
+            def _send(self, status, payload):
+                body = json.dumps(payload, default=str).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                if isinstance(payload, list):
+                    self.send_header('Content-Range', f'0-{max(len(payload) - 1, 0)}/*')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'null') if length else None
+
+            def _route(self):
+                parts = urlsplit(self.path)
+                params = parse_qsl(parts.query, keep_blank_values=True)
+                segments = [unquote(s) for s in parts.path.split('/') if s]
+                if segments[:2] != ['rest', 'v1'] or len(segments) < 3:
+                    return None, None, params
+                if segments[2] == 'rpc':
+                    return 'rpc', segments[3], params
+                return 'table', segments[2], params
+
+            def _handle(self, method):
+                # Always drain the body so keep-alive connections stay in sync
+                body = self._body()
+                self._delay()
+                kind, name, params = self._route()
+                with mock._lock:
+                    mock.request_count += 1
+                    key = (method, name)
+                    mock.request_counts[key] = mock.request_counts.get(key, 0) + 1
+                if kind is None:
+                    return self._send(404, {'message': 'Not found'})
+                prefer = self.headers.get('Prefer', '')
+                try:
+                    if kind == 'rpc':
+                        handler = mock.rpc_handlers.get(name)
+                        if handler is None:
+                            return self._send(404, {'code': 'PGRST202', 'message': f'Function {name} not found'})
+                        return self._send(200, handler(mock, body or {}))
+                    if method == 'GET':
+                        return self._send(200, mock.select_rows(name, params))
+                    if method == 'POST':
+                        rows = body if isinstance(body, list) else [body]
+                        resolution = None
+                        for option in ('ignore-duplicates', 'merge-duplicates'):
+                            if f'resolution={option}' in prefer:
+                                resolution = option
+                        written = mock.insert_rows(name, rows, dict(params).get('on_conflict'), resolution)
+                        select = dict(params).get('select')
+                        if select:
+                            written = [mock._project(r, select) for r in written]
+                        return self._send(201, written if 'return=representation' in prefer else [])
+                    if method == 'PATCH':
+                        return self._send(200, mock.update_rows(name, params, body or {}))
+                    if method == 'DELETE':
+                        return self._send(200, mock.delete_rows(name, params))
+                except ValueError as e:
+                    if e.args and isinstance(e.args[0], tuple):
+                        code, message = e.args[0]
+                        return self._send(409, {'code': code, 'message': message, 'details': None, 'hint': None})
+                    return self._send(400, {'code': 'PGRST100', 'message': str(e), 'details': None, 'hint': None})
+                return self._send(405, {'message': 'Method not allowed'})
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_HEAD(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def do_PATCH(self):
+                self._handle('PATCH')
+
+            def do_DELETE(self):
+                self._handle('DELETE')
+
+        return Handler
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the mock PostgREST server')
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockPostgrest(port=args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms).start()
+    print(f"Mock PostgREST listening on {server.url} (latency {args.latency_ms}ms ± {args.jitter_ms}ms)")
+    print(f"   SUPABASE_URL={server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
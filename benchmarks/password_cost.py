@@ -0,0 +1,96 @@
+"""Measure login throughput at each password hashing cost setting.
+
+For every setting the seeded users are given a hash at that cost, then the
+login scenario from run_benchmarks.py is replayed against the PostgREST
+mock. Raw single-hash timings are recorded alongside, with and without the
+process pool, and the report is written to results/password-cost-<label>.json:
+
+    python benchmarks/password_cost.py --concurrency 8
+    python benchmarks/password_cost.py --workers 0 --label inline
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import password_hashing  # noqa: E402
+from benchmarks.run_benchmarks import (  # noqa: E402
+    RESULTS_DIR, SEED_PASSWORD, git_revision, run_scenario, start_environment
+)
+
+# label -> password_hashing.configure() arguments
+COST_SETTINGS = {
+    'pbkdf2-100k': {'algorithm': 'pbkdf2_sha256', 'pbkdf2_iterations': 100000},
+    'pbkdf2-310k': {'algorithm': 'pbkdf2_sha256', 'pbkdf2_iterations': 310000},
+    'pbkdf2-600k': {'algorithm': 'pbkdf2_sha256', 'pbkdf2_iterations': 600000},
+    'scrypt-n2^13': {'algorithm': 'scrypt', 'scrypt_n': 2 ** 13},
+    'scrypt-n2^14': {'algorithm': 'scrypt', 'scrypt_n': 2 ** 14},
+    'scrypt-n2^15': {'algorithm': 'scrypt', 'scrypt_n': 2 ** 15},
+}
+
+def time_single_hash(rounds=5):
+    started = time.perf_counter()
+    stored = None
+    for _ in range(rounds):
+        stored = password_hashing.hash_password(SEED_PASSWORD)
+    hash_ms = (time.perf_counter() - started) / rounds * 1000
+    started = time.perf_counter()
+    for _ in range(rounds):
+        password_hashing.verify_password(SEED_PASSWORD, stored)
+    verify_ms = (time.perf_counter() - started) / rounds * 1000
+    return stored, round(hash_ms, 2), round(verify_ms, 2)
+
+def run(label, settings, requests_count, concurrency, workers, latency_ms, users):
+    password_hashing.configure(workers=workers)
+    mock, app_module = start_environment(users, latency_ms, 0.0)
+    report = {
+        'label': label,
+        'git_revision': git_revision(),
+        'recorded_at': datetime.now(timezone.utc).isoformat(),
+        'config': {'requests': requests_count, 'concurrency': concurrency, 'workers': workers,
+                   'latency_ms': latency_ms, 'users': users},
+        'settings': {}
+    }
+
+    for name in settings:
+        password_hashing.configure(**COST_SETTINGS[name])
+        stored, hash_ms, verify_ms = time_single_hash()
+        for user in mock.tables['users']:
+            user['password_hash'] = stored
+        result = run_scenario(app_module, mock, 'login', requests_count, concurrency)
+        result.update({'settings': COST_SETTINGS[name], 'hash_ms': hash_ms, 'verify_ms': verify_ms})
+        report['settings'][name] = result
+        print(f"✅ {name:<14} hash {hash_ms:>7.1f}ms  verify {verify_ms:>7.1f}ms  "
+              f"login {result['throughput_rps']:>7.1f} req/s  p95 {result['latency_ms']['p95']:>8.1f}ms  "
+              f"errors {result['errors']}")
+
+    mock.stop()
+    password_hashing.shutdown_pool()
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'password-cost-{label}.json')
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {path}")
+    return True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--label', help='Result name (defaults to the git revision)')
+    parser.add_argument('--setting', action='append', choices=list(COST_SETTINGS),
+                        help='Cost setting to measure (repeatable; default: all)')
+    parser.add_argument('--requests', type=int, default=200, help='Logins per setting')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent workers')
+    parser.add_argument('--workers', type=int, default=password_hashing.PASSWORD_HASH_WORKERS,
+                        help='Hashing process pool size (0 hashes inline)')
+    parser.add_argument('--latency-ms', type=float, default=2.0, help='Mock database round-trip latency')
+    parser.add_argument('--users', type=int, default=50, help='Seeded users')
+    args = parser.parse_args()
+
+    ok = run(args.label or git_revision(), args.setting or list(COST_SETTINGS), args.requests,
+             args.concurrency, args.workers, args.latency_ms, args.users)
+    sys.exit(0 if ok else 1)
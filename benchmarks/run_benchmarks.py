@@ -0,0 +1,297 @@
+"""Load-test the API against the in-memory PostgREST mock.
+
+Starts benchmarks/mock_postgrest.py with the requested latency, points the
+app's supabase client at it, seeds users/progress/badges and drives each
+scenario from a pool of concurrent workers through Flask's test client.
+Throughput and latency percentiles are written to results/<label>.json
+(the label defaults to the current git commit), so two commits can be
+compared:
+
+    python benchmarks/run_benchmarks.py --latency-ms 5
+    git checkout other-branch
+    python benchmarks/run_benchmarks.py --latency-ms 5 --label other
+    python benchmarks/run_benchmarks.py --compare 1a2b3c4 other
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.mock_postgrest import MockPostgrest  # noqa: E402
+
+ROOMS = ['flowchart', 'networking', 'ai-training', 'database', 'programming']
+SEED_PASSWORD = 'benchmark-pass'
+ADMIN_TOKEN = 'benchmark-admin-token'
+
+def git_revision():
+    try:
+        sha = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                                      stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                        cwd=ROOT_DIR, stderr=subprocess.DEVNULL).decode().strip()
+        return f'{sha}-dirty' if dirty else sha
+    except Exception:
+        return 'unknown'
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def seed(mock, app_module, users=200):
+    """Fill the mock with users, progress rows, badges, rooms and an admin session"""
+    now = datetime.now(timezone.utc)
+    password_hash = app_module.hash_password(SEED_PASSWORD)
+    for i, room in enumerate(ROOMS):
+        meta = app_module.ROOM_METADATA[room]
+        mock.insert_rows('learning_rooms', [{
+            'room_name': room, 'display_name': meta['display_name'], 'code_name': meta['display_name'],
+            'description': meta['description'], 'icon': meta['icon'], 'color': meta['color'],
+            'aliases': list(meta['aliases']), 'sort_order': i, 'is_active': True
+        }])
+
+    mock.insert_rows('users', [{
+        'name': 'admin', 'email': 'admin@ascended.tech', 'password_hash': password_hash,
+        'role': 'admin', 'created_at': now.isoformat()
+    }])
+    rng = random.Random(7)
+    for i in range(users):
+        user_id = mock.insert_rows('users', [{
+            'name': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': password_hash,
+            'total_score': 0, 'created_at': (now - timedelta(minutes=i)).isoformat()
+        }])[0]['id']
+        for room in rng.sample(ROOMS, rng.randint(1, len(ROOMS))):
+            level = rng.randint(1, 5)
+            mock.insert_rows('user_progress', [{
+                'user_id': user_id, 'room_name': room, 'current_level': level,
+                'progress_percentage': (level - 1) * 20, 'score': level * 10,
+                'completed': False, 'last_accessed': (now - timedelta(seconds=rng.randint(0, 86400))).isoformat()
+            }])
+        if rng.random() < 0.5:
+            mock.insert_rows('badges', [{
+                'user_id': user_id, 'badge_name': 'first_login', 'badge_type': 'achievement',
+                'earned_at': now.isoformat()
+            }])
+
+    mock.insert_rows('admin_sessions', [{
+        'user_id': 1, 'session_token': ADMIN_TOKEN, 'is_active': True,
+        'expires_at': (now + timedelta(days=1)).isoformat()
+    }])
+
+def user_ids(mock):
+    return [u['id'] for u in mock.tables['users'] if u['role'] == 'user']
+
+# Each scenario returns a callable(client, worker_rng, i) -> response
+def scenario_login(mock):
+    names = [u['name'] for u in mock.tables['users'] if u['role'] == 'user']
+
+    def run(client, rng, i):
+        return client.post('/api/auth/login', json={
+            'username': rng.choice(names), 'password': SEED_PASSWORD
+        })
+    return run
+
+def scenario_progress_storm(mock):
+    ids = user_ids(mock)
+
+    def run(client, rng, i):
+        level = rng.randint(1, 5)
+        return client.post(f'/api/users/{rng.choice(ids)}/progress', json={
+            'room_name': rng.choice(ROOMS), 'current_level': level,
+            'progress_percentage': min(100, level * 20 - rng.randint(0, 19)),
+            'score': level * 10, 'time_spent': rng.randint(5, 120)
+        })
+    return run
+
+def scenario_dashboard_polling(mock):
+    ids = user_ids(mock)
+
+    def run(client, rng, i):
+        user_id = rng.choice(ids)
+        # The dashboard's two reads: progress summary, then badges and achievements together
+        if i % 2 == 0:
+            return client.get(f'/api/users/{user_id}/progress/summary')
+        return client.get('/api/achievements/user', headers={'X-User-ID': str(user_id)})
+    return run
+
+def scenario_admin_users(mock):
+    def run(client, rng, i):
+        return client.get('/api/admin/users', headers={'Authorization': f'Bearer {ADMIN_TOKEN}'})
+    return run
+
+def scenario_analytics(mock):
+    def run(client, rng, i):
+        path = '/api/admin/analytics/overview' if i % 2 == 0 else '/api/admin/activity/live'
+        return client.get(path, headers={'Authorization': f'Bearer {ADMIN_TOKEN}'})
+    return run
+
+# name -> (factory, default request count)
+SCENARIOS = {
+    'login': (scenario_login, 400),
+    'progress_write_storm': (scenario_progress_storm, 1000),
+    'dashboard_polling': (scenario_dashboard_polling, 1000),
+    'admin_user_listing': (scenario_admin_users, 20),
+    'analytics': (scenario_analytics, 40),
+}
+
+def run_scenario(app_module, mock, name, requests_count, concurrency):
+    factory, _ = SCENARIOS[name]
+    action = factory(mock)
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    counter = iter(range(requests_count))
+
+    def worker(worker_index):
+        client = app_module.app.test_client()
+        rng = random.Random(worker_index)
+        local_latencies, local_statuses = [], {}
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            started = time.perf_counter()
+            response = action(client, rng, i)
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[response.status_code] = local_statuses.get(response.status_code, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    mock.reset_counters()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if status >= 400)
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'duration_s': round(elapsed, 4),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'errors': errors,
+        'status_codes': {str(k): v for k, v in sorted(statuses.items())},
+        'db_requests': mock.request_count,
+        'db_requests_per_request': round(mock.request_count / len(latencies), 2) if latencies else 0.0,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+            'p50': round(percentile(latencies, 50) * 1000, 3),
+            'p90': round(percentile(latencies, 90) * 1000, 3),
+            'p95': round(percentile(latencies, 95) * 1000, 3),
+            'p99': round(percentile(latencies, 99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        }
+    }
+
+def start_environment(users, latency_ms, jitter_ms):
+    """Start and seed the mock, then import the app pointed at it"""
+    mock = MockPostgrest(latency_ms=0, seed=1).start()
+    os.environ['SUPABASE_URL'] = mock.url
+    os.environ.setdefault('SUPABASE_SERVICE_ROLE_KEY', 'benchmark.service.key')
+    os.environ.setdefault('REAPER_ENABLED', 'false')
+    os.environ.setdefault('PARTITION_MAINTENANCE_ENABLED', 'false')
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+    # Seeding needs the app's password hashing, so the registry is
+    # refreshed again once the learning_rooms rows exist
+    import app as app_module
+    seed(mock, app_module, users=users)
+    app_module.room_registry.refresh()
+    mock.latency_ms, mock.jitter_ms = latency_ms, jitter_ms
+    return mock, app_module
+
+def run(label, scenarios, latency_ms, jitter_ms, concurrency, users, scale):
+    mock, app_module = start_environment(users, latency_ms, jitter_ms)
+
+    report = {
+        'label': label,
+        'git_revision': git_revision(),
+        'recorded_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'config': {'latency_ms': latency_ms, 'jitter_ms': jitter_ms, 'concurrency': concurrency,
+                   'users': users, 'scale': scale},
+        'scenarios': {}
+    }
+
+    for name in scenarios:
+        count = max(1, int(SCENARIOS[name][1] * scale))
+        result = run_scenario(app_module, mock, name, count, concurrency)
+        report['scenarios'][name] = result
+        lat = result['latency_ms']
+        print(f"✅ {name:<22} {result['throughput_rps']:>8.1f} req/s  "
+              f"p50 {lat['p50']:>8.2f}ms  p95 {lat['p95']:>8.2f}ms  p99 {lat['p99']:>8.2f}ms  "
+              f"db/req {result['db_requests_per_request']:>5.1f}  errors {result['errors']}")
+
+    mock.stop()
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'{label}.json')
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {path}")
+    return True
+
+def compare(before_label, after_label, threshold):
+    """Print per-scenario deltas; returns False if any scenario regressed past threshold percent"""
+    reports = []
+    for label in (before_label, after_label):
+        with open(os.path.join(RESULTS_DIR, f'{label}.json')) as f:
+            reports.append(json.load(f))
+
+    before, after = reports
+    if before['config'] != after['config']:
+        print(f"⚠️  Configs differ: {before['config']} vs {after['config']}")
+
+    ok = True
+    for name, old in before['scenarios'].items():
+        new = after['scenarios'].get(name)
+        if not new:
+            print(f"   {name}: missing from {after_label}")
+            continue
+        rps_change = (new['throughput_rps'] - old['throughput_rps']) / old['throughput_rps'] * 100 if old['throughput_rps'] else 0.0
+        p95_old, p95_new = old['latency_ms']['p95'], new['latency_ms']['p95']
+        p95_change = (p95_new - p95_old) / p95_old * 100 if p95_old else 0.0
+        regressed = rps_change < -threshold or p95_change > threshold
+        ok = ok and not regressed
+        marker = '❌' if regressed else '✅'
+        print(f"{marker} {name:<22} req/s {old['throughput_rps']:>8.1f} -> {new['throughput_rps']:>8.1f} ({rps_change:+.1f}%)  "
+              f"p95 {p95_old:>8.2f} -> {p95_new:>8.2f}ms ({p95_change:+.1f}%)  "
+              f"db/req {old['db_requests_per_request']} -> {new['db_requests_per_request']}")
+    return ok
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--label', help='Result name (defaults to the git revision)')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='Scenario to run (repeatable; default: all)')
+    parser.add_argument('--latency-ms', type=float, default=2.0, help='Mock database round-trip latency')
+    parser.add_argument('--jitter-ms', type=float, default=1.0, help='Random extra latency per round trip')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent workers per scenario')
+    parser.add_argument('--users', type=int, default=200, help='Seeded users')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplier for each scenario\'s request count')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='Compare two result files')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Regression threshold in percent for --compare')
+    args = parser.parse_args()
+
+    if args.compare:
+        ok = compare(*args.compare, threshold=args.threshold)
+    else:
+        ok = run(args.label or git_revision(), args.scenario or list(SCENARIOS), args.latency_ms,
+                 args.jitter_ms, args.concurrency, args.users, args.scale)
+    sys.exit(0 if ok else 1)
@@ -18,9 +18,26 @@ DROP TABLE IF EXISTS user_sessions CASCADE;
 DROP TABLE IF EXISTS user_preferences CASCADE;
 DROP TABLE IF EXISTS system_config CASCADE;
 DROP TABLE IF EXISTS leaderboard CASCADE;
+DROP TABLE IF EXISTS events CASCADE;
+DROP TABLE IF EXISTS sync_tombstones CASCADE;
+DROP TABLE IF EXISTS task_assignments CASCADE;
+DROP TABLE IF EXISTS cohort_room_stats CASCADE;
+DROP TABLE IF EXISTS cohort_members CASCADE;
+DROP TABLE IF EXISTS cohorts CASCADE;
+DROP TABLE IF EXISTS teacher_tasks CASCADE;
 DROP TABLE IF EXISTS badges CASCADE;
 DROP TABLE IF EXISTS items CASCADE;
 DROP TABLE IF EXISTS users CASCADE;
+DROP SEQUENCE IF EXISTS change_seq CASCADE;
+
+-- Every insert or update on a synced table (users, user_progress, badges,
+-- items) takes the next value, and deletes leave a row in sync_tombstones
+-- numbered from the same sequence; /api/sync returns what changed after a
+-- client's cursor with one indexed range scan per table. Values are taken at
+-- write time, not commit time, so each row also records the writing
+-- transaction (change_xid). Cursors are (change_xid, change_seq) positions
+-- and only cover rows below commit_horizon(), so no commit can land behind one.
+CREATE SEQUENCE change_seq;
 
 -- Users table - Core user authentication and profile
 CREATE TABLE users (
@@ -41,7 +58,9 @@ CREATE TABLE users (
     last_activity TIMESTAMP,
     last_login TIMESTAMP,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    change_seq BIGINT NOT NULL DEFAULT nextval('change_seq'),
+    change_xid XID8 NOT NULL DEFAULT pg_current_xact_id()
 );
 
 -- Email verification codes table
@@ -65,16 +84,22 @@ CREATE TABLE temp_registrations (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
--- User sessions for login management
+-- User sessions for login management. One row per login, so it is split
+-- into monthly partitions by created_at (see ensure_monthly_partitions) and
+-- old months are dropped instead of deleted row by row. Unique keys on a
+-- partitioned table must include the partition key.
 CREATE TABLE user_sessions (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-    session_token TEXT UNIQUE NOT NULL,
+    session_token TEXT NOT NULL,
     ip_address TEXT,
     user_agent TEXT,
     expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at),
+    UNIQUE (session_token, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE TABLE user_sessions_default PARTITION OF user_sessions DEFAULT;
 
 -- Admin sessions for admin authentication
 CREATE TABLE admin_sessions (
@@ -87,16 +112,18 @@ CREATE TABLE admin_sessions (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
--- Admin actions audit log
+-- Admin actions audit log, partitioned by month like user_sessions
 CREATE TABLE admin_actions (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     admin_user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     action_type TEXT NOT NULL,
     target_user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     description TEXT,
     ip_address TEXT,
-    timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-);
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+CREATE TABLE admin_actions_default PARTITION OF admin_actions DEFAULT;
 
 -- Items/content table (for learning materials and user-generated content)
 CREATE TABLE items (
@@ -104,7 +131,70 @@ CREATE TABLE items (
     title TEXT NOT NULL,
     description TEXT,
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    change_seq BIGINT NOT NULL DEFAULT nextval('change_seq'),
+    change_xid XID8 NOT NULL DEFAULT pg_current_xact_id()
+);
+
+-- Tasks teachers design for their classes. Room, difficulty, due date and
+-- status are typed columns so listing filters in the database; the rest of
+-- the task (objectives, instructions, flags) lives in payload.
+CREATE TABLE teacher_tasks (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    title TEXT NOT NULL,
+    task_type TEXT NOT NULL DEFAULT 'teacher_task',
+    room_name TEXT,
+    difficulty TEXT DEFAULT 'medium' CHECK (difficulty IN ('easy','medium','hard')),
+    due_date TIMESTAMP WITH TIME ZONE,
+    is_active BOOLEAN DEFAULT TRUE,
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    target_progress INTEGER NOT NULL DEFAULT 100 CHECK (target_progress BETWEEN 0 AND 100),
+    assigned_count INTEGER NOT NULL DEFAULT 0,
+    completed_count INTEGER NOT NULL DEFAULT 0,
+    legacy_item_id INTEGER UNIQUE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Classes: a teacher owns cohorts and students can belong to several.
+-- cohort_room_stats holds per-room aggregates kept current by triggers.
+CREATE TABLE cohorts (
+    id SERIAL PRIMARY KEY,
+    teacher_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    member_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(teacher_id, name)
+);
+
+CREATE TABLE cohort_members (
+    cohort_id INTEGER NOT NULL REFERENCES cohorts(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    last_active_at TIMESTAMP WITH TIME ZONE,
+    joined_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (cohort_id, user_id)
+);
+
+CREATE TABLE cohort_room_stats (
+    cohort_id INTEGER NOT NULL REFERENCES cohorts(id) ON DELETE CASCADE,
+    room_name TEXT NOT NULL,
+    started_count INTEGER NOT NULL DEFAULT 0,
+    completed_count INTEGER NOT NULL DEFAULT 0,
+    progress_sum BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (cohort_id, room_name)
+);
+
+-- A teacher task handed to one student. completed_at is set by a trigger once
+-- the student's progress in the task's room reaches target_progress.
+CREATE TABLE task_assignments (
+    task_id INTEGER NOT NULL REFERENCES teacher_tasks(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    cohort_id INTEGER REFERENCES cohorts(id) ON DELETE SET NULL,
+    assigned_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    completed_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (task_id, user_id)
 );
 
 -- Simple badges table (compatible with existing app logic)
@@ -113,14 +203,52 @@ CREATE TABLE badges (
     user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     badge_name TEXT NOT NULL,
     badge_type TEXT DEFAULT 'achievement',
-    earned_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    earned_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    change_seq BIGINT NOT NULL DEFAULT nextval('change_seq'),
+    change_xid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    UNIQUE(user_id, badge_name)
 );
 
+-- Deleted rows of the synced tables, kept for SYNC_TOMBSTONE_RETENTION_DAYS
+-- so clients can drop them from their local copy. No foreign key: the owning
+-- user may be the row that was deleted.
+CREATE TABLE sync_tombstones (
+    id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    user_id INTEGER,
+    change_seq BIGINT NOT NULL DEFAULT nextval('change_seq'),
+    change_xid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    deleted_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Append-only history of progress, badge, achievement, user and content
+-- changes, written by triggers in the same transaction as the change.
+-- Consumers (the live activity feed, /api/admin/events) read it in seq
+-- order from an offset instead of rescanning current-state tables. seq is
+-- taken at write time, so change_xid records the writing transaction and
+-- offsets are (change_xid, seq) positions below commit_horizon().
+-- user_id has no foreign key so history outlives deleted users.
+-- Partitioned by month on ts; retention drops whole months.
+CREATE TABLE events (
+    seq BIGSERIAL,
+    type TEXT NOT NULL,
+    user_id INTEGER,
+    room TEXT,
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    ts TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    change_xid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    PRIMARY KEY (seq, ts)
+) PARTITION BY RANGE (ts);
+CREATE TABLE events_default PARTITION OF events DEFAULT;
+
 -- Learning rooms/modules configuration
 CREATE TABLE learning_rooms (
     id SERIAL PRIMARY KEY,
     room_name TEXT UNIQUE NOT NULL,
     display_name TEXT NOT NULL,
+    code_name TEXT,          -- Upper-case brand name shown in the UI, e.g. FLOWBYTE
+    aliases JSONB DEFAULT '[]'::jsonb,  -- Frontend names that resolve to this room
     description TEXT,
     difficulty_level INTEGER DEFAULT 1 CHECK (difficulty_level BETWEEN 1 AND 5),
     icon TEXT,
@@ -148,6 +276,8 @@ CREATE TABLE user_progress (
     completed_at TIMESTAMP WITH TIME ZONE,
     last_accessed TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     notes TEXT,
+    change_seq BIGINT NOT NULL DEFAULT nextval('change_seq'),
+    change_xid XID8 NOT NULL DEFAULT pg_current_xact_id(),
     UNIQUE(user_id, room_name)
 );
 
@@ -250,14 +380,13 @@ CREATE TABLE user_preferences (
     UNIQUE(user_id, preference_key)
 );
 
--- Insert default learning rooms
-INSERT INTO learning_rooms (room_name, display_name, description, difficulty_level, icon, color_theme, max_score) VALUES
-('flowchart', 'Flowchart Logic', 'Master the art of flowchart design and logical thinking', 1, 'bi-diagram-3', '#A069FF', 100),
-('netxus', 'NetXus Labs', 'Advanced network simulation and configuration challenges', 3, 'bi-hdd-network', '#00BCD4', 100),
-('networking', 'Network Engineering', 'Dive deep into network protocols and infrastructure', 2, 'bi-hdd-network', '#10a1fa', 100),
-('ai-training', 'AI & Machine Learning', 'Train AI models and understand machine learning concepts', 3, 'bi-robot', '#FFD700', 100),
-('database', 'Database Management', 'Design and optimize database systems', 2, 'bi-database', '#4CAF50', 100),
-('programming', 'Advanced Programming', 'Master programming concepts and algorithms', 4, 'bi-code-slash', '#FF5722', 100)
+-- Insert default learning rooms (the app's room registry is loaded from these rows)
+INSERT INTO learning_rooms (room_name, display_name, code_name, aliases, description, difficulty_level, icon, color_theme, max_score, sort_order) VALUES
+('flowchart', 'Flowchart Logic', 'FLOWBYTE', '["flowbyte"]', 'Master the art of flowchart design and logical thinking', 1, 'bi-diagram-3', '#005FFB', 100, 0),
+('networking', 'Network Engineering', 'NETXUS', '["netxus"]', 'Dive deep into network protocols and infrastructure', 2, 'bi-hdd-network', '#00A949', 100, 1),
+('ai-training', 'AI & Machine Learning', 'AITRIX', '["aitrix"]', 'Train AI models and understand machine learning concepts', 3, 'bi-robot', '#E08300', 100, 2),
+('database', 'Database Management', 'SCHEMAX', '["schemax"]', 'Design and optimize database systems', 2, 'bi-database', '#FF3600', 100, 3),
+('programming', 'Advanced Programming', 'CODEVANCE', '["codevance"]', 'Master programming concepts and algorithms', 4, 'bi-code-slash', '#FF006D', 100, 4)
 ON CONFLICT (room_name) DO NOTHING;
 
 -- Insert default achievements
@@ -341,24 +470,93 @@ INSERT INTO system_config (config_key, config_value, description) VALUES
 ON CONFLICT (config_key) DO NOTHING;
 
 -- Create indexes for better performance
-CREATE INDEX IF NOT EXISTS idx_users_name ON users(name);  -- Changed from username to name
-CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
+-- Each index below is derived from an sb_select/sb_update call site in app.py.
+-- Columns already covered by a UNIQUE constraint (users.name, users.email,
+-- *_sessions.session_token, temp_registrations.email,
+-- user_progress(user_id, room_name), badges(user_id, badge_name)) get no extra index.
+DROP INDEX IF EXISTS idx_users_name;
+DROP INDEX IF EXISTS idx_users_email;
+DROP INDEX IF EXISTS idx_user_progress_user_id;
+DROP INDEX IF EXISTS idx_user_sessions_token;
+DROP INDEX IF EXISTS idx_user_sessions_expires;
+DROP INDEX IF EXISTS idx_admin_sessions_token;
+DROP INDEX IF EXISTS idx_badges_user_id;
+DROP INDEX IF EXISTS idx_items_user_id;
+DROP INDEX IF EXISTS idx_temp_registrations_email;
+
+-- users: admin_login / create_admin_user filter on (role, is_active);
+-- get_users, admin_get_users, get_teacher_students, get_live_activity order by created_at
+CREATE INDEX IF NOT EXISTS idx_users_role_active ON users(role, is_active);
+CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users(last_activity);
-CREATE INDEX IF NOT EXISTS idx_user_progress_user_id ON user_progress(user_id);
-CREATE INDEX IF NOT EXISTS idx_user_progress_room_name ON user_progress(room_name);  -- Changed from room_id
-CREATE INDEX IF NOT EXISTS idx_user_achievements_user_id ON user_achievements(user_id);
-CREATE INDEX IF NOT EXISTS idx_user_sessions_token ON user_sessions(session_token);
-CREATE INDEX IF NOT EXISTS idx_user_sessions_expires ON user_sessions(expires_at);
-CREATE INDEX IF NOT EXISTS idx_admin_sessions_token ON admin_sessions(session_token);
+
+-- user_progress: get_user_progress / admin_get_user_progress filter by user and
+-- order by last_accessed; get_live_activity / get_progress_summary order globally
+CREATE INDEX IF NOT EXISTS idx_user_progress_user_last_accessed ON user_progress(user_id, last_accessed DESC);
+CREATE INDEX IF NOT EXISTS idx_user_progress_last_accessed ON user_progress(last_accessed DESC);
+CREATE INDEX IF NOT EXISTS idx_user_progress_room_name ON user_progress(room_name);
+
+-- badges: get_user_badges filters by user and orders by earned_at;
+-- get_live_activity / get_badges_summary order globally
+CREATE INDEX IF NOT EXISTS idx_badges_user_earned_at ON badges(user_id, earned_at DESC);
+CREATE INDEX IF NOT EXISTS idx_badges_earned_at ON badges(earned_at DESC);
+
+-- items: get_teacher_tasks filters by user and orders by created_at;
+-- get_items / get_live_activity order globally
+CREATE INDEX IF NOT EXISTS idx_items_user_created_at ON items(user_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_items_created_at ON items(created_at DESC);
+
+-- teacher_tasks: get_teacher_tasks filters by teacher and task_type, newest first
+CREATE INDEX IF NOT EXISTS idx_teacher_tasks_user_type ON teacher_tasks(user_id, task_type, created_at DESC);
+
+-- cohorts: teachers list their own cohorts (covered by UNIQUE(teacher_id, name));
+-- cohort_members: the progress trigger finds a student's cohorts by user_id, and
+-- cohort summaries count members active since a cutoff
+CREATE INDEX IF NOT EXISTS idx_cohort_members_user_id ON cohort_members(user_id);
+CREATE INDEX IF NOT EXISTS idx_cohort_members_active ON cohort_members(cohort_id, last_active_at DESC);
+
+-- task_assignments: the progress trigger looks up a student's open assignments
+CREATE INDEX IF NOT EXISTS idx_task_assignments_open ON task_assignments(user_id) WHERE completed_at IS NULL;
+
+-- sync: /api/sync scans each synced table (and the tombstones) in
+-- (change_xid, change_seq) order from the client's cursor up to the commit
+-- horizon; the reaper prunes tombstones by deleted_at
+CREATE INDEX IF NOT EXISTS idx_users_change_xid ON users(change_xid, change_seq);
+CREATE INDEX IF NOT EXISTS idx_user_progress_change_xid ON user_progress(change_xid, change_seq);
+CREATE INDEX IF NOT EXISTS idx_badges_change_xid ON badges(change_xid, change_seq);
+CREATE INDEX IF NOT EXISTS idx_items_change_xid ON items(change_xid, change_seq);
+CREATE INDEX IF NOT EXISTS idx_sync_tombstones_change_xid ON sync_tombstones(change_xid, change_seq);
+CREATE INDEX IF NOT EXISTS idx_sync_tombstones_deleted_at ON sync_tombstones(deleted_at);
+
+-- events: consumers read in (change_xid, seq) order from an offset,
+-- optionally narrowed to some event types or one user; the live feed and
+-- retention go by ts, which partition pruning handles without an index
+CREATE INDEX IF NOT EXISTS idx_events_change_xid ON events(change_xid, seq);
+CREATE INDEX IF NOT EXISTS idx_events_type_xid ON events(type, change_xid, seq);
+CREATE INDEX IF NOT EXISTS idx_events_user_xid ON events(user_id, change_xid, seq);
+
+-- admin_actions: /api/admin/audit pages newest first on (timestamp, id),
+-- optionally narrowed to one admin, one target user or some action types
+CREATE INDEX IF NOT EXISTS idx_admin_actions_timestamp ON admin_actions(timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_admin_actions_admin ON admin_actions(admin_user_id, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_admin_actions_target ON admin_actions(target_user_id, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_admin_actions_type ON admin_actions(action_type, timestamp DESC, id DESC);
+
+-- Sessions: require_admin looks up (session_token, is_active = TRUE); the partial
+-- index only holds live sessions so it stays small as old rows accumulate
+CREATE INDEX IF NOT EXISTS idx_admin_sessions_active_token ON admin_sessions(session_token) WHERE is_active = TRUE;
 CREATE INDEX IF NOT EXISTS idx_admin_sessions_expires ON admin_sessions(expires_at);
-CREATE INDEX IF NOT EXISTS idx_badges_user_id ON badges(user_id);
-CREATE INDEX IF NOT EXISTS idx_items_user_id ON items(user_id);
+CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id);
+
+-- user_achievements: the user_earned_achievements view filters by user and orders by earned_at
+DROP INDEX IF EXISTS idx_user_achievements_user_id;
+CREATE INDEX IF NOT EXISTS idx_user_achievements_user_earned_at ON user_achievements(user_id, earned_at DESC);
+
 CREATE INDEX IF NOT EXISTS idx_leaderboard_category ON leaderboard(category);
 CREATE INDEX IF NOT EXISTS idx_learning_items_room_id ON learning_items(room_id);
 CREATE INDEX IF NOT EXISTS idx_verification_codes_email ON verification_codes(email);
 CREATE INDEX IF NOT EXISTS idx_verification_codes_code ON verification_codes(code);
 CREATE INDEX IF NOT EXISTS idx_verification_codes_used ON verification_codes(used);
-CREATE INDEX IF NOT EXISTS idx_temp_registrations_email ON temp_registrations(email);
 CREATE INDEX IF NOT EXISTS idx_temp_registrations_expires ON temp_registrations(expires_at);
 
 -- Triggers: use PL/pgSQL functions and triggers in PostgreSQL
@@ -395,20 +593,574 @@ AFTER INSERT ON room_completions
 FOR EACH ROW
 EXECUTE FUNCTION trg_update_user_score_on_completion();
 
--- Cleanup expired sessions after a session is inserted
-CREATE OR REPLACE FUNCTION trg_cleanup_expired_sessions()
+-- Cohort aggregates: cohort_room_stats holds, per cohort and room, how many
+-- members started it, how many completed it and the sum of their progress.
+-- The triggers below keep it (and cohorts.member_count, cohort_members.last_active_at)
+-- current on every progress and membership change; recompute_cohort_stats rebuilds
+-- one cohort from scratch if it ever drifts.
+CREATE OR REPLACE FUNCTION apply_cohort_progress_delta(
+    p_user_id INTEGER, p_room_name TEXT, p_started INTEGER, p_completed INTEGER, p_progress BIGINT
+)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO cohort_room_stats (cohort_id, room_name, started_count, completed_count, progress_sum, updated_at)
+    SELECT cm.cohort_id, p_room_name, p_started, p_completed, p_progress, CURRENT_TIMESTAMP
+    FROM cohort_members cm
+    WHERE cm.user_id = p_user_id
+    ON CONFLICT (cohort_id, room_name) DO UPDATE
+    SET started_count = cohort_room_stats.started_count + EXCLUDED.started_count,
+        completed_count = cohort_room_stats.completed_count + EXCLUDED.completed_count,
+        progress_sum = cohort_room_stats.progress_sum + EXCLUDED.progress_sum,
+        updated_at = CURRENT_TIMESTAMP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_cohort_stats_on_progress()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.user_id = NEW.user_id AND OLD.room_name = NEW.room_name THEN
+        IF OLD.completed IS DISTINCT FROM NEW.completed
+           OR OLD.progress_percentage IS DISTINCT FROM NEW.progress_percentage THEN
+            PERFORM apply_cohort_progress_delta(
+                NEW.user_id, NEW.room_name, 0,
+                (CASE WHEN NEW.completed THEN 1 ELSE 0 END) - (CASE WHEN OLD.completed THEN 1 ELSE 0 END),
+                COALESCE(NEW.progress_percentage, 0) - COALESCE(OLD.progress_percentage, 0)
+            );
+        END IF;
+    ELSE
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM apply_cohort_progress_delta(
+                OLD.user_id, OLD.room_name, -1,
+                -(CASE WHEN OLD.completed THEN 1 ELSE 0 END), -COALESCE(OLD.progress_percentage, 0)
+            );
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM apply_cohort_progress_delta(
+                NEW.user_id, NEW.room_name, 1,
+                CASE WHEN NEW.completed THEN 1 ELSE 0 END, COALESCE(NEW.progress_percentage, 0)
+            );
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.last_accessed IS NOT NULL THEN
+        UPDATE cohort_members
+        SET last_active_at = NEW.last_accessed
+        WHERE user_id = NEW.user_id
+          AND (last_active_at IS NULL OR last_active_at < NEW.last_accessed);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS update_cohort_stats_on_progress ON user_progress;
+CREATE TRIGGER update_cohort_stats_on_progress
+AFTER INSERT OR UPDATE OR DELETE ON user_progress
+FOR EACH ROW
+EXECUTE FUNCTION trg_cohort_stats_on_progress();
+
+-- Joining or leaving a cohort adds or removes the member's existing progress
+CREATE OR REPLACE FUNCTION trg_cohort_stats_on_membership()
+RETURNS TRIGGER AS $$
+DECLARE
+    target_cohort INTEGER := CASE WHEN TG_OP = 'INSERT' THEN NEW.cohort_id ELSE OLD.cohort_id END;
+    member_id INTEGER := CASE WHEN TG_OP = 'INSERT' THEN NEW.user_id ELSE OLD.user_id END;
+    delta INTEGER := CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END;
+BEGIN
+    -- The cohort itself is being deleted; its stats go with it
+    IF NOT EXISTS (SELECT 1 FROM cohorts WHERE id = target_cohort) THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE cohorts SET member_count = member_count + delta WHERE id = target_cohort;
+
+    INSERT INTO cohort_room_stats (cohort_id, room_name, started_count, completed_count, progress_sum, updated_at)
+    SELECT target_cohort, up.room_name, delta,
+           delta * (CASE WHEN up.completed THEN 1 ELSE 0 END),
+           delta * COALESCE(up.progress_percentage, 0),
+           CURRENT_TIMESTAMP
+    FROM user_progress up
+    WHERE up.user_id = member_id
+    ON CONFLICT (cohort_id, room_name) DO UPDATE
+    SET started_count = cohort_room_stats.started_count + EXCLUDED.started_count,
+        completed_count = cohort_room_stats.completed_count + EXCLUDED.completed_count,
+        progress_sum = cohort_room_stats.progress_sum + EXCLUDED.progress_sum,
+        updated_at = CURRENT_TIMESTAMP;
+
+    IF TG_OP = 'INSERT' THEN
+        UPDATE cohort_members
+        SET last_active_at = (SELECT MAX(last_accessed) FROM user_progress WHERE user_id = member_id)
+        WHERE cohort_id = target_cohort AND user_id = member_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS update_cohort_stats_on_membership ON cohort_members;
+CREATE TRIGGER update_cohort_stats_on_membership
+AFTER INSERT OR DELETE ON cohort_members
+FOR EACH ROW
+EXECUTE FUNCTION trg_cohort_stats_on_membership();
+
+CREATE OR REPLACE FUNCTION recompute_cohort_stats(p_cohort_id INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    UPDATE cohorts
+    SET member_count = (SELECT COUNT(*) FROM cohort_members WHERE cohort_id = p_cohort_id)
+    WHERE id = p_cohort_id;
+
+    DELETE FROM cohort_room_stats WHERE cohort_id = p_cohort_id;
+    INSERT INTO cohort_room_stats (cohort_id, room_name, started_count, completed_count, progress_sum, updated_at)
+    SELECT p_cohort_id, up.room_name, COUNT(*), COUNT(*) FILTER (WHERE up.completed),
+           COALESCE(SUM(up.progress_percentage), 0), CURRENT_TIMESTAMP
+    FROM cohort_members cm
+    JOIN user_progress up ON up.user_id = cm.user_id
+    WHERE cm.cohort_id = p_cohort_id
+    GROUP BY up.room_name;
+
+    UPDATE cohort_members cm
+    SET last_active_at = latest.last_accessed
+    FROM (
+        SELECT up.user_id, MAX(up.last_accessed) AS last_accessed
+        FROM user_progress up
+        JOIN cohort_members m ON m.user_id = up.user_id AND m.cohort_id = p_cohort_id
+        GROUP BY up.user_id
+    ) latest
+    WHERE cm.cohort_id = p_cohort_id AND cm.user_id = latest.user_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Task assignments: teacher_tasks.assigned_count / completed_count are kept by
+-- statement-level triggers on task_assignments, so a fan-out of hundreds of rows
+-- costs one counter update per task. A progress write completes the student's open
+-- assignments for that room once it reaches the task's target_progress, and
+-- changing a task's room or target re-checks all of its assignments.
+CREATE OR REPLACE FUNCTION trg_task_counters_on_assign()
 RETURNS TRIGGER AS $$
 BEGIN
-    DELETE FROM user_sessions WHERE expires_at < CURRENT_TIMESTAMP;
+    UPDATE teacher_tasks t
+    SET assigned_count = t.assigned_count + d.assigned,
+        completed_count = t.completed_count + d.completed
+    FROM (
+        SELECT task_id, COUNT(*) AS assigned, COUNT(completed_at) AS completed
+        FROM new_assignments GROUP BY task_id
+    ) d
+    WHERE t.id = d.task_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_task_counters_on_unassign()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE teacher_tasks t
+    SET assigned_count = t.assigned_count - d.assigned,
+        completed_count = t.completed_count - d.completed
+    FROM (
+        SELECT task_id, COUNT(*) AS assigned, COUNT(completed_at) AS completed
+        FROM old_assignments GROUP BY task_id
+    ) d
+    WHERE t.id = d.task_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_task_counters_on_complete()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE teacher_tasks t
+    SET completed_count = t.completed_count + d.delta
+    FROM (
+        SELECT task_id, SUM(change) AS delta
+        FROM (
+            SELECT task_id, 1 AS change FROM new_assignments WHERE completed_at IS NOT NULL
+            UNION ALL
+            SELECT task_id, -1 FROM old_assignments WHERE completed_at IS NOT NULL
+        ) changes
+        GROUP BY task_id
+    ) d
+    WHERE t.id = d.task_id AND d.delta <> 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS task_counters_on_assign ON task_assignments;
+CREATE TRIGGER task_counters_on_assign
+AFTER INSERT ON task_assignments
+REFERENCING NEW TABLE AS new_assignments
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_task_counters_on_assign();
+
+DROP TRIGGER IF EXISTS task_counters_on_unassign ON task_assignments;
+CREATE TRIGGER task_counters_on_unassign
+AFTER DELETE ON task_assignments
+REFERENCING OLD TABLE AS old_assignments
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_task_counters_on_unassign();
+
+DROP TRIGGER IF EXISTS task_counters_on_complete ON task_assignments;
+CREATE TRIGGER task_counters_on_complete
+AFTER UPDATE ON task_assignments
+REFERENCING OLD TABLE AS old_assignments NEW TABLE AS new_assignments
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_task_counters_on_complete();
+
+CREATE OR REPLACE FUNCTION trg_complete_task_assignments()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- idx_task_assignments_open keeps this to the student's open assignments
+    UPDATE task_assignments ta
+    SET completed_at = CURRENT_TIMESTAMP
+    FROM teacher_tasks t
+    WHERE ta.user_id = NEW.user_id
+      AND ta.completed_at IS NULL
+      AND t.id = ta.task_id
+      AND t.room_name = NEW.room_name
+      AND (NEW.completed OR COALESCE(NEW.progress_percentage, 0) >= t.target_progress);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS complete_task_assignments_on_progress ON user_progress;
+CREATE TRIGGER complete_task_assignments_on_progress
+AFTER INSERT OR UPDATE ON user_progress
+FOR EACH ROW
+EXECUTE FUNCTION trg_complete_task_assignments();
+
+CREATE OR REPLACE FUNCTION trg_recheck_task_assignments()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE task_assignments ta
+    SET completed_at = CASE WHEN s.done THEN CURRENT_TIMESTAMP END
+    FROM (
+        SELECT a.user_id,
+               COALESCE(up.completed OR COALESCE(up.progress_percentage, 0) >= NEW.target_progress, FALSE) AS done
+        FROM task_assignments a
+        LEFT JOIN user_progress up ON up.user_id = a.user_id AND up.room_name = NEW.room_name
+        WHERE a.task_id = NEW.id
+    ) s
+    WHERE ta.task_id = NEW.id
+      AND ta.user_id = s.user_id
+      AND (ta.completed_at IS NOT NULL) <> s.done;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS recheck_task_assignments_on_target ON teacher_tasks;
+CREATE TRIGGER recheck_task_assignments_on_target
+AFTER UPDATE OF room_name, target_progress ON teacher_tasks
+FOR EACH ROW
+WHEN (OLD.room_name IS DISTINCT FROM NEW.room_name OR OLD.target_progress IS DISTINCT FROM NEW.target_progress)
+EXECUTE FUNCTION trg_recheck_task_assignments();
+
+-- Sync: renumber a row on every update that changes it, and record deletes.
+-- The tombstone trigger runs once per statement over the deleted rows; its
+-- argument names the column holding the owning user's id.
+CREATE OR REPLACE FUNCTION trg_bump_change_seq()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF ROW(NEW.*) IS DISTINCT FROM ROW(OLD.*) THEN
+        NEW.change_seq := nextval('change_seq');
+        NEW.change_xid := pg_current_xact_id();
+    END IF;
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
 
+-- Oldest transaction still running. Anything written by a lower transaction
+-- id has committed or rolled back, and every later transaction gets a higher
+-- id, so readers paging in (transaction id, sequence) order below the horizon
+-- never have a commit land behind their cursor.
+CREATE OR REPLACE FUNCTION commit_horizon()
+RETURNS BIGINT AS $$
+    SELECT pg_snapshot_xmin(pg_current_snapshot())::TEXT::BIGINT;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION trg_record_sync_tombstones()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO sync_tombstones (table_name, row_id, user_id)
+    SELECT TG_TABLE_NAME, (to_jsonb(d) ->> 'id')::INTEGER, (to_jsonb(d) ->> TG_ARGV[0])::INTEGER
+    FROM deleted_rows d;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER users_change_seq BEFORE UPDATE ON users
+FOR EACH ROW EXECUTE FUNCTION trg_bump_change_seq();
+CREATE TRIGGER user_progress_change_seq BEFORE UPDATE ON user_progress
+FOR EACH ROW EXECUTE FUNCTION trg_bump_change_seq();
+CREATE TRIGGER badges_change_seq BEFORE UPDATE ON badges
+FOR EACH ROW EXECUTE FUNCTION trg_bump_change_seq();
+CREATE TRIGGER items_change_seq BEFORE UPDATE ON items
+FOR EACH ROW EXECUTE FUNCTION trg_bump_change_seq();
+
+CREATE TRIGGER users_sync_tombstones AFTER DELETE ON users
+REFERENCING OLD TABLE AS deleted_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_record_sync_tombstones('id');
+CREATE TRIGGER user_progress_sync_tombstones AFTER DELETE ON user_progress
+REFERENCING OLD TABLE AS deleted_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_record_sync_tombstones('user_id');
+CREATE TRIGGER badges_sync_tombstones AFTER DELETE ON badges
+REFERENCING OLD TABLE AS deleted_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_record_sync_tombstones('user_id');
+CREATE TRIGGER items_sync_tombstones AFTER DELETE ON items
+REFERENCING OLD TABLE AS deleted_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_record_sync_tombstones('user_id');
+
+-- Event log: one statement-level trigger per table and operation appends
+-- the statement's changes to events in a single INSERT ... SELECT, so a
+-- coalesced batch of progress writes costs one extra statement, not one
+-- per row. Updates that change none of the tracked columns log nothing.
+CREATE OR REPLACE FUNCTION trg_events_on_progress()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO events (type, user_id, room, payload)
+        SELECT CASE WHEN n.completed THEN 'room_completed' ELSE 'progress_started' END,
+               n.user_id, n.room_name,
+               jsonb_build_object('progress_percentage', n.progress_percentage, 'current_level', n.current_level,
+                                  'score', n.score, 'completed', n.completed)
+        FROM new_rows n ORDER BY n.id;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO events (type, user_id, room, payload)
+        SELECT CASE WHEN n.completed AND NOT COALESCE(o.completed, FALSE) THEN 'room_completed' ELSE 'progress_updated' END,
+               n.user_id, n.room_name,
+               jsonb_build_object('progress_percentage', n.progress_percentage, 'current_level', n.current_level,
+                                  'score', n.score, 'completed', n.completed,
+                                  'previous_percentage', o.progress_percentage,
+                                  'score_delta', COALESCE(n.score, 0) - COALESCE(o.score, 0),
+                                  'time_spent_delta', COALESCE(n.time_spent, 0) - COALESCE(o.time_spent, 0))
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        WHERE (n.progress_percentage, n.current_level, n.score, n.completed, n.time_spent)
+              IS DISTINCT FROM (o.progress_percentage, o.current_level, o.score, o.completed, o.time_spent)
+        ORDER BY n.id;
+    ELSE
+        INSERT INTO events (type, user_id, room, payload)
+        SELECT 'progress_reset', o.user_id, o.room_name,
+               jsonb_build_object('progress_percentage', o.progress_percentage, 'score', o.score)
+        FROM old_rows o ORDER BY o.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_events_on_badges()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO events (type, user_id, payload)
+        SELECT 'badge_earned', n.user_id, jsonb_build_object('badge_name', n.badge_name, 'badge_type', n.badge_type)
+        FROM new_rows n ORDER BY n.id;
+    ELSE
+        INSERT INTO events (type, user_id, payload)
+        SELECT 'badge_revoked', o.user_id, jsonb_build_object('badge_name', o.badge_name, 'badge_type', o.badge_type)
+        FROM old_rows o ORDER BY o.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_events_on_user_achievements()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO events (type, user_id, payload)
+    SELECT 'achievement_earned', n.user_id,
+           jsonb_build_object('achievement_key', a.achievement_key, 'title', a.title, 'points', a.points)
+    FROM new_rows n
+    JOIN achievements a ON a.id = n.achievement_id
+    ORDER BY n.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_events_on_users()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO events (type, user_id, payload)
+        SELECT 'user_registered', n.id, jsonb_build_object('name', n.name, 'role', n.role)
+        FROM new_rows n ORDER BY n.id;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO events (type, user_id, payload)
+        SELECT 'user_login', n.id, jsonb_build_object('name', n.name)
+        FROM new_rows n JOIN old_rows o ON o.id = n.id
+        WHERE n.last_login IS DISTINCT FROM o.last_login
+        UNION ALL
+        SELECT 'user_role_changed', n.id, jsonb_build_object('name', n.name, 'role', n.role, 'previous_role', o.role)
+        FROM new_rows n JOIN old_rows o ON o.id = n.id
+        WHERE n.role IS DISTINCT FROM o.role;
+    ELSE
+        INSERT INTO events (type, user_id, payload)
+        SELECT 'user_deleted', o.id, jsonb_build_object('name', o.name)
+        FROM old_rows o ORDER BY o.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_events_on_items()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO events (type, user_id, payload)
+    SELECT 'content_created', n.user_id, jsonb_build_object('item_id', n.id, 'title', n.title)
+    FROM new_rows n ORDER BY n.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER user_progress_events_on_insert AFTER INSERT ON user_progress
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_progress();
+CREATE TRIGGER user_progress_events_on_update AFTER UPDATE ON user_progress
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_progress();
+CREATE TRIGGER user_progress_events_on_delete AFTER DELETE ON user_progress
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_progress();
+CREATE TRIGGER badges_events_on_insert AFTER INSERT ON badges
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_badges();
+CREATE TRIGGER badges_events_on_delete AFTER DELETE ON badges
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_badges();
+CREATE TRIGGER user_achievements_events_on_insert AFTER INSERT ON user_achievements
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_user_achievements();
+CREATE TRIGGER users_events_on_insert AFTER INSERT ON users
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_users();
+CREATE TRIGGER users_events_on_update AFTER UPDATE ON users
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_users();
+CREATE TRIGGER users_events_on_delete AFTER DELETE ON users
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_users();
+CREATE TRIGGER items_events_on_insert AFTER INSERT ON items
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_items();
+
+-- Monthly range partitions are named <table>_YYYY_MM. ensure_monthly_partitions
+-- creates any missing partition from the month of p_from through
+-- p_months_ahead months past the current one; drop_old_partitions drops those
+-- that ended before the last p_keep_months whole months. Both return how many
+-- partitions they touched. Rows with no matching partition land in
+-- <table>_default, so a missed maintenance run never fails a write; a month
+-- whose rows are already in the default partition is skipped with a warning.
+CREATE OR REPLACE FUNCTION ensure_monthly_partitions(
+    p_table TEXT, p_months_ahead INTEGER DEFAULT 2, p_from TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP)
+RETURNS INTEGER AS $$
+DECLARE
+    part_start DATE := date_trunc('month', LEAST(p_from, CURRENT_TIMESTAMP))::date;
+    last_start DATE := (date_trunc('month', CURRENT_TIMESTAMP) + make_interval(months => p_months_ahead))::date;
+    part_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(p_table)) THEN
+        RAISE EXCEPTION '% is not a partitioned table', p_table;
+    END IF;
+    WHILE part_start <= last_start LOOP
+        part_name := p_table || '_' || to_char(part_start, 'YYYY_MM');
+        IF to_regclass(part_name) IS NULL THEN
+            BEGIN
+                EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                               part_name, p_table, part_start, (part_start + INTERVAL '1 month')::date);
+                created := created + 1;
+            EXCEPTION WHEN check_violation THEN
+                RAISE WARNING 'Rows for % are in %_default; partition not created', part_name, p_table;
+            END;
+        END IF;
+        part_start := (part_start + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION drop_old_partitions(p_table TEXT, p_keep_months INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    cutoff DATE := (date_trunc('month', CURRENT_TIMESTAMP) - make_interval(months => p_keep_months))::date;
+    part RECORD;
+    dropped INTEGER := 0;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(p_table)) THEN
+        RAISE EXCEPTION '% is not a partitioned table', p_table;
+    END IF;
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(p_table)
+          AND c.relname ~ ('^' || p_table || '_[0-9]{4}_[0-9]{2}$')
+          AND to_date(right(c.relname, 7), 'YYYY_MM') < cutoff
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('DROP TABLE %I', part.relname);
+        dropped := dropped + 1;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- They run as the table owner (creating a partition requires owning the
+-- parent), so only the app's service role may call them
+REVOKE EXECUTE ON FUNCTION ensure_monthly_partitions(TEXT, INTEGER, TIMESTAMP WITH TIME ZONE) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION drop_old_partitions(TEXT, INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION ensure_monthly_partitions(TEXT, INTEGER, TIMESTAMP WITH TIME ZONE) TO service_role;
+GRANT EXECUTE ON FUNCTION drop_old_partitions(TEXT, INTEGER) TO service_role;
+
+SELECT ensure_monthly_partitions('user_sessions');
+SELECT ensure_monthly_partitions('admin_actions');
+SELECT ensure_monthly_partitions('events');
+
+-- Expired sessions used to be deleted by a trigger on every user_sessions
+-- insert, which turned each login into an unbounded DELETE. Old sessions now
+-- go a month at a time with their partition (drop_old_partitions), and the
+-- app's background reaper (run_reaper in app.py) removes expired admin
+-- sessions, verification codes and temp registrations in small batches.
 DROP TRIGGER IF EXISTS cleanup_expired_sessions ON user_sessions;
-CREATE TRIGGER cleanup_expired_sessions
-AFTER INSERT ON user_sessions
-FOR EACH ROW
-EXECUTE FUNCTION trg_cleanup_expired_sessions();
+DROP FUNCTION IF EXISTS trg_cleanup_expired_sessions();
+
+-- Everything a user has earned in one place: achievements (keyed by
+-- achievement_key in badge_name) and the simple badges table. get_user_achievements
+-- reads it with a single user_id filter; each branch uses its (user_id, earned_at) index.
+-- Clients save most awards to both tables under the same key, so a badge is
+-- left out when the user holds the achievement of that name.
+CREATE OR REPLACE VIEW user_earned_achievements AS
+SELECT ua.user_id,
+       'achievement'::text AS source,
+       a.achievement_key AS badge_name,
+       a.category AS badge_type,
+       a.title,
+       a.description,
+       a.icon,
+       a.badge_color,
+       a.points,
+       a.rarity,
+       ua.earned_at,
+       ua.progress_data
+FROM user_achievements ua
+JOIN achievements a ON a.id = ua.achievement_id
+UNION ALL
+SELECT b.user_id,
+       'badge'::text AS source,
+       b.badge_name,
+       b.badge_type,
+       b.badge_name AS title,
+       NULL::text AS description,
+       NULL::text AS icon,
+       NULL::text AS badge_color,
+       0 AS points,
+       NULL::text AS rarity,
+       b.earned_at,
+       NULL::jsonb AS progress_data
+FROM badges b
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM user_achievements ua
+    JOIN achievements a ON a.id = ua.achievement_id
+    WHERE ua.user_id = b.user_id AND a.achievement_key = b.badge_name
+);
 
 -- =====================================================
 -- PERMISSIONS AND SECURITY CONFIGURATION
@@ -479,6 +1231,13 @@ CREATE POLICY "Users can manage their own completions" ON room_completions
 ALTER TABLE learning_rooms DISABLE ROW LEVEL SECURITY;
 ALTER TABLE achievements DISABLE ROW LEVEL SECURITY;
 ALTER TABLE items DISABLE ROW LEVEL SECURITY;
+ALTER TABLE teacher_tasks DISABLE ROW LEVEL SECURITY;
+ALTER TABLE cohorts DISABLE ROW LEVEL SECURITY;
+ALTER TABLE cohort_members DISABLE ROW LEVEL SECURITY;
+ALTER TABLE cohort_room_stats DISABLE ROW LEVEL SECURITY;
+ALTER TABLE task_assignments DISABLE ROW LEVEL SECURITY;
+ALTER TABLE sync_tombstones DISABLE ROW LEVEL SECURITY;
+ALTER TABLE events DISABLE ROW LEVEL SECURITY;
 ALTER TABLE badges DISABLE ROW LEVEL SECURITY;
 ALTER TABLE system_config DISABLE ROW LEVEL SECURITY;
 
@@ -0,0 +1,170 @@
+"""Salted, versioned password hashes for app.py.
+
+Stored formats:
+
+    scrypt$<n>$<r>$<p>$<salt>$<hash>
+    pbkdf2_sha256$<iterations>$<salt>$<hash>
+    <64 hex chars>                      legacy unsalted SHA-256
+
+Salt and hash are unpadded urlsafe base64. verify_password() reports
+whether the stored hash should be replaced (legacy format, a different
+algorithm or a lower cost than configured) so callers can rehash on login.
+
+Key derivation runs in a small process pool so a burst of logins can't
+hold the GIL and starve other requests; a semaphore bounds how many jobs
+queue for it, and everything falls back to inline hashing when the pool
+can't be started (e.g. PASSWORD_HASH_WORKERS=0 or no /dev/shm on Vercel).
+"""
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import re
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+ALGORITHMS = ('scrypt', 'pbkdf2_sha256')
+LEGACY_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+PASSWORD_HASH_ALGORITHM = os.environ.get('PASSWORD_HASH_ALGORITHM', 'scrypt')
+PASSWORD_SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14))
+PASSWORD_SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', 8))
+PASSWORD_SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', 1))
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 600000))
+PASSWORD_HASH_WORKERS = int(os.environ.get(
+    'PASSWORD_HASH_WORKERS', 0 if os.environ.get('VERCEL') else min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', max(1, PASSWORD_HASH_WORKERS) * 4))
+
+_pool = None
+_pool_failed = False
+_pool_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+def configure(algorithm=None, scrypt_n=None, scrypt_r=None, scrypt_p=None,
+              pbkdf2_iterations=None, workers=None, max_pending=None):
+    """Override the environment settings, e.g. from a benchmark"""
+    global PASSWORD_HASH_ALGORITHM, PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P
+    global PASSWORD_PBKDF2_ITERATIONS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, _pending
+    if algorithm is not None:
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f'Unsupported password hash algorithm: {algorithm}')
+        PASSWORD_HASH_ALGORITHM = algorithm
+    PASSWORD_SCRYPT_N = scrypt_n or PASSWORD_SCRYPT_N
+    PASSWORD_SCRYPT_R = scrypt_r or PASSWORD_SCRYPT_R
+    PASSWORD_SCRYPT_P = scrypt_p or PASSWORD_SCRYPT_P
+    PASSWORD_PBKDF2_ITERATIONS = pbkdf2_iterations or PASSWORD_PBKDF2_ITERATIONS
+    if workers is not None and workers != PASSWORD_HASH_WORKERS:
+        PASSWORD_HASH_WORKERS = workers
+        shutdown_pool()
+    if max_pending is not None:
+        PASSWORD_HASH_MAX_PENDING = max_pending
+        _pending = threading.BoundedSemaphore(max_pending)
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _derive(algorithm, password, salt, params):
+    """Run the KDF; module-level so the process pool can pickle it"""
+    if algorithm == 'scrypt':
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=HASH_BYTES)
+    (iterations,) = params
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations, dklen=HASH_BYTES)
+
+def _get_pool():
+    global _pool, _pool_failed
+    if PASSWORD_HASH_WORKERS <= 0 or _pool_failed:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            try:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                _pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, mp_context=context)
+            except (OSError, ValueError, NotImplementedError) as e:
+                print(f"⚠️ Password hash pool unavailable, hashing inline: {str(e)}")
+                _pool_failed = True
+        return _pool
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def _run_kdf(algorithm, password, salt, params):
+    """Derive in the pool when available, waiting for a free slot first"""
+    global _pool_failed
+    pool = _get_pool()
+    if pool is None:
+        return _derive(algorithm, password, salt, params)
+    with _pending:
+        try:
+            return pool.submit(_derive, algorithm, password, salt, params).result()
+        except (BrokenProcessPool, OSError) as e:
+            print(f"⚠️ Password hash pool failed, hashing inline: {str(e)}")
+            _pool_failed = True
+            shutdown_pool()
+            return _derive(algorithm, password, salt, params)
+
+def _current_params(algorithm):
+    if algorithm == 'scrypt':
+        return (PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P)
+    return (PASSWORD_PBKDF2_ITERATIONS,)
+
+def hash_password(password):
+    """Hash a password with the configured algorithm and a fresh salt"""
+    algorithm = PASSWORD_HASH_ALGORITHM
+    params = _current_params(algorithm)
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _run_kdf(algorithm, password, salt, params)
+    return '$'.join([algorithm, *(str(v) for v in params), _b64encode(salt), _b64encode(digest)])
+
+def _parse(stored):
+    """Split a stored hash into (algorithm, params, salt, digest), or None if unrecognized"""
+    parts = stored.split('$')
+    try:
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            return 'scrypt', tuple(int(v) for v in parts[1:4]), _b64decode(parts[4]), _b64decode(parts[5])
+        if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            return 'pbkdf2_sha256', (int(parts[1]),), _b64decode(parts[2]), _b64decode(parts[3])
+    except ValueError:
+        return None
+    return None
+
+def needs_rehash(stored):
+    if not stored or LEGACY_SHA256.match(stored):
+        return True
+    parsed = _parse(stored)
+    if parsed is None:
+        return True
+    algorithm, params, _, _ = parsed
+    return algorithm != PASSWORD_HASH_ALGORITHM or params != _current_params(algorithm)
+
+def verify_password(password, stored):
+    """Check a password against a stored hash.
+
+    Returns (matches, needs_rehash); needs_rehash is only meaningful when
+    the password matched.
+    """
+    if not stored:
+        return False, False
+    if LEGACY_SHA256.match(stored):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored), True
+    parsed = _parse(stored)
+    if parsed is None:
+        return False, False
+    algorithm, params, salt, digest = parsed
+    matches = hmac.compare_digest(_run_kdf(algorithm, password, salt, params), digest)
+    return matches, matches and needs_rehash(stored)
@@ -51,3 +51,1027 @@ DO $$ BEGIN
         ADD CONSTRAINT users_role_check
         CHECK (role IN ('user', 'admin', 'moderator', 'teacher'));
 END $$;
+
+-- ============================================================
+-- MIGRATION: Unique (user_id, badge_name) on badges
+-- Run this block on an existing database before re-running the
+-- index section of database_schema.sql. Keeps the earliest copy
+-- of every duplicated badge, then adds the constraint.
+-- ============================================================
+DO $$ BEGIN
+    DELETE FROM badges b
+    USING badges dup
+    WHERE b.user_id = dup.user_id
+      AND b.badge_name = dup.badge_name
+      AND b.id > dup.id;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.table_constraints
+        WHERE constraint_name = 'badges_user_id_badge_name_key'
+          AND table_name = 'badges'
+    ) THEN
+        ALTER TABLE badges
+            ADD CONSTRAINT badges_user_id_badge_name_key
+            UNIQUE (user_id, badge_name);
+    END IF;
+END $$;
+
+-- ============================================================
+-- MIGRATION: Room registry columns on learning_rooms
+-- The app loads its room registry from learning_rooms. This adds
+-- the brand name and alias columns, aligns existing rows with the
+-- values the API has always served, and retires the legacy
+-- 'netxus' row (netxus is an alias of 'networking').
+-- ============================================================
+ALTER TABLE learning_rooms ADD COLUMN IF NOT EXISTS code_name TEXT;
+ALTER TABLE learning_rooms ADD COLUMN IF NOT EXISTS aliases JSONB DEFAULT '[]'::jsonb;
+
+UPDATE learning_rooms AS lr
+SET code_name = v.code_name,
+    aliases = v.aliases::jsonb,
+    color_theme = v.color_theme,
+    sort_order = v.sort_order
+FROM (VALUES
+    ('flowchart', 'FLOWBYTE', '["flowbyte"]', '#005FFB', 0),
+    ('networking', 'NETXUS', '["netxus"]', '#00A949', 1),
+    ('ai-training', 'AITRIX', '["aitrix"]', '#E08300', 2),
+    ('database', 'SCHEMAX', '["schemax"]', '#FF3600', 3),
+    ('programming', 'CODEVANCE', '["codevance"]', '#FF006D', 4)
+) AS v(room_name, code_name, aliases, color_theme, sort_order)
+WHERE lr.room_name = v.room_name;
+
+UPDATE learning_rooms SET is_active = FALSE WHERE room_name = 'netxus';
+
+-- ============================================================
+-- MIGRATION: user_earned_achievements view
+-- Unified read model for /api/achievements/user: achievements
+-- joined to their definitions plus the simple badges table.
+-- ============================================================
+DROP INDEX IF EXISTS idx_user_achievements_user_id;
+CREATE INDEX IF NOT EXISTS idx_user_achievements_user_earned_at ON user_achievements(user_id, earned_at DESC);
+
+CREATE OR REPLACE VIEW user_earned_achievements AS
+SELECT ua.user_id,
+       'achievement'::text AS source,
+       a.achievement_key AS badge_name,
+       a.category AS badge_type,
+       a.title,
+       a.description,
+       a.icon,
+       a.badge_color,
+       a.points,
+       a.rarity,
+       ua.earned_at,
+       ua.progress_data
+FROM user_achievements ua
+JOIN achievements a ON a.id = ua.achievement_id
+UNION ALL
+SELECT b.user_id,
+       'badge'::text AS source,
+       b.badge_name,
+       b.badge_type,
+       b.badge_name AS title,
+       NULL::text AS description,
+       NULL::text AS icon,
+       NULL::text AS badge_color,
+       0 AS points,
+       NULL::text AS rarity,
+       b.earned_at,
+       NULL::jsonb AS progress_data
+FROM badges b;
+
+GRANT SELECT ON user_earned_achievements TO service_role;
+
+-- ============================================================
+-- MIGRATION: teacher_tasks table
+-- Teacher tasks used to be items rows whose description held a
+-- JSON blob with "teacher_task": true. This creates the typed
+-- table, copies every such item into it (legacy_item_id makes a
+-- re-run a no-op), then deletes the copied items. Rows whose
+-- description isn't valid JSON are left in items untouched.
+-- ============================================================
+CREATE TABLE IF NOT EXISTS teacher_tasks (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    title TEXT NOT NULL,
+    task_type TEXT NOT NULL DEFAULT 'teacher_task',
+    room_name TEXT,
+    difficulty TEXT DEFAULT 'medium' CHECK (difficulty IN ('easy','medium','hard')),
+    due_date TIMESTAMP WITH TIME ZONE,
+    is_active BOOLEAN DEFAULT TRUE,
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    legacy_item_id INTEGER UNIQUE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_teacher_tasks_user_type ON teacher_tasks(user_id, task_type, created_at DESC);
+ALTER TABLE teacher_tasks DISABLE ROW LEVEL SECURITY;
+
+DO $$
+DECLARE
+    item RECORD;
+    meta JSONB;
+BEGIN
+    FOR item IN SELECT id, title, description, user_id, created_at FROM items WHERE user_id IS NOT NULL LOOP
+        BEGIN
+            meta := item.description::jsonb;
+        EXCEPTION WHEN others THEN
+            CONTINUE;
+        END;
+        IF jsonb_typeof(meta) <> 'object' OR meta->>'teacher_task' IS DISTINCT FROM 'true' THEN
+            CONTINUE;
+        END IF;
+
+        INSERT INTO teacher_tasks (user_id, title, task_type, room_name, difficulty, is_active,
+                                   payload, legacy_item_id, created_at, updated_at)
+        VALUES (
+            item.user_id,
+            item.title,
+            'teacher_task',
+            meta->>'room',
+            CASE WHEN meta->>'difficulty' IN ('easy', 'medium', 'hard') THEN meta->>'difficulty' ELSE 'medium' END,
+            COALESCE((meta->>'is_active')::boolean, TRUE),
+            meta - 'type' - 'teacher_task' - 'room' - 'room_display' - 'difficulty' - 'is_active',
+            item.id,
+            item.created_at,
+            item.created_at
+        )
+        ON CONFLICT (legacy_item_id) DO NOTHING;
+
+        DELETE FROM items WHERE id = item.id;
+    END LOOP;
+END $$;
+
+-- ============================================================
+-- MIGRATION: Cohorts
+-- Class membership, per-room cohort aggregates and the triggers
+-- that maintain them. Cohorts start empty, so nothing needs
+-- backfilling.
+-- ============================================================
+CREATE TABLE IF NOT EXISTS cohorts (
+    id SERIAL PRIMARY KEY,
+    teacher_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    member_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(teacher_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS cohort_members (
+    cohort_id INTEGER NOT NULL REFERENCES cohorts(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    last_active_at TIMESTAMP WITH TIME ZONE,
+    joined_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (cohort_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS cohort_room_stats (
+    cohort_id INTEGER NOT NULL REFERENCES cohorts(id) ON DELETE CASCADE,
+    room_name TEXT NOT NULL,
+    started_count INTEGER NOT NULL DEFAULT 0,
+    completed_count INTEGER NOT NULL DEFAULT 0,
+    progress_sum BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (cohort_id, room_name)
+);
+
+-- cohorts: teachers list their own cohorts (covered by UNIQUE(teacher_id, name));
+-- cohort_members: the progress trigger finds a student's cohorts by user_id, and
+-- cohort summaries count members active since a cutoff
+CREATE INDEX IF NOT EXISTS idx_cohort_members_user_id ON cohort_members(user_id);
+CREATE INDEX IF NOT EXISTS idx_cohort_members_active ON cohort_members(cohort_id, last_active_at DESC);
+
+ALTER TABLE cohorts DISABLE ROW LEVEL SECURITY;
+ALTER TABLE cohort_members DISABLE ROW LEVEL SECURITY;
+ALTER TABLE cohort_room_stats DISABLE ROW LEVEL SECURITY;
+
+-- Cohort aggregates: cohort_room_stats holds, per cohort and room, how many
+-- members started it, how many completed it and the sum of their progress.
+-- The triggers below keep it (and cohorts.member_count, cohort_members.last_active_at)
+-- current on every progress and membership change; recompute_cohort_stats rebuilds
+-- one cohort from scratch if it ever drifts.
+CREATE OR REPLACE FUNCTION apply_cohort_progress_delta(
+    p_user_id INTEGER, p_room_name TEXT, p_started INTEGER, p_completed INTEGER, p_progress BIGINT
+)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO cohort_room_stats (cohort_id, room_name, started_count, completed_count, progress_sum, updated_at)
+    SELECT cm.cohort_id, p_room_name, p_started, p_completed, p_progress, CURRENT_TIMESTAMP
+    FROM cohort_members cm
+    WHERE cm.user_id = p_user_id
+    ON CONFLICT (cohort_id, room_name) DO UPDATE
+    SET started_count = cohort_room_stats.started_count + EXCLUDED.started_count,
+        completed_count = cohort_room_stats.completed_count + EXCLUDED.completed_count,
+        progress_sum = cohort_room_stats.progress_sum + EXCLUDED.progress_sum,
+        updated_at = CURRENT_TIMESTAMP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_cohort_stats_on_progress()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.user_id = NEW.user_id AND OLD.room_name = NEW.room_name THEN
+        IF OLD.completed IS DISTINCT FROM NEW.completed
+           OR OLD.progress_percentage IS DISTINCT FROM NEW.progress_percentage THEN
+            PERFORM apply_cohort_progress_delta(
+                NEW.user_id, NEW.room_name, 0,
+                (CASE WHEN NEW.completed THEN 1 ELSE 0 END) - (CASE WHEN OLD.completed THEN 1 ELSE 0 END),
+                COALESCE(NEW.progress_percentage, 0) - COALESCE(OLD.progress_percentage, 0)
+            );
+        END IF;
+    ELSE
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM apply_cohort_progress_delta(
+                OLD.user_id, OLD.room_name, -1,
+                -(CASE WHEN OLD.completed THEN 1 ELSE 0 END), -COALESCE(OLD.progress_percentage, 0)
+            );
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM apply_cohort_progress_delta(
+                NEW.user_id, NEW.room_name, 1,
+                CASE WHEN NEW.completed THEN 1 ELSE 0 END, COALESCE(NEW.progress_percentage, 0)
+            );
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.last_accessed IS NOT NULL THEN
+        UPDATE cohort_members
+        SET last_active_at = NEW.last_accessed
+        WHERE user_id = NEW.user_id
+          AND (last_active_at IS NULL OR last_active_at < NEW.last_accessed);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS update_cohort_stats_on_progress ON user_progress;
+CREATE TRIGGER update_cohort_stats_on_progress
+AFTER INSERT OR UPDATE OR DELETE ON user_progress
+FOR EACH ROW
+EXECUTE FUNCTION trg_cohort_stats_on_progress();
+
+-- Joining or leaving a cohort adds or removes the member's existing progress
+CREATE OR REPLACE FUNCTION trg_cohort_stats_on_membership()
+RETURNS TRIGGER AS $$
+DECLARE
+    target_cohort INTEGER := CASE WHEN TG_OP = 'INSERT' THEN NEW.cohort_id ELSE OLD.cohort_id END;
+    member_id INTEGER := CASE WHEN TG_OP = 'INSERT' THEN NEW.user_id ELSE OLD.user_id END;
+    delta INTEGER := CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END;
+BEGIN
+    -- The cohort itself is being deleted; its stats go with it
+    IF NOT EXISTS (SELECT 1 FROM cohorts WHERE id = target_cohort) THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE cohorts SET member_count = member_count + delta WHERE id = target_cohort;
+
+    INSERT INTO cohort_room_stats (cohort_id, room_name, started_count, completed_count, progress_sum, updated_at)
+    SELECT target_cohort, up.room_name, delta,
+           delta * (CASE WHEN up.completed THEN 1 ELSE 0 END),
+           delta * COALESCE(up.progress_percentage, 0),
+           CURRENT_TIMESTAMP
+    FROM user_progress up
+    WHERE up.user_id = member_id
+    ON CONFLICT (cohort_id, room_name) DO UPDATE
+    SET started_count = cohort_room_stats.started_count + EXCLUDED.started_count,
+        completed_count = cohort_room_stats.completed_count + EXCLUDED.completed_count,
+        progress_sum = cohort_room_stats.progress_sum + EXCLUDED.progress_sum,
+        updated_at = CURRENT_TIMESTAMP;
+
+    IF TG_OP = 'INSERT' THEN
+        UPDATE cohort_members
+        SET last_active_at = (SELECT MAX(last_accessed) FROM user_progress WHERE user_id = member_id)
+        WHERE cohort_id = target_cohort AND user_id = member_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS update_cohort_stats_on_membership ON cohort_members;
+CREATE TRIGGER update_cohort_stats_on_membership
+AFTER INSERT OR DELETE ON cohort_members
+FOR EACH ROW
+EXECUTE FUNCTION trg_cohort_stats_on_membership();
+
+CREATE OR REPLACE FUNCTION recompute_cohort_stats(p_cohort_id INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    UPDATE cohorts
+    SET member_count = (SELECT COUNT(*) FROM cohort_members WHERE cohort_id = p_cohort_id)
+    WHERE id = p_cohort_id;
+
+    DELETE FROM cohort_room_stats WHERE cohort_id = p_cohort_id;
+    INSERT INTO cohort_room_stats (cohort_id, room_name, started_count, completed_count, progress_sum, updated_at)
+    SELECT p_cohort_id, up.room_name, COUNT(*), COUNT(*) FILTER (WHERE up.completed),
+           COALESCE(SUM(up.progress_percentage), 0), CURRENT_TIMESTAMP
+    FROM cohort_members cm
+    JOIN user_progress up ON up.user_id = cm.user_id
+    WHERE cm.cohort_id = p_cohort_id
+    GROUP BY up.room_name;
+
+    UPDATE cohort_members cm
+    SET last_active_at = latest.last_accessed
+    FROM (
+        SELECT up.user_id, MAX(up.last_accessed) AS last_accessed
+        FROM user_progress up
+        JOIN cohort_members m ON m.user_id = up.user_id AND m.cohort_id = p_cohort_id
+        GROUP BY up.user_id
+    ) latest
+    WHERE cm.cohort_id = p_cohort_id AND cm.user_id = latest.user_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ============================================================
+-- MIGRATION: Teacher task assignments
+-- Per-student assignments of teacher_tasks, completion targets
+-- and the counters/triggers that track them. Run after the
+-- teacher_tasks and cohorts migrations.
+-- ============================================================
+ALTER TABLE teacher_tasks ADD COLUMN IF NOT EXISTS target_progress INTEGER NOT NULL DEFAULT 100
+    CHECK (target_progress BETWEEN 0 AND 100);
+ALTER TABLE teacher_tasks ADD COLUMN IF NOT EXISTS assigned_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE teacher_tasks ADD COLUMN IF NOT EXISTS completed_count INTEGER NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS task_assignments (
+    task_id INTEGER NOT NULL REFERENCES teacher_tasks(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    cohort_id INTEGER REFERENCES cohorts(id) ON DELETE SET NULL,
+    assigned_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    completed_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (task_id, user_id)
+);
+
+-- task_assignments: the progress trigger looks up a student's open assignments
+CREATE INDEX IF NOT EXISTS idx_task_assignments_open ON task_assignments(user_id) WHERE completed_at IS NULL;
+ALTER TABLE task_assignments DISABLE ROW LEVEL SECURITY;
+
+-- Task assignments: teacher_tasks.assigned_count / completed_count are kept by
+-- statement-level triggers on task_assignments, so a fan-out of hundreds of rows
+-- costs one counter update per task. A progress write completes the student's open
+-- assignments for that room once it reaches the task's target_progress.
+CREATE OR REPLACE FUNCTION trg_task_counters_on_assign()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE teacher_tasks t
+    SET assigned_count = t.assigned_count + d.assigned,
+        completed_count = t.completed_count + d.completed
+    FROM (
+        SELECT task_id, COUNT(*) AS assigned, COUNT(completed_at) AS completed
+        FROM new_assignments GROUP BY task_id
+    ) d
+    WHERE t.id = d.task_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_task_counters_on_unassign()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE teacher_tasks t
+    SET assigned_count = t.assigned_count - d.assigned,
+        completed_count = t.completed_count - d.completed
+    FROM (
+        SELECT task_id, COUNT(*) AS assigned, COUNT(completed_at) AS completed
+        FROM old_assignments GROUP BY task_id
+    ) d
+    WHERE t.id = d.task_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_task_counters_on_complete()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE teacher_tasks t
+    SET completed_count = t.completed_count + d.delta
+    FROM (
+        SELECT task_id, SUM(change) AS delta
+        FROM (
+            SELECT task_id, 1 AS change FROM new_assignments WHERE completed_at IS NOT NULL
+            UNION ALL
+            SELECT task_id, -1 FROM old_assignments WHERE completed_at IS NOT NULL
+        ) changes
+        GROUP BY task_id
+    ) d
+    WHERE t.id = d.task_id AND d.delta <> 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS task_counters_on_assign ON task_assignments;
+CREATE TRIGGER task_counters_on_assign
+AFTER INSERT ON task_assignments
+REFERENCING NEW TABLE AS new_assignments
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_task_counters_on_assign();
+
+DROP TRIGGER IF EXISTS task_counters_on_unassign ON task_assignments;
+CREATE TRIGGER task_counters_on_unassign
+AFTER DELETE ON task_assignments
+REFERENCING OLD TABLE AS old_assignments
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_task_counters_on_unassign();
+
+DROP TRIGGER IF EXISTS task_counters_on_complete ON task_assignments;
+CREATE TRIGGER task_counters_on_complete
+AFTER UPDATE ON task_assignments
+REFERENCING OLD TABLE AS old_assignments NEW TABLE AS new_assignments
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_task_counters_on_complete();
+
+CREATE OR REPLACE FUNCTION trg_complete_task_assignments()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- idx_task_assignments_open keeps this to the student's open assignments
+    UPDATE task_assignments ta
+    SET completed_at = CURRENT_TIMESTAMP
+    FROM teacher_tasks t
+    WHERE ta.user_id = NEW.user_id
+      AND ta.completed_at IS NULL
+      AND t.id = ta.task_id
+      AND t.room_name = NEW.room_name
+      AND (NEW.completed OR COALESCE(NEW.progress_percentage, 0) >= t.target_progress);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS complete_task_assignments_on_progress ON user_progress;
+CREATE TRIGGER complete_task_assignments_on_progress
+AFTER INSERT OR UPDATE ON user_progress
+FOR EACH ROW
+EXECUTE FUNCTION trg_complete_task_assignments();
+
+-- ============================================================
+-- MIGRATION: Incremental sync
+-- change_seq columns, tombstones and the triggers behind
+-- /api/sync. Adding the columns with a nextval() default numbers
+-- every existing row, so clients start from a complete snapshot.
+-- ============================================================
+CREATE SEQUENCE IF NOT EXISTS change_seq;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT nextval('change_seq');
+ALTER TABLE user_progress ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT nextval('change_seq');
+ALTER TABLE badges ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT nextval('change_seq');
+ALTER TABLE items ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT nextval('change_seq');
+
+CREATE TABLE IF NOT EXISTS sync_tombstones (
+    id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    user_id INTEGER,
+    change_seq BIGINT NOT NULL DEFAULT nextval('change_seq'),
+    deleted_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+ALTER TABLE sync_tombstones DISABLE ROW LEVEL SECURITY;
+
+CREATE INDEX IF NOT EXISTS idx_users_change_seq ON users(change_seq);
+CREATE INDEX IF NOT EXISTS idx_user_progress_change_seq ON user_progress(change_seq);
+CREATE INDEX IF NOT EXISTS idx_badges_change_seq ON badges(change_seq);
+CREATE INDEX IF NOT EXISTS idx_items_change_seq ON items(change_seq);
+CREATE INDEX IF NOT EXISTS idx_sync_tombstones_change_seq ON sync_tombstones(change_seq);
+CREATE INDEX IF NOT EXISTS idx_sync_tombstones_deleted_at ON sync_tombstones(deleted_at);
+
+CREATE OR REPLACE FUNCTION trg_bump_change_seq()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF ROW(NEW.*) IS DISTINCT FROM ROW(OLD.*) THEN
+        NEW.change_seq := nextval('change_seq');
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_record_sync_tombstones()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO sync_tombstones (table_name, row_id, user_id)
+    SELECT TG_TABLE_NAME, (to_jsonb(d) ->> 'id')::INTEGER, (to_jsonb(d) ->> TG_ARGV[0])::INTEGER
+    FROM deleted_rows d;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_change_seq ON users;
+CREATE TRIGGER users_change_seq BEFORE UPDATE ON users
+FOR EACH ROW EXECUTE FUNCTION trg_bump_change_seq();
+DROP TRIGGER IF EXISTS user_progress_change_seq ON user_progress;
+CREATE TRIGGER user_progress_change_seq BEFORE UPDATE ON user_progress
+FOR EACH ROW EXECUTE FUNCTION trg_bump_change_seq();
+DROP TRIGGER IF EXISTS badges_change_seq ON badges;
+CREATE TRIGGER badges_change_seq BEFORE UPDATE ON badges
+FOR EACH ROW EXECUTE FUNCTION trg_bump_change_seq();
+DROP TRIGGER IF EXISTS items_change_seq ON items;
+CREATE TRIGGER items_change_seq BEFORE UPDATE ON items
+FOR EACH ROW EXECUTE FUNCTION trg_bump_change_seq();
+
+DROP TRIGGER IF EXISTS users_sync_tombstones ON users;
+CREATE TRIGGER users_sync_tombstones AFTER DELETE ON users
+REFERENCING OLD TABLE AS deleted_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_record_sync_tombstones('id');
+DROP TRIGGER IF EXISTS user_progress_sync_tombstones ON user_progress;
+CREATE TRIGGER user_progress_sync_tombstones AFTER DELETE ON user_progress
+REFERENCING OLD TABLE AS deleted_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_record_sync_tombstones('user_id');
+DROP TRIGGER IF EXISTS badges_sync_tombstones ON badges;
+CREATE TRIGGER badges_sync_tombstones AFTER DELETE ON badges
+REFERENCING OLD TABLE AS deleted_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_record_sync_tombstones('user_id');
+DROP TRIGGER IF EXISTS items_sync_tombstones ON items;
+CREATE TRIGGER items_sync_tombstones AFTER DELETE ON items
+REFERENCING OLD TABLE AS deleted_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_record_sync_tombstones('user_id');
+
+-- ============================================================
+-- MIGRATION: Event log
+-- Append-only events table and the statement-level triggers that
+-- fill it from user_progress, badges, user_achievements, users and
+-- items. History starts when this runs; nothing is backfilled.
+-- ============================================================
+CREATE TABLE IF NOT EXISTS events (
+    seq BIGSERIAL PRIMARY KEY,
+    type TEXT NOT NULL,
+    user_id INTEGER,
+    room TEXT,
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    ts TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+ALTER TABLE events DISABLE ROW LEVEL SECURITY;
+
+CREATE INDEX IF NOT EXISTS idx_events_type_seq ON events(type, seq);
+CREATE INDEX IF NOT EXISTS idx_events_user_seq ON events(user_id, seq);
+
+CREATE OR REPLACE FUNCTION trg_events_on_progress()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO events (type, user_id, room, payload)
+        SELECT CASE WHEN n.completed THEN 'room_completed' ELSE 'progress_started' END,
+               n.user_id, n.room_name,
+               jsonb_build_object('progress_percentage', n.progress_percentage, 'current_level', n.current_level,
+                                  'score', n.score, 'completed', n.completed)
+        FROM new_rows n ORDER BY n.id;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO events (type, user_id, room, payload)
+        SELECT CASE WHEN n.completed AND NOT COALESCE(o.completed, FALSE) THEN 'room_completed' ELSE 'progress_updated' END,
+               n.user_id, n.room_name,
+               jsonb_build_object('progress_percentage', n.progress_percentage, 'current_level', n.current_level,
+                                  'score', n.score, 'completed', n.completed,
+                                  'previous_percentage', o.progress_percentage,
+                                  'score_delta', COALESCE(n.score, 0) - COALESCE(o.score, 0),
+                                  'time_spent_delta', COALESCE(n.time_spent, 0) - COALESCE(o.time_spent, 0))
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        WHERE (n.progress_percentage, n.current_level, n.score, n.completed, n.time_spent)
+              IS DISTINCT FROM (o.progress_percentage, o.current_level, o.score, o.completed, o.time_spent)
+        ORDER BY n.id;
+    ELSE
+        INSERT INTO events (type, user_id, room, payload)
+        SELECT 'progress_reset', o.user_id, o.room_name,
+               jsonb_build_object('progress_percentage', o.progress_percentage, 'score', o.score)
+        FROM old_rows o ORDER BY o.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_events_on_badges()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO events (type, user_id, payload)
+        SELECT 'badge_earned', n.user_id, jsonb_build_object('badge_name', n.badge_name, 'badge_type', n.badge_type)
+        FROM new_rows n ORDER BY n.id;
+    ELSE
+        INSERT INTO events (type, user_id, payload)
+        SELECT 'badge_revoked', o.user_id, jsonb_build_object('badge_name', o.badge_name, 'badge_type', o.badge_type)
+        FROM old_rows o ORDER BY o.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_events_on_user_achievements()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO events (type, user_id, payload)
+    SELECT 'achievement_earned', n.user_id,
+           jsonb_build_object('achievement_key', a.achievement_key, 'title', a.title, 'points', a.points)
+    FROM new_rows n
+    JOIN achievements a ON a.id = n.achievement_id
+    ORDER BY n.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_events_on_users()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO events (type, user_id, payload)
+        SELECT 'user_registered', n.id, jsonb_build_object('name', n.name, 'role', n.role)
+        FROM new_rows n ORDER BY n.id;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO events (type, user_id, payload)
+        SELECT 'user_login', n.id, jsonb_build_object('name', n.name)
+        FROM new_rows n JOIN old_rows o ON o.id = n.id
+        WHERE n.last_login IS DISTINCT FROM o.last_login
+        UNION ALL
+        SELECT 'user_role_changed', n.id, jsonb_build_object('name', n.name, 'role', n.role, 'previous_role', o.role)
+        FROM new_rows n JOIN old_rows o ON o.id = n.id
+        WHERE n.role IS DISTINCT FROM o.role;
+    ELSE
+        INSERT INTO events (type, user_id, payload)
+        SELECT 'user_deleted', o.id, jsonb_build_object('name', o.name)
+        FROM old_rows o ORDER BY o.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_events_on_items()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO events (type, user_id, payload)
+    SELECT 'content_created', n.user_id, jsonb_build_object('item_id', n.id, 'title', n.title)
+    FROM new_rows n ORDER BY n.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_progress_events_on_insert ON user_progress;
+CREATE TRIGGER user_progress_events_on_insert AFTER INSERT ON user_progress
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_progress();
+DROP TRIGGER IF EXISTS user_progress_events_on_update ON user_progress;
+CREATE TRIGGER user_progress_events_on_update AFTER UPDATE ON user_progress
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_progress();
+DROP TRIGGER IF EXISTS user_progress_events_on_delete ON user_progress;
+CREATE TRIGGER user_progress_events_on_delete AFTER DELETE ON user_progress
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_progress();
+DROP TRIGGER IF EXISTS badges_events_on_insert ON badges;
+CREATE TRIGGER badges_events_on_insert AFTER INSERT ON badges
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_badges();
+DROP TRIGGER IF EXISTS badges_events_on_delete ON badges;
+CREATE TRIGGER badges_events_on_delete AFTER DELETE ON badges
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_badges();
+DROP TRIGGER IF EXISTS user_achievements_events_on_insert ON user_achievements;
+CREATE TRIGGER user_achievements_events_on_insert AFTER INSERT ON user_achievements
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_user_achievements();
+DROP TRIGGER IF EXISTS users_events_on_insert ON users;
+CREATE TRIGGER users_events_on_insert AFTER INSERT ON users
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_users();
+DROP TRIGGER IF EXISTS users_events_on_update ON users;
+CREATE TRIGGER users_events_on_update AFTER UPDATE ON users
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_users();
+DROP TRIGGER IF EXISTS users_events_on_delete ON users;
+CREATE TRIGGER users_events_on_delete AFTER DELETE ON users
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_users();
+DROP TRIGGER IF EXISTS items_events_on_insert ON items;
+CREATE TRIGGER items_events_on_insert AFTER INSERT ON items
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_events_on_items();
+
+-- ============================================================
+-- MIGRATION: Monthly partitions for history tables
+-- user_sessions, admin_actions and events become tables
+-- partitioned by month on their timestamp. Each table is
+-- converted once: the old table is renamed, the partitioned table
+-- and enough partitions for its oldest row are created, rows are
+-- copied (only unexpired sessions), and the old table is dropped.
+-- Run after the event log migration. The app's partition
+-- maintenance job keeps future partitions ahead of time and drops
+-- expired months afterwards.
+-- ============================================================
+-- Monthly range partitions are named <table>_YYYY_MM. ensure_monthly_partitions
+-- creates any missing partition from the month of p_from through
+-- p_months_ahead months past the current one; drop_old_partitions drops those
+-- that ended before the last p_keep_months whole months. Both return how many
+-- partitions they touched. Rows with no matching partition land in
+-- <table>_default, so a missed maintenance run never fails a write; a month
+-- whose rows are already in the default partition is skipped with a warning.
+CREATE OR REPLACE FUNCTION ensure_monthly_partitions(
+    p_table TEXT, p_months_ahead INTEGER DEFAULT 2, p_from TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP)
+RETURNS INTEGER AS $$
+DECLARE
+    part_start DATE := date_trunc('month', LEAST(p_from, CURRENT_TIMESTAMP))::date;
+    last_start DATE := (date_trunc('month', CURRENT_TIMESTAMP) + make_interval(months => p_months_ahead))::date;
+    part_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(p_table)) THEN
+        RAISE EXCEPTION '% is not a partitioned table', p_table;
+    END IF;
+    WHILE part_start <= last_start LOOP
+        part_name := p_table || '_' || to_char(part_start, 'YYYY_MM');
+        IF to_regclass(part_name) IS NULL THEN
+            BEGIN
+                EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                               part_name, p_table, part_start, (part_start + INTERVAL '1 month')::date);
+                created := created + 1;
+            EXCEPTION WHEN check_violation THEN
+                RAISE WARNING 'Rows for % are in %_default; partition not created', part_name, p_table;
+            END;
+        END IF;
+        part_start := (part_start + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION drop_old_partitions(p_table TEXT, p_keep_months INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    cutoff DATE := (date_trunc('month', CURRENT_TIMESTAMP) - make_interval(months => p_keep_months))::date;
+    part RECORD;
+    dropped INTEGER := 0;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(p_table)) THEN
+        RAISE EXCEPTION '% is not a partitioned table', p_table;
+    END IF;
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(p_table)
+          AND c.relname ~ ('^' || p_table || '_[0-9]{4}_[0-9]{2}$')
+          AND to_date(right(c.relname, 7), 'YYYY_MM') < cutoff
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('DROP TABLE %I', part.relname);
+        dropped := dropped + 1;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- They run as the table owner (creating a partition requires owning the
+-- parent), so only the app's service role may call them
+REVOKE EXECUTE ON FUNCTION ensure_monthly_partitions(TEXT, INTEGER, TIMESTAMP WITH TIME ZONE) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION drop_old_partitions(TEXT, INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION ensure_monthly_partitions(TEXT, INTEGER, TIMESTAMP WITH TIME ZONE) TO service_role;
+GRANT EXECUTE ON FUNCTION drop_old_partitions(TEXT, INTEGER) TO service_role;
+
+DO $$
+DECLARE
+    oldest TIMESTAMP WITH TIME ZONE;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'user_sessions'::regclass) THEN
+        ALTER TABLE user_sessions RENAME TO user_sessions_unpartitioned;
+        ALTER TABLE user_sessions_unpartitioned RENAME CONSTRAINT user_sessions_pkey TO user_sessions_unpartitioned_pkey;
+        ALTER TABLE user_sessions_unpartitioned RENAME CONSTRAINT user_sessions_session_token_key TO user_sessions_unpartitioned_session_token_key;
+        CREATE TABLE user_sessions (
+            id INTEGER NOT NULL DEFAULT nextval('user_sessions_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            session_token TEXT NOT NULL,
+            ip_address TEXT,
+            user_agent TEXT,
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at),
+            UNIQUE (session_token, created_at)
+        ) PARTITION BY RANGE (created_at);
+        ALTER SEQUENCE user_sessions_id_seq OWNED BY user_sessions.id;
+        CREATE TABLE user_sessions_default PARTITION OF user_sessions DEFAULT;
+
+        SELECT MIN(created_at) INTO oldest FROM user_sessions_unpartitioned WHERE expires_at > CURRENT_TIMESTAMP;
+        PERFORM ensure_monthly_partitions('user_sessions', 2, COALESCE(oldest, CURRENT_TIMESTAMP));
+        INSERT INTO user_sessions (id, user_id, session_token, ip_address, user_agent, expires_at, created_at)
+        SELECT id, user_id, session_token, ip_address, user_agent, expires_at, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM user_sessions_unpartitioned
+        WHERE expires_at > CURRENT_TIMESTAMP;
+        DROP TABLE user_sessions_unpartitioned;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'admin_actions'::regclass) THEN
+        ALTER TABLE admin_actions RENAME TO admin_actions_unpartitioned;
+        ALTER TABLE admin_actions_unpartitioned RENAME CONSTRAINT admin_actions_pkey TO admin_actions_unpartitioned_pkey;
+        CREATE TABLE admin_actions (
+            id INTEGER NOT NULL DEFAULT nextval('admin_actions_id_seq'),
+            admin_user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            action_type TEXT NOT NULL,
+            target_user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            description TEXT,
+            ip_address TEXT,
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+        ALTER SEQUENCE admin_actions_id_seq OWNED BY admin_actions.id;
+        CREATE TABLE admin_actions_default PARTITION OF admin_actions DEFAULT;
+
+        SELECT MIN(timestamp) INTO oldest FROM admin_actions_unpartitioned;
+        PERFORM ensure_monthly_partitions('admin_actions', 2, COALESCE(oldest, CURRENT_TIMESTAMP));
+        INSERT INTO admin_actions (id, admin_user_id, action_type, target_user_id, description, ip_address, timestamp)
+        SELECT id, admin_user_id, action_type, target_user_id, description, ip_address, COALESCE(timestamp, CURRENT_TIMESTAMP)
+        FROM admin_actions_unpartitioned;
+        DROP TABLE admin_actions_unpartitioned;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'events'::regclass) THEN
+        ALTER TABLE events RENAME TO events_unpartitioned;
+        ALTER TABLE events_unpartitioned RENAME CONSTRAINT events_pkey TO events_unpartitioned_pkey;
+        CREATE TABLE events (
+            seq BIGINT NOT NULL DEFAULT nextval('events_seq_seq'),
+            type TEXT NOT NULL,
+            user_id INTEGER,
+            room TEXT,
+            payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+            ts TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (seq, ts)
+        ) PARTITION BY RANGE (ts);
+        ALTER SEQUENCE events_seq_seq OWNED BY events.seq;
+        CREATE TABLE events_default PARTITION OF events DEFAULT;
+
+        SELECT MIN(ts) INTO oldest FROM events_unpartitioned;
+        PERFORM ensure_monthly_partitions('events', 2, COALESCE(oldest, CURRENT_TIMESTAMP));
+        INSERT INTO events (seq, type, user_id, room, payload, ts)
+        SELECT seq, type, user_id, room, payload, ts FROM events_unpartitioned;
+        DROP TABLE events_unpartitioned;
+    END IF;
+END $$;
+
+ALTER TABLE user_sessions ENABLE ROW LEVEL SECURITY;
+ALTER TABLE admin_actions DISABLE ROW LEVEL SECURITY;
+ALTER TABLE events DISABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Service role can manage all sessions" ON user_sessions;
+CREATE POLICY "Service role can manage all sessions" ON user_sessions
+    FOR ALL USING (auth.role() = 'service_role');
+DROP POLICY IF EXISTS "Users can manage their own sessions" ON user_sessions;
+CREATE POLICY "Users can manage their own sessions" ON user_sessions
+    FOR ALL USING (auth.uid()::text = user_id::text OR auth.role() = 'service_role');
+
+CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id);
+CREATE INDEX IF NOT EXISTS idx_events_type_seq ON events(type, seq);
+CREATE INDEX IF NOT EXISTS idx_events_user_seq ON events(user_id, seq);
+
+-- ============================================================
+-- MIGRATION: Audit log indexes
+-- Indexes behind /api/admin/audit. On the partitioned
+-- admin_actions table each index is created on every partition.
+-- ============================================================
+-- admin_actions: /api/admin/audit pages newest first on (timestamp, id),
+-- optionally narrowed to one admin, one target user or some action types
+CREATE INDEX IF NOT EXISTS idx_admin_actions_timestamp ON admin_actions(timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_admin_actions_admin ON admin_actions(admin_user_id, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_admin_actions_target ON admin_actions(target_user_id, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_admin_actions_type ON admin_actions(action_type, timestamp DESC, id DESC);
+
+-- ============================================================
+-- MIGRATION: Deduplicate user_earned_achievements
+-- A badge saved under the key of an achievement the user also
+-- holds is only listed once, as the achievement.
+-- ============================================================
+CREATE OR REPLACE VIEW user_earned_achievements AS
+SELECT ua.user_id,
+       'achievement'::text AS source,
+       a.achievement_key AS badge_name,
+       a.category AS badge_type,
+       a.title,
+       a.description,
+       a.icon,
+       a.badge_color,
+       a.points,
+       a.rarity,
+       ua.earned_at,
+       ua.progress_data
+FROM user_achievements ua
+JOIN achievements a ON a.id = ua.achievement_id
+UNION ALL
+SELECT b.user_id,
+       'badge'::text AS source,
+       b.badge_name,
+       b.badge_type,
+       b.badge_name AS title,
+       NULL::text AS description,
+       NULL::text AS icon,
+       NULL::text AS badge_color,
+       0 AS points,
+       NULL::text AS rarity,
+       b.earned_at,
+       NULL::jsonb AS progress_data
+FROM badges b
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM user_achievements ua
+    JOIN achievements a ON a.id = ua.achievement_id
+    WHERE ua.user_id = b.user_id AND a.achievement_key = b.badge_name
+);
+
+GRANT SELECT ON user_earned_achievements TO service_role;
+
+-- ============================================================
+-- MIGRATION: Re-check task assignments on target changes
+-- Editing a task's room or target_progress re-evaluates every
+-- assignment against user_progress; the completion counter
+-- trigger on task_assignments keeps completed_count in step.
+-- ============================================================
+CREATE OR REPLACE FUNCTION trg_recheck_task_assignments()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE task_assignments ta
+    SET completed_at = CASE WHEN s.done THEN CURRENT_TIMESTAMP END
+    FROM (
+        SELECT a.user_id,
+               COALESCE(up.completed OR COALESCE(up.progress_percentage, 0) >= NEW.target_progress, FALSE) AS done
+        FROM task_assignments a
+        LEFT JOIN user_progress up ON up.user_id = a.user_id AND up.room_name = NEW.room_name
+        WHERE a.task_id = NEW.id
+    ) s
+    WHERE ta.task_id = NEW.id
+      AND ta.user_id = s.user_id
+      AND (ta.completed_at IS NOT NULL) <> s.done;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS recheck_task_assignments_on_target ON teacher_tasks;
+CREATE TRIGGER recheck_task_assignments_on_target
+AFTER UPDATE OF room_name, target_progress ON teacher_tasks
+FOR EACH ROW
+WHEN (OLD.room_name IS DISTINCT FROM NEW.room_name OR OLD.target_progress IS DISTINCT FROM NEW.target_progress)
+EXECUTE FUNCTION trg_recheck_task_assignments();
+
+-- ============================================================
+-- MIGRATION: Commit-safe sync cursors
+-- change_seq is taken at write time, so a transaction can commit
+-- a lower value after a poll has already returned a higher one.
+-- Rows now record the writing transaction, and /api/sync holds
+-- its cursor below any row whose transaction is at or above
+-- commit_horizon(). Existing rows get this migration's id.
+-- ============================================================
+ALTER TABLE users ADD COLUMN IF NOT EXISTS change_xid XID8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE user_progress ADD COLUMN IF NOT EXISTS change_xid XID8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE badges ADD COLUMN IF NOT EXISTS change_xid XID8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE items ADD COLUMN IF NOT EXISTS change_xid XID8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE sync_tombstones ADD COLUMN IF NOT EXISTS change_xid XID8 NOT NULL DEFAULT pg_current_xact_id();
+
+CREATE OR REPLACE FUNCTION trg_bump_change_seq()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF ROW(NEW.*) IS DISTINCT FROM ROW(OLD.*) THEN
+        NEW.change_seq := nextval('change_seq');
+        NEW.change_xid := pg_current_xact_id();
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Oldest transaction still running; readers page below it.
+CREATE OR REPLACE FUNCTION commit_horizon()
+RETURNS BIGINT AS $$
+    SELECT pg_snapshot_xmin(pg_current_snapshot())::TEXT::BIGINT;
+$$ LANGUAGE sql STABLE;
+
+-- ============================================================
+-- MIGRATION: Commit-safe event offsets
+-- Events record the writing transaction like the synced tables,
+-- replacing the timestamp settle window: ts is the transaction
+-- start, so a long transaction's events looked settled as soon as
+-- they committed. Existing events all count as one old
+-- transaction ('1'): a constant default fills them without
+-- rewriting the partitions.
+-- ============================================================
+ALTER TABLE events ADD COLUMN IF NOT EXISTS change_xid XID8 NOT NULL DEFAULT '1'::xid8;
+ALTER TABLE events ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id();
+
+-- ============================================================
+-- MIGRATION: Sync cursors ordered by transaction
+-- A transaction with a lower id can still take a higher change_seq
+-- than one running alongside it, so /api/sync now pages in
+-- (change_xid, change_seq) order below commit_horizon() and its
+-- cursors carry both values.
+-- ============================================================
+DROP INDEX IF EXISTS idx_users_change_seq;
+DROP INDEX IF EXISTS idx_user_progress_change_seq;
+DROP INDEX IF EXISTS idx_badges_change_seq;
+DROP INDEX IF EXISTS idx_items_change_seq;
+DROP INDEX IF EXISTS idx_sync_tombstones_change_seq;
+CREATE INDEX IF NOT EXISTS idx_users_change_xid ON users(change_xid, change_seq);
+CREATE INDEX IF NOT EXISTS idx_user_progress_change_xid ON user_progress(change_xid, change_seq);
+CREATE INDEX IF NOT EXISTS idx_badges_change_xid ON badges(change_xid, change_seq);
+CREATE INDEX IF NOT EXISTS idx_items_change_xid ON items(change_xid, change_seq);
+CREATE INDEX IF NOT EXISTS idx_sync_tombstones_change_xid ON sync_tombstones(change_xid, change_seq);
+
+-- ============================================================
+-- MIGRATION: Event offsets ordered by transaction
+-- Like /api/sync, /api/admin/events now pages in (change_xid, seq)
+-- order below commit_horizon(). Databases that added change_xid
+-- as a nullable column get their NULL events backfilled as the
+-- same old transaction ('1'); elsewhere this touches nothing.
+-- ============================================================
+UPDATE events SET change_xid = '1'::xid8 WHERE change_xid IS NULL;
+ALTER TABLE events ALTER COLUMN change_xid SET NOT NULL;
+
+DROP INDEX IF EXISTS idx_events_type_seq;
+DROP INDEX IF EXISTS idx_events_user_seq;
+CREATE INDEX IF NOT EXISTS idx_events_change_xid ON events(change_xid, seq);
+CREATE INDEX IF NOT EXISTS idx_events_type_xid ON events(type, change_xid, seq);
+CREATE INDEX IF NOT EXISTS idx_events_user_xid ON events(user_id, change_xid, seq);
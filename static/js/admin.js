@@ -682,6 +682,13 @@ const dashboardStats = {
         }
     };
     
+    api.syncChanges = async function(since, tables) {
+        const params = new URLSearchParams({ since, tables: tables.join(',') });
+        return this.request(`/api/sync?${params}`, {
+            headers: { 'X-User-ID': localStorage.getItem('userId') || '' }
+        });
+    };
+    
     api.getBadgesSummary = async function() {
         try {
             const response = await this.request('/api/admin/badges/summary');
@@ -755,6 +762,31 @@ const userManagement = {
         }
     },
 
+    // Cursor from /api/sync; null until the first check has run
+    syncCursor: null,
+
+    // Returns true when users or progress rows changed since the previous check
+    async checkForChanges() {
+        try {
+            let changed = false;
+            let hasMore = true;
+            while (hasMore) {
+                const delta = await api.syncChanges(this.syncCursor || 'head', ['users', 'user_progress']);
+                if (this.syncCursor) {
+                    changed = changed || delta.reset ||
+                        Object.values(delta.changes).some(rows => rows.length > 0) ||
+                        Object.keys(delta.deleted).length > 0;
+                }
+                this.syncCursor = delta.cursor;
+                hasMore = delta.has_more;
+            }
+            return changed;
+        } catch (error) {
+            console.warn('⚠️ Change check failed, reloading users anyway:', error);
+            return true;
+        }
+    },
+
     calculateOverallProgress(userProgress) {
         if (!userProgress || userProgress.length === 0) return 0;
         
@@ -1415,9 +1447,11 @@ class AdminDashboard {
             }
         }, 30000);
 
-        // Refresh user data every 60 seconds when on users page
-        const userRefresh = setInterval(() => {
-            if (this.currentSection === 'users') {
+        // Check for changed users or progress every 60 seconds when on the
+        // users page, and reload the list only when there are any
+        userManagement.checkForChanges();
+        const userRefresh = setInterval(async () => {
+            if (this.currentSection === 'users' && await userManagement.checkForChanges()) {
                 userManagement.loadUsers();
             }
         }, 60000);
@@ -533,6 +533,41 @@ function loadLocalProgress() {
     updateDashboardProgress(defaultProgress);
 }
 
+// Cursor from /api/sync; null until the first check has run
+let dashboardSyncCursor = null;
+
+// Returns true when the user's progress or badges changed since the previous call
+async function syncDashboardChanges() {
+    const userId = localStorage.getItem('userId');
+    if (!userId) return false;
+    try {
+        let changed = false;
+        let hasMore = true;
+        while (hasMore) {
+            const since = dashboardSyncCursor || 'head';
+            const response = await fetch(`/api/sync?tables=user_progress,badges&since=${encodeURIComponent(since)}`, {
+                headers: { 'X-User-ID': userId }
+            });
+            if (!response.ok) {
+                throw new Error(`Sync failed: ${response.status} ${response.statusText}`);
+            }
+            const delta = await response.json();
+            if (dashboardSyncCursor) {
+                changed = changed || delta.reset ||
+                    Object.values(delta.changes).some(rows => rows.length > 0) ||
+                    Object.keys(delta.deleted).length > 0;
+            }
+            dashboardSyncCursor = delta.cursor;
+            hasMore = delta.has_more;
+        }
+        return changed;
+    } catch (error) {
+        // Fall back to a full refresh so a sync failure never hides updates
+        console.warn('⚠️ Change check failed, refreshing anyway:', error);
+        return true;
+    }
+}
+
 // Load and display user badges from database
 async function loadUserBadges() {
     try {
@@ -544,8 +579,10 @@ async function loadUserBadges() {
 
         console.log('🏆 Loading badges for user ID:', userId);
 
-        // Fetch user badges from backend
-        const response = await fetch(`/api/users/${userId}/badges`);
+        // Badges and achievements come back together from one request
+        const response = await fetch('/api/achievements/user', {
+            headers: { 'X-User-ID': userId }
+        });
         
         if (!response.ok) {
             throw new Error(`Failed to load badges: ${response.status} ${response.statusText}`);
@@ -638,8 +675,8 @@ function createBasicBadgeElement(badge, isUnlocked = false) {
     badgeElement.className = `badge-item ${isUnlocked ? 'unlocked' : 'locked'}`;
     
     badgeElement.innerHTML = `
-        <i class="bi-award" style="color: ${isUnlocked ? '#FFD700' : '#666'};"></i>
-        <span>${badge.badge_name}</span>
+        <i class="${badge.icon || 'bi-award'}" style="color: ${isUnlocked ? (badge.badge_color || '#FFD700') : '#666'};"></i>
+        <span>${badge.title || badge.badge_name}</span>
         ${isUnlocked && badge.earned_at ? `<small class="earned-date">Earned ${formatEarnedDate(badge.earned_at)}</small>` : ''}
     `;
     
@@ -1094,10 +1131,14 @@ document.addEventListener('DOMContentLoaded', function() {
     // Load initial progress
     loadUserProgress();
     
-    // Set up periodic refresh every 30 seconds to catch any missed updates
-    setInterval(() => {
-        console.log('🔄 Periodic dashboard refresh...');
-        loadUserProgress();
+    // Every 30 seconds ask the server what changed since the last check and
+    // only reload progress and badges when something did
+    syncDashboardChanges();
+    setInterval(async () => {
+        if (await syncDashboardChanges()) {
+            console.log('🔄 Progress changed, refreshing dashboard...');
+            loadUserProgress();
+        }
     }, 30000);
     
     console.log('User dashboard initialized successfully for:', username);
@@ -160,11 +160,12 @@ class ProgressTracker {
             this.progressCache.set(roomName, updatedProgress);
             this.saveProgressToStorage();
             
-            // Queue for server update
+            // Queue for server update; the key lets the server drop replays of this update
+            const idempotencyKey = this.createIdempotencyKey();
             if (this.isOnline) {
-                await this.syncProgressToServer(roomName, updatedProgress);
+                await this.syncProgressToServer(roomName, updatedProgress, idempotencyKey);
             } else {
-                this.queueProgressUpdate(roomName, updatedProgress);
+                this.queueProgressUpdate(roomName, updatedProgress, idempotencyKey);
             }
             
             // Trigger event for UI updates
@@ -237,12 +238,20 @@ class ProgressTracker {
         return roomNameMap[roomName] || roomName;
     }
     
-    async syncProgressToServer(roomName, progressData) {
+    createIdempotencyKey() {
+        if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+            return window.crypto.randomUUID();
+        }
+        return `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    }
+    
+    async syncProgressToServer(roomName, progressData, idempotencyKey = this.createIdempotencyKey()) {
         try {
             const response = await fetch(`/api/users/${this.currentUser.id}/progress`, {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': idempotencyKey
                 },
                 body: JSON.stringify(progressData)
             });
@@ -264,16 +273,17 @@ class ProgressTracker {
         } catch (error) {
             console.error(`❌ Failed to sync progress for ${roomName}:`, error);
             // Queue for retry
-            this.queueProgressUpdate(roomName, progressData);
+            this.queueProgressUpdate(roomName, progressData, idempotencyKey);
             throw error;
         }
     }
     
-    queueProgressUpdate(roomName, progressData) {
+    queueProgressUpdate(roomName, progressData, idempotencyKey = this.createIdempotencyKey()) {
         // Add to queue for offline sync
         this.updateQueue.push({
             roomName,
             progressData,
+            idempotencyKey,
             timestamp: Date.now()
         });
         
@@ -290,7 +300,7 @@ class ProgressTracker {
         
         for (const update of this.updateQueue) {
             try {
-                await this.syncProgressToServer(update.roomName, update.progressData);
+                await this.syncProgressToServer(update.roomName, update.progressData, update.idempotencyKey);
                 successfulUpdates.push(update);
             } catch (error) {
                 console.error(`Failed to sync queued update for ${update.roomName}:`, error);
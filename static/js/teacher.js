@@ -119,23 +119,39 @@ async function apiFetch(url, options = {}) {
     }
 }
 
+// Students and their per-room progress from the roster endpoint, flattened
+// into the progress-row shape the dashboard views already consume
+async function loadRoster() {
+    const students = [];
+    const progress = [];
+    for (let page = 1; ; page++) {
+        const roster = await apiFetch(`/api/teacher/roster?page=${page}&per_page=200`);
+        if (!roster) return null;
+        roster.students.forEach(s => {
+            students.push(s);
+            Object.entries(s.progress).forEach(([room, p]) => {
+                if (p) progress.push({ ...p, user_id: s.id, user_name: s.name, room_name: room });
+            });
+        });
+        if (!roster.has_more) break;
+    }
+    progress.sort((a, b) => new Date(b.last_accessed || 0) - new Date(a.last_accessed || 0));
+    TeacherDash.allStudents = students;
+    TeacherDash.allProgress = progress;
+    return { students, progress };
+}
+
 // ============================================
 // DASHBOARD OVERVIEW
 // ============================================
 async function loadDashboardOverview() {
     try {
-        const [users, analytics, progressSummary] = await Promise.all([
-            apiFetch('/api/users'),
-            apiFetch('/api/admin/analytics/overview?timeframe=7'),
-            apiFetch('/api/admin/progress/summary')
+        const [roster, analytics] = await Promise.all([
+            loadRoster(),
+            apiFetch('/api/admin/analytics/overview?timeframe=7')
         ]);
-
-        // Filter only regular students
-        const students = (users || []).filter(u =>
-            u.role === 'user' && u.name !== 'admin' && u.name !== 'teacher'
-        );
-        TeacherDash.allStudents = students;
-        TeacherDash.allProgress = progressSummary || [];
+        const students = roster ? roster.students : [];
+        const progressSummary = roster ? roster.progress : [];
 
         // Update stat cards
         document.getElementById('totalStudents').textContent = students.length;
@@ -323,14 +339,7 @@ function renderRecentActivity(progressData) {
 // ============================================
 async function loadStudents() {
     if (!TeacherDash.allStudents.length) {
-        const [users, progressSummary] = await Promise.all([
-            apiFetch('/api/users'),
-            apiFetch('/api/admin/progress/summary')
-        ]);
-        TeacherDash.allStudents = (users || []).filter(u =>
-            u.role === 'user' && u.name !== 'admin' && u.name !== 'teacher'
-        );
-        TeacherDash.allProgress = progressSummary || [];
+        await loadRoster();
     }
     renderStudentsTable(TeacherDash.allStudents);
     updateStudentSummaryBar(TeacherDash.allStudents);
@@ -569,6 +578,7 @@ function renderTaskCards(tasks) {
                     <span class="tag ${diffClass}">${capitalize(meta.difficulty)}</span>
                     ${meta.cooperative ? '<span class="tag tag-coop"><i class="bi bi-people-fill"></i> Coop</span>' : ''}
                     ${!meta.is_active ? '<span class="tag tag-inactive">Inactive</span>' : ''}
+                    ${task.assigned_count ? `<span class="tag tag-room"><i class="bi bi-check2-circle"></i> ${task.completed_count || 0}/${task.assigned_count} done</span>` : ''}
                 </div>
                 <div class="task-card-objectives">${escHtml(meta.objectives || 'No objectives set.')}</div>
             </div>
@@ -602,11 +612,12 @@ function filterTasks() {
 }
 
 function parseTaskMeta(task) {
-    try {
-        return JSON.parse(task.description || '{}');
-    } catch {
-        return {};
-    }
+    return {
+        ...(task.payload || {}),
+        room: task.room_name,
+        difficulty: task.difficulty || 'medium',
+        is_active: task.is_active !== false
+    };
 }
 
 // TASK MODAL
@@ -668,22 +679,19 @@ async function saveTask() {
     if (!title) { showToast('Task title is required.', 'error'); return; }
     if (!objectives) { showToast('Learning objectives are required.', 'error'); return; }
 
-    const roomDisplay = TeacherDash.rooms[room]?.name || room;
-    const description = JSON.stringify({
-        type: 'teacher_task',
-        room,
-        room_display: roomDisplay,
+    const payload = {
+        title,
+        room_name: room,
         difficulty,
-        objectives,
-        instructions,
-        cooperative,
-        critical_thinking: criticalThinking,
-        self_directed: selfDirected,
         is_active: isActive,
-        teacher_task: true
-    });
-
-    const payload = { title, description, user_id: TeacherDash.userId };
+        payload: {
+            objectives,
+            instructions,
+            cooperative,
+            critical_thinking: criticalThinking,
+            self_directed: selfDirected
+        }
+    };
 
     let result;
     if (taskId) {
@@ -723,17 +731,9 @@ async function deleteTask(taskId) {
 // PROGRESS TRACKING
 // ============================================
 async function loadProgressTracking() {
-    const [progressSummary, users] = await Promise.all([
-        apiFetch('/api/admin/progress/summary'),
-        apiFetch('/api/users')
-    ]);
-
-    const students = (users || []).filter(u =>
-        u.role === 'user' && u.name !== 'admin' && u.name !== 'teacher'
-    );
-
-    TeacherDash.allStudents = students;
-    TeacherDash.allProgress = progressSummary || [];
+    const roster = await loadRoster();
+    const students = roster ? roster.students : [];
+    const progressSummary = roster ? roster.progress : [];
 
     // Update stats
     document.getElementById('ptotalStudents').textContent = students.length;